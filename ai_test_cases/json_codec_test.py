@@ -0,0 +1,64 @@
+"""
+# -*- coding:utf-8 -*-
+# @Author: Beck
+# @File: json_codec_test.py
+# @Date: 2026/10/15 16:40
+"""
+
+import json
+
+import pytest
+
+from src.utils import json_codec
+
+# 两种实现都要测试：安装了orjson时测试orjson和标准库json，未安装时只测试标准库json
+_BACKENDS = [None] + ([json_codec.orjson] if json_codec.orjson is not None else [])
+
+
+@pytest.fixture(params=_BACKENDS, ids=lambda backend: 'json' if backend is None else 'orjson')
+def codec(request, monkeypatch):
+    """切换json_codec使用的实现"""
+    monkeypatch.setattr(json_codec, 'orjson', request.param)
+    return json_codec
+
+
+def test_dumps_matches_stdlib_json(codec):
+    """测试序列化结果与标准库json(ensure_ascii=False)的输出一致"""
+    data = {'id': 'TC001', 'title': '登录', 'steps': ['打开页面', '输入账号'], 'priority': 1, 'extra': None}
+    assert codec.dumps(data) == json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+    assert codec.dumps(data, indent=False) == json.dumps(
+        data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def test_dumps_sort_keys(codec):
+    """测试按键排序输出，键顺序不同的字典序列化结果相同"""
+    assert codec.dumps({'b': 1, 'a': 2}, indent=False, sort_keys=True) == b'{"a":2,"b":1}'
+    assert (codec.dumps({'b': 1, 'a': 2}, indent=False, sort_keys=True)
+            == codec.dumps({'a': 2, 'b': 1}, indent=False, sort_keys=True))
+
+
+def test_dumps_default(codec):
+    """测试无法直接序列化的对象交给default转换"""
+    class Model:
+        def model_dump(self):
+            return {'name': '测试'}
+
+    assert codec.loads(codec.dumps({'m': Model()}, default=lambda obj: obj.model_dump())) == {'m': {'name': '测试'}}
+    with pytest.raises(TypeError):
+        codec.dumps({'m': Model()})
+
+
+def test_loads_bytes_and_str(codec):
+    """测试字节串和字符串都可以解析，非法JSON抛出ValueError"""
+    assert codec.loads('{"a": [1, "中文"]}') == {'a': [1, '中文']}
+    assert codec.loads('{"a": [1, "中文"]}'.encode('utf-8')) == {'a': [1, '中文']}
+    with pytest.raises(ValueError):
+        codec.loads('{"a": ')
+
+
+def test_load_file_roundtrip(codec, tmp_path):
+    """测试写出的文件可以原样读回"""
+    data = {'test_cases': [{'id': 'TC001', 'steps': ['步骤1']}], 'count': 1}
+    file_path = tmp_path / 'result.json'
+    file_path.write_bytes(codec.dumps(data))
+    assert codec.load_file(str(file_path)) == data
@@ -0,0 +1,188 @@
+"""
+# -*- coding:utf-8 -*-
+# @Author: Beck
+# @File: llm_cache_test.py
+# @Date: 2026/10/15 16:10
+"""
+import os
+
+from src.utils import llm_cache
+from src.utils.agent_io import AgentIO
+from src.utils.llm_cache import LLMCache, ResultCache, SimilarityCache
+
+
+class _FakeClock:
+    """可手动推进的monotonic时钟，用于测试缓存过期"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_llm_cache_hit_returns_copy():
+    """测试命中缓存时返回副本，修改返回值不影响缓存内容"""
+    cache = LLMCache(maxsize=4, ttl=60)
+    key = cache.cache_key('test_designer', ({'a': 1},))
+    cache.set(key, {'cases': [1, 2]})
+
+    result = cache.get(key)
+    assert result == {'cases': [1, 2]}
+    result['cases'].append(3)
+    assert cache.get(key) == {'cases': [1, 2]}
+    assert cache.stats == {'hits': 2, 'misses': 0}
+
+
+def test_llm_cache_key_depends_on_role_and_message():
+    """测试缓存键由角色和输入内容共同决定，与字典键的顺序无关"""
+    key = LLMCache.cache_key('writer', {'a': 1, 'b': 2})
+    assert key == LLMCache.cache_key('writer', {'b': 2, 'a': 1})
+    assert key != LLMCache.cache_key('designer', {'a': 1, 'b': 2})
+    assert key != LLMCache.cache_key('writer', {'a': 1, 'b': 3})
+
+
+def test_llm_cache_ttl_expiry(monkeypatch):
+    """测试缓存项超过ttl后失效并被删除"""
+    clock = _FakeClock()
+    monkeypatch.setattr(llm_cache.time, 'monotonic', clock)
+    cache = LLMCache(maxsize=4, ttl=10)
+    cache.set('k', 'v')
+
+    clock.now += 9
+    assert cache.get('k') == 'v'
+    clock.now += 2
+    assert cache.get('k') is None
+    assert 'k' not in cache._data
+    assert cache.stats == {'hits': 1, 'misses': 1}
+
+
+def test_llm_cache_lru_eviction():
+    """测试超过maxsize时淘汰最久未使用的项"""
+    cache = LLMCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    # 读取a后，b成为最久未使用的项
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_llm_cache_disabled():
+    """测试maxsize或ttl小于等于0时不缓存"""
+    for cache in (LLMCache(maxsize=0, ttl=60), LLMCache(maxsize=4, ttl=0)):
+        assert not cache.enabled
+        cache.set('k', 'v')
+        assert cache.get('k') is None
+
+
+def test_llm_cache_disabled_by_default():
+    """测试未设置LLM_CACHE_SIZE时默认不启用结果缓存"""
+    assert LLMCache(maxsize=0).enabled is False
+    if not llm_cache.os.getenv('LLM_CACHE_SIZE'):
+        assert not llm_cache.LLM_CACHE.enabled
+
+
+def test_similarity_cache_threshold():
+    """测试只有相似度不低于阈值时才命中缓存"""
+    cache = SimilarityCache(threshold=0.9, maxsize=4)
+    text = "用户登录功能：用户输入用户名和密码后点击登录按钮，系统校验通过后进入首页。"
+    cache.set(text, {'features': ['登录']})
+
+    # 相同文本相似度为1
+    assert cache.get(text) == {'features': ['登录']}
+    # 仅末尾措辞不同的文本相似度高于阈值
+    assert cache.get(text[:-1] + "！") == {'features': ['登录']}
+    # 完全不同的文本不命中
+    assert cache.get("订单导出功能：支持按日期筛选并导出为Excel文件。") is None
+    assert cache.stats == {'hits': 2, 'misses': 1}
+
+
+def test_similarity_cache_exact_threshold_boundary():
+    """测试阈值为1时只有完全相同的文本命中"""
+    cache = SimilarityCache(threshold=1.0, maxsize=4)
+    cache.set("第一份需求文档", 'v')
+    assert cache.get("第一份需求文档") == 'v'
+    assert cache.get("第二份需求文档") is None
+
+
+def test_similarity_cache_returns_best_match():
+    """测试多个结果满足阈值时返回最相似的结果"""
+    cache = SimilarityCache(threshold=0.5, maxsize=4)
+    cache.set("aaaaaaaabbbbbbbb", 'first')
+    cache.set("aaaaaaaabbbbbbbc", 'second')
+    assert cache.get("aaaaaaaabbbbbbbc") == 'second'
+
+
+def test_similarity_cache_lru_eviction():
+    """测试超过maxsize时淘汰最久未使用的项"""
+    cache = SimilarityCache(threshold=0.99, maxsize=2)
+    cache.set("第一份需求文档", 1)
+    cache.set("第二份需求文档", 2)
+    assert cache.get("第一份需求文档") == 1
+    cache.set("第三份需求文档", 3)
+
+    assert cache.get("第二份需求文档") is None
+    assert cache.get("第一份需求文档") == 1
+    assert cache.get("第三份需求文档") == 3
+
+
+def test_similarity_cache_disabled():
+    """测试阈值不在(0, 1]范围内时不启用"""
+    for threshold in (0, -0.5, 1.5):
+        cache = SimilarityCache(threshold=threshold, maxsize=4)
+        assert not cache.enabled
+        cache.set("需求文档", 'v')
+        assert not cache._data
+
+
+def test_result_cache_roundtrip(tmp_path):
+    """测试持久化结果缓存的读写，读取结果为副本"""
+    cache = ResultCache(AgentIO(str(tmp_path)), "test_cache", ttl=60)
+    key = cache.cache_key([{'id': 'TC001'}])
+    assert cache.lookup(key) is None
+
+    cache.update(key, {'reviewed_cases': [{'id': 'TC001'}]})
+    assert (tmp_path / f"test_cache_{key}_result.json").exists()
+    result = cache.lookup(key)
+    assert result == {'reviewed_cases': [{'id': 'TC001'}]}
+    result['reviewed_cases'].clear()
+    assert cache.lookup(key) == {'reviewed_cases': [{'id': 'TC001'}]}
+    assert cache.stats == {'hits': 2, 'misses': 1}
+
+
+def test_result_cache_disabled_by_default(tmp_path):
+    """测试未指定ttl时不缓存也不写入文件"""
+    cache = ResultCache(AgentIO(str(tmp_path)), "test_cache")
+    cache.update('k', 'v')
+    assert cache.lookup('k') is None
+    assert not os.listdir(tmp_path)
+
+
+def test_result_cache_expired_entry_is_deleted(tmp_path, monkeypatch):
+    """测试读取到过期的缓存时返回None并删除缓存文件"""
+    cache = ResultCache(AgentIO(str(tmp_path)), "test_cache", ttl=10)
+    cache.update('k', 'v')
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, 'time', lambda: now + 11)
+
+    assert cache.lookup('k') is None
+    assert not (tmp_path / "test_cache_k_result.json").exists()
+
+
+def test_result_cache_purge_expired(tmp_path):
+    """测试写入缓存时删除同前缀的过期缓存文件，其他文件不受影响"""
+    agent_io = AgentIO(str(tmp_path))
+    cache = ResultCache(agent_io, "test_cache", ttl=10)
+    cache.update('old', 'v')
+    agent_io.save_result("other_old", {'a': 1})
+    old_time = llm_cache.time.time() - 60
+    for name in ("test_cache_old_result.json", "other_old_result.json"):
+        os.utime(tmp_path / name, (old_time, old_time))
+
+    cache.update('new', 'v')
+    assert sorted(os.listdir(tmp_path)) == ["other_old_result.json", "test_cache_new_result.json"]
+    assert cache.lookup('new') == 'v'
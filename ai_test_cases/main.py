@@ -7,15 +7,23 @@
 
 import os
 import sys
-import json
+import functools
 
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 把项目根目录添加到python路径（不添加，Windows环境可能会报错）
+_THIS = os.path.abspath(__file__)
+_PARENT = os.path.dirname(_THIS)
+_GRANDPARENT = os.path.dirname(_PARENT)
+for _p in (_GRANDPARENT, _PARENT):
+    if _p not in sys.path:
+        sys.path.append(_p)
 
 import logging
 import asyncio
+from pathlib import Path
 from typing import Dict, List, Optional
 from src.models.template import Template
-from src.utils.agent_io import AgentIO
+from src.utils.agent_io import AGENT_IO
+from src.utils import json_codec
 
 from src.utils.logger import setup_logger
 from src.services.document_prcessor import DocumentProcessor
@@ -28,16 +36,51 @@ from src.agents.test_case_writer import TestCaseWriterAgent
 from src.agents.quality_assurance import QualityAssuranceAgent
 from src.agents.assistant import AssistantAgent
 
-# 把项目根目录添加到python路径（不添加，Windows环境可能会报错）
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-
 logger = logging.getLogger(__name__)
 
+# 测试用例数量超过该值时分成多个Excel文件导出，避免单个文件过大
+SEGMENT_THRESHOLD = 50_000
+
+# 日志只需配置一次，重复调用setup_logger会给根日志记录器重复添加handler
+_logger_configured = False
+
+
+def _ensure_logger():
+    """确保日志记录器只初始化一次"""
+    global _logger_configured
+    if not _logger_configured:
+        setup_logger()
+        _logger_configured = True
+
+
+@functools.lru_cache(maxsize=32)
+def _load_template_cached(path: str, mtime: float) -> Template:
+    """
+    按(模板路径, 修改时间)缓存解析后的模板，文件未变化时不再重复读取和解析
+    :param path: 模板文件路径
+    :param mtime: 模板文件的修改时间，文件更新后自动失效
+    :return: 模板对象
+    """
+    return Template.from_dict(json_codec.load_file(path))
+
+
+def _as_case_list(data) -> Optional[List]:
+    """
+    将持久化的测试用例结果统一规范为列表
+    :param data: {'test_cases': [...]}、单个测试用例字典或测试用例列表
+    :return: 测试用例列表，格式不正确时返回None
+    """
+    if isinstance(data, dict) and 'test_cases' in data:
+        data = data['test_cases']
+    if isinstance(data, dict):
+        return [data]
+    return data if isinstance(data, list) else None
+
 
 class AITestingSystem:
 
     def __init__(self, concurrent_workers: int = 1):
-        setup_logger()
+        _ensure_logger()
 
         # 初始化服务
         self.doc_processor = DocumentProcessor()
@@ -45,6 +88,7 @@ class AITestingSystem:
         self.export_service = ExportService()
 
         # 初始化agents
+        # agent保存了last_*结果和对话历史等运行状态，每个实例单独创建，避免多个实例之间共享状态
         self.requirement_analyst = RequirementAnalystAgent()
         self.test_designer = TestDesignerAgent()
         self.test_case_writer = TestCaseWriterAgent(concurrent_workers=concurrent_workers)
@@ -53,6 +97,18 @@ class AITestingSystem:
             [self.requirement_analyst, self.test_designer,
              self.test_case_writer, self.quality_assurance]
         )
+        # 按类型索引各个agent，避免每次处理时遍历agents列表做isinstance判断
+        self._agents_by_type = {
+            RequirementAnalystAgent: self.requirement_analyst,
+            TestDesignerAgent: self.test_designer,
+            TestCaseWriterAgent: self.test_case_writer,
+            QualityAssuranceAgent: self.quality_assurance,
+        }
+
+    def close(self) -> None:
+        """等待各agent的后台写入完成并释放其线程池，之后不能再处理需求。"""
+        self.requirement_analyst.close()
+        self.test_case_writer.close()
 
     async def process_requirements(self,
                                    doc_path: str,
@@ -72,7 +128,7 @@ class AITestingSystem:
         try:
             # 处理需求文档
             doc_content = await self.doc_processor.process_document(doc_path)
-            logger.info(f"已处理需求文档：{doc_path}")
+            logger.info("已处理需求文档：%s", doc_path)
 
             # 使用assistant协调工作流程，而不是直接调用各个代理
             task = {
@@ -83,116 +139,51 @@ class AITestingSystem:
 
             try:
                 result = await self.assistant.coordinate_workflow(task)
-                logger.info(f"工作流程协调结果：{result}")
+                logger.info("工作流程协调结果：%s", result)
             except Exception as e:
-                logger.error(f"工作流程协调时出错：{str(e)}")
+                logger.error("工作流程协调时出错：%s", e)
                 return {'status': 'error', 'message': f'工作流程协调错误: {str(e)}'}
 
             # 如果需要修改，返回错误信息
             if result.get("status") == "needs_revison":
-                logger.error(f"需求分析结果需要调整：{result.get('message')}")
+                logger.error("需求分析结果需要调整：%s", result.get('message'))
                 return {'status': 'error', 'message': '需求分析结果需要调整'}
 
-            # 从协调结果中获取各个阶段的结果
-            requirements = None
-            test_strategy = None
-            test_cases = None
-            reviewed_cases = None
-
-            # 初始化AgentIO用于读取各个agent的结果
-            agent_io = AgentIO()
-            from src.agents.test_case_writer import TestCaseWriterAgent
-
-            # 首先尝试从agent示例中获取结果
-            for agent in self.assistant.agents:
-                if isinstance(agent, RequirementAnalystAgent) and hasattr(agent, 'last_analysis'):
-                    requirements = agent.last_analysis
-                elif isinstance(agent, TestDesignerAgent) and hasattr(agent, 'last_design'):
-                    test_strategy = agent.last_design
-                elif isinstance(agent, TestCaseWriterAgent) and hasattr(agent, 'last_cases'):
-                    test_cases = agent.last_cases
-                elif isinstance(agent, QualityAssuranceAgent) and hasattr(agent, 'last_review'):
-                    reviewed_cases = agent.last_review
-
-            # 如果从agent实例中没有获取到结果，尝试从持久化存储中读取
-            if not requirements:
-                requirements = agent_io.load_result("requirement_analyst")
-                logger.info("从持久化存储中加载需求分析结果")
-
-            if not test_strategy:
-                test_strategy = agent_io.load_result("test_designer")
-                logger.info("从持久化存储中加载测试设计结果")
-
-            # 从test_case_writer的持久化存储中加载最终的测试用例
-            test_cases_data = agent_io.load_result("test_case_writer")
-            logger.info("从test_case_writer的持久化存储中加载最终的测试用例")
-
-            # 确保正确提取test_cases字段
-            if isinstance(test_cases_data, dict) and 'test_cases' in test_cases_data:
-                test_cases = test_cases_data['test_cases']
-            else:
-                test_cases = test_cases_data
-
-                # 如果没有获取到任何测试用例，返回错误
+            # 等待后台的测试用例改进完成，确保读取到的是改进后的测试用例
+            await self.assistant.drain()
+            # 等待需求分析结果在后台写盘完成，确保从持久化存储中读取到的是本次的结果
+            await asyncio.to_thread(self.requirement_analyst.flush)
+
+            # 首先尝试从agent实例中获取结果，没有时再从持久化存储中读取
+            requirements = getattr(self._agents_by_type[RequirementAnalystAgent], 'last_analysis', None)
+            test_strategy = getattr(self._agents_by_type[TestDesignerAgent], 'last_design', None)
+
+            # 各结果文件相互独立，放到线程中并发读取，避免阻塞事件循环；实例中已有结果时不读盘
+            async def _or_load(value, name: str):
+                if value:
+                    return value
+                logger.info("从持久化存储中加载%s的结果", name)
+                return await asyncio.to_thread(AGENT_IO.load_result, name)
+
+            # 最终的测试用例总是从test_case_writer的持久化存储中加载
+            requirements, test_strategy, test_cases_data = await asyncio.gather(
+                _or_load(requirements, "requirement_analyst"),
+                _or_load(test_strategy, "test_designer"),
+                _or_load(None, "test_case_writer"),
+            )
+
+            # 确保正确提取test_cases字段，并统一为列表
+            test_cases = _as_case_list(test_cases_data)
+            if test_cases is None and test_cases_data:
+                logger.error("测试用例格式错误：必须是字典或字典列表")
+                return {'status': 'error', 'message': '测试用例格式错误'}
+
+            # 如果没有获取到任何测试用例，返回错误
             if not test_cases:
                 logger.error("没有生成任何测试用例")
                 return {'status': 'error', 'message': '没有生成任何测试用例'}
 
-            # 导出测试用例
-            if output_path and test_cases:
-                # 确保test_cases是列表
-                if isinstance(test_cases, dict):
-                    test_cases = [test_cases]
-
-                elif not isinstance(test_cases, list):
-                    logger.error("测试用例格式错误：必须是字典或字典列表")
-                    return {'status': 'error', 'message': '测试用例格式错误'}
-
-                # 确保输出路径包含.xlsx后缀
-                if not output_path.endswith('.xlsx'):
-                    output_path += '.xlsx'
-
-                # 如果template_path是路径，则从文件加载模板
-                if isinstance(template_path, str):
-                    try:
-                        with open(template_path, 'r', encoding='utf-8') as f:
-                            template_data = json.load(f)
-                        template = Template.from_dict(template_data)
-                    except Exception as e:
-                        logger.error(f"加载模板时出错：{str(e)}")
-                        # 使用默认模板
-                        template = Template(
-                            "Default Template",
-                            "Default test case template"
-                        )
-                else:
-                    # 假设template_path已经是Template对象
-                    template = template_path
-
-                await self.export_service.export_to_excel(
-                    test_cases,
-                    template,
-                    output_path
-                )
-                logger.info(f"测试用例导出成功：{output_path}")
-
-                # 清理测试用例改进过程中生成的临时批次文件
-                try:
-                    # 查找TestCaseWriterAgent实例并调用清理函数
-                    for agent in self.assistant.agents:
-                        if isinstance(agent, TestCaseWriterAgent):
-                            agent.delete_improved_batch_files()
-                            break
-                    else:
-                        # 如果在agents列表中没有找到，创建一个新实例并调用
-                        from src.agents.test_case_writer import TestCaseWriterAgent
-                        writer = TestCaseWriterAgent()
-                        writer.delete_improved_batch_files()
-                        logger.info("已清理测试用例改进过程中生成的临时批次文件")
-                except Exception as e:
-                    logger.warning(f"清理临时批次文件时出错：{str(e)}")
-                    # 继续执行，不影响主流程
-            return {
+            response = {
                 "status": "success",
                 "requirements": requirements,
                 "test_strategy": test_strategy,
@@ -200,14 +191,76 @@ class AITestingSystem:
                 "workflow_result": result
             }
 
+            # 未指定输出路径时只返回内存中的结果，跳过模板加载、导出和临时文件清理
+            if not output_path:
+                return response
+
+            # 导出测试用例
+            # 确保输出路径使用.xlsx后缀；已有其他后缀时追加而不是替换，避免截断文件名中带点的部分（如 v1.2）
+            output_path = Path(output_path)
+            if output_path.suffix.lower() != '.xlsx':
+                output_path = output_path.with_name(output_path.name + '.xlsx')
+
+            # 如果template_path是路径，则从文件加载模板
+            if isinstance(template_path, str):
+                try:
+                    # 模板读取和解析放到线程中执行，避免阻塞事件循环；结果按(路径, 修改时间)缓存
+                    mtime = os.path.getmtime(template_path)
+                    template = await asyncio.to_thread(_load_template_cached, template_path, mtime)
+                except Exception as e:
+                    logger.error("加载模板时出错：%s", e)
+                    # 使用默认模板
+                    template = Template(
+                        "Default Template",
+                        "Default test case template"
+                    )
+            else:
+                # 假设template_path已经是Template对象
+                template = template_path
+
+            # 清理测试用例改进过程中生成的临时批次文件
+            # 清理与导出互不依赖，提交到线程池与导出并行执行
+            cleanup_future = asyncio.get_running_loop().run_in_executor(
+                None, TestCaseWriterAgent.delete_improved_batch_files
+            )
+
+            # 无论导出成功与否都等待清理完成，避免遗留未等待的后台任务
+            try:
+                if len(test_cases) > SEGMENT_THRESHOLD:
+                    # 测试用例过多时分段导出为 xxx_part1.xlsx、xxx_part2.xlsx ...
+                    # 各分段文件互不依赖，在线程中并行写出
+                    chunks = [test_cases[i:i + SEGMENT_THRESHOLD] for i in range(0, len(test_cases), SEGMENT_THRESHOLD)]
+                    part_paths = [output_path.with_stem(f"{output_path.stem}_part{n}") for n in range(1, len(chunks) + 1)]
+                    await asyncio.gather(*(
+                        asyncio.to_thread(self.export_service.export_to_excel_sync, chunk, template, part_path)
+                        for chunk, part_path in zip(chunks, part_paths)
+                    ))
+                    for part_path in part_paths:
+                        logger.info("测试用例分段导出成功：%s", part_path)
+                else:
+                    await self.export_service.export_to_excel(
+                        test_cases,
+                        template,
+                        output_path
+                    )
+                    logger.info("测试用例导出成功：%s", output_path)
+            finally:
+                try:
+                    await cleanup_future
+                except Exception as e:
+                    logger.warning("清理临时批次文件时出错：%s", e)
+                    # 继续执行，不影响主流程
+            return response
+
 
         except Exception as e:
-            logger.error(f"处理需求时出错：{e}")
+            logger.error("处理需求时出错：%s", e)
             raise
 
 async def main():
     # 使用命令行参数解析器获取参数
     from src.utils.cli_parser import get_cli_args
+    system = None
     try:
         args = get_cli_args()
 
@@ -237,6 +290,18 @@ async def main():
             python src/main.py -d docs/需求文档.pdf -t functional -o test_cases.xlsx
         """
         print(usage)
+    finally:
+        if system is not None:
+            system.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # 安装了uvloop时使用其事件循环（Windows不支持，未安装时使用默认事件循环）
+    try:
+        import uvloop
+    except ImportError:
+        uvloop = None
+
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
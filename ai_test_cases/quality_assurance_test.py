@@ -0,0 +1,54 @@
+"""
+# -*- coding:utf-8 -*-
+# @Author: Beck
+# @File: quality_assurance_test.py
+# @Date: 2026/10/15 16:50
+"""
+
+from src.agents.quality_assurance import QualityAssuranceAgent
+from src.utils import json_codec
+
+
+def _case(case_id: str, size: int) -> dict:
+    """构造序列化长度随size增长的测试用例"""
+    return {'id': case_id, 'steps': ['步' * size]}
+
+
+def _batch_loads(test_cases, batches):
+    """计算各批次测试用例的序列化总长度"""
+    return [sum(len(json_codec.dumps(test_cases[i], default=str, indent=False)) for i in batch) for batch in batches]
+
+
+def test_balance_batches_covers_every_case_once():
+    """测试每个测试用例恰好分到一个批次，批次内保持原有顺序"""
+    test_cases = [_case(f'TC{i:03d}', size) for i, size in enumerate([5, 80, 3, 40, 40, 7, 1, 60])]
+    batches = QualityAssuranceAgent._balance_batches(test_cases, 3)
+
+    assert len(batches) == 3
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(test_cases)))
+    assert all(batch == sorted(batch) for batch in batches)
+
+
+def test_balance_batches_balances_by_size():
+    """测试大用例分散到不同批次，各批次总长度比按数量均分时更接近"""
+    # 两个大用例相邻，按数量均分时会落在同一个批次
+    test_cases = [_case('TC001', 200), _case('TC002', 200), _case('TC003', 10), _case('TC004', 10)]
+    batches = QualityAssuranceAgent._balance_batches(test_cases, 2)
+
+    assert [0, 1] not in batches
+    balanced = _batch_loads(test_cases, batches)
+    naive = _batch_loads(test_cases, [[0, 1], [2, 3]])
+    assert max(balanced) - min(balanced) < max(naive) - min(naive)
+
+
+def test_balance_batches_fewer_cases_than_batches():
+    """测试用例数少于批次数时不产生空批次"""
+    test_cases = [_case('TC001', 1), _case('TC002', 2)]
+    batches = QualityAssuranceAgent._balance_batches(test_cases, 5)
+    assert sorted(batches) == [[0], [1]]
+
+
+def test_balance_batches_single_batch():
+    """测试只有一个批次时包含全部测试用例"""
+    test_cases = [_case(f'TC{i:03d}', i) for i in range(5)]
+    assert QualityAssuranceAgent._balance_batches(test_cases, 1) == [[0, 1, 2, 3, 4]]
@@ -0,0 +1,212 @@
+"""
+# -*- coding:utf-8 -*-
+# @Author: Beck
+# @File: requirement_analyst_test.py
+# @Date: 2026/10/15 17:00
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from src.agents.requirement_analyst import RequirementAnalystAgent
+from src.utils.agent_io import AgentIO
+from src.utils.llm_cache import ResultCache
+
+# 代理返回的文本格式消息，以及改为单次遍历前逐部分提取的结果，测试场景为(id, description)
+_MARKDOWN_MESSAGE = """### 1. 功能需求
+1. 系统应支持用户登录
+2. 用户需要能够修改密码
+- 管理员可以导出用户列表
+### 2. 非功能需求
+- 响应时间小于2秒
+2、 安全性要求高
+**粗体**
+### 3. 测试场景
+1. 正常登录场景
+- 异常密码场景
+### 4. 风险领域
+- 数据泄露
+1) 并发冲突
+5. 其他
+- 不应出现
+"""
+_SECTION_SAMPLES = [
+    (_MARKDOWN_MESSAGE, {
+        'functional_requirements': ['系统应支持用户登录', '用户需要能够修改密码', '管理员可以导出用户列表',
+                                    '响应时间小于2秒', '安全性要求高', '*粗体**'],
+        'non_functional_requirements': ['响应时间小于2秒', '安全性要求高', '*粗体**'],
+        'test_scenarios': [('TS001', '正常登录场景'), ('TS002', '异常密码场景')],
+        'risk_areas': ['数据泄露', '并发冲突'],
+    }),
+    ("功能需求：\n  提供导出功能\n非功能需求:\n 性能稳定可靠\n测试场景：\n场景A\n风险领域:\n风险B\n", {
+        'functional_requirements': ['提供导出功能', '性能稳定可靠'],
+        'non_functional_requirements': ['性能稳定可靠'],
+        'test_scenarios': [('TS001', '需要提供具体的测试场景')],
+        'risk_areas': [],
+    }),
+    ("无结构文本\n第二行", {
+        'functional_requirements': ['需要提供具体的功能需求'],
+        'non_functional_requirements': [],
+        'test_scenarios': [('TS001', '需要提供具体的测试场景')],
+        'risk_areas': [],
+    }),
+    # ①、²等Unicode数字编号与阿拉伯数字编号一样去除
+    ("### 2. 非功能需求\n①、支持批量上传\n²、x响应时间小于2秒\n### 3. 测试场景\n①、正常上传场景\n② 异常文件场景\n"
+     "### 4. 风险领域\n①、数据丢失\n5. 其他\n", {
+        'functional_requirements': ['①、支持批量上传', '²、x响应时间小于2秒'],
+        'non_functional_requirements': ['支持批量上传', 'x响应时间小于2秒'],
+        'test_scenarios': [('TS001', '正常上传场景'), ('TS002', '② 异常文件场景')],
+        'risk_areas': ['数据丢失'],
+    }),
+    ("feature list\n- support export\n测试场景: x\n- 场景一\n- 场景二\n风险领域：\n- r1\n\x01\n- r2", {
+        'functional_requirements': ['support export'],
+        'non_functional_requirements': [],
+        'test_scenarios': [('TS001', '需要提供具体的测试场景')],
+        'risk_areas': ['r1', 'r2'],
+    }),
+]
+
+
+def _scenario_pairs(result):
+    """将测试场景转换为(id, description)，便于比较"""
+    return dict(result, test_scenarios=[(s.id, s.description) for s in result['test_scenarios']])
+
+
+@pytest.fixture
+def analyst(tmp_path):
+    """结果文件和分析缓存写入临时目录的需求分析代理"""
+    agent = RequirementAnalystAgent()
+    agent.agent_io = AgentIO(str(tmp_path))
+    agent.analysis_cache = ResultCache(agent.agent_io, "ra_cache", ttl=60)
+    yield agent
+    agent.close()
+
+
+@pytest.mark.parametrize('message, expected', _SECTION_SAMPLES)
+def test_extract_all_sections_matches_per_section_extraction(message, expected):
+    """测试单次遍历提取的结果与逐部分遍历提取的结果一致"""
+    agent = RequirementAnalystAgent.__new__(RequirementAnalystAgent)
+    assert _scenario_pairs(agent._extract_all_sections(message)) == expected
+
+
+def test_extract_all_sections_drops_short_fragments():
+    """测试功能需求中过短的片段和以冒号结尾的小标题被过滤"""
+    agent = RequirementAnalystAgent.__new__(RequirementAnalystAgent)
+    result = agent._extract_all_sections("功能需求\n- 短\n- 登录模块：\n- 系统应支持用户登录\n")
+    assert result['functional_requirements'] == ['系统应支持用户登录']
+
+
+def test_extract_all_sections_empty_message():
+    """测试空消息返回默认的功能需求和测试场景"""
+    agent = RequirementAnalystAgent.__new__(RequirementAnalystAgent)
+    assert _scenario_pairs(agent._extract_all_sections('')) == {
+        'functional_requirements': ['需要提供具体的功能需求'],
+        'non_functional_requirements': [],
+        'test_scenarios': [('TS001', '需要提供具体的测试场景')],
+        'risk_areas': [],
+    }
+
+
+def _analysis(functional, scenario=None, doc_index=None):
+    """构造一个文档的分析结果"""
+    result = {
+        'functional_requirements': [functional],
+        'non_functional_requirements': ['响应时间小于2秒'],
+        'test_scenarios': [{'id': 'TS001', 'description': scenario or functional, 'test_cases': []}],
+        'risk_areas': ['数据泄露'],
+    }
+    if doc_index is not None:
+        result['doc_index'] = doc_index
+    return result
+
+
+def test_analyze_batch_single_request(analyst):
+    """测试多个文档合并为一次LLM调用，结果按doc_index对应文档，空文档返回默认结果"""
+    messages = []
+    response = json.dumps({'results': [_analysis('B功能', doc_index=1), _analysis('A功能', doc_index=0)]},
+                          ensure_ascii=False)
+    analyst._chat = lambda message: messages.append(message) or response
+
+    results = analyst.analyze_batch(['文档A', '', '文档B'])
+
+    assert len(messages) == 1
+    assert '---DOC 0---\n文档A' in messages[0] and '---DOC 1---\n文档B' in messages[0]
+    assert [r['functional_requirements'] for r in results] == [['A功能'], ['需要提供具体的功能需求'], ['B功能']]
+    assert results[2]['test_scenarios'][0].description == 'B功能'
+    assert analyst.last_analysis is results[-1]
+
+
+def test_analyze_batch_falls_back_to_analyze(analyst):
+    """测试批量响应中缺少的文档单独调用analyze补充分析"""
+    responses = iter([
+        json.dumps({'results': [_analysis('A功能')]}, ensure_ascii=False),
+        json.dumps(_analysis('B功能'), ensure_ascii=False),
+    ])
+    messages = []
+    analyst._chat = lambda message: messages.append(message) or next(responses)
+
+    results = analyst.analyze_batch(['文档A', '文档B'])
+
+    assert len(messages) == 2
+    assert '文档B' in messages[1] and '文档A' not in messages[1]
+    assert [r['functional_requirements'] for r in results] == [['A功能'], ['B功能']]
+
+
+def test_analyze_batch_uses_cache(analyst):
+    """测试已缓存的文档不再发送给LLM，只有一个未命中的文档时直接调用analyze"""
+    analyst.analysis_cache.update(analyst.analysis_cache.cache_key('文档A'), _analysis('A功能'))
+    messages = []
+    response = json.dumps(_analysis('B功能'), ensure_ascii=False)
+    analyst._chat = lambda message: messages.append(message) or response
+
+    results = analyst.analyze_batch(['文档A', '文档B'])
+
+    assert len(messages) == 1
+    assert '---DOC' not in messages[0]
+    assert [r['functional_requirements'] for r in results] == [['A功能'], ['B功能']]
+
+
+def test_analysis_cache_disabled_by_default(monkeypatch):
+    """测试未设置RA_CACHE_TTL时不启用分析缓存"""
+    monkeypatch.delenv('RA_CACHE_TTL', raising=False)
+    agent = RequirementAnalystAgent()
+    try:
+        assert agent.analysis_cache.ttl <= 0
+    finally:
+        agent.close()
+
+
+def test_analysis_cache_evicts_expired_entry(analyst, monkeypatch):
+    """测试过期的分析缓存不再命中，并删除缓存文件"""
+    key = analyst.analysis_cache.cache_key('文档A')
+    analyst.analysis_cache.update(key, _analysis('A功能'))
+    cache_file = os.path.join(analyst.agent_io.output_dir, f"ra_cache_{key}_result.json")
+    assert os.path.exists(cache_file)
+
+    monkeypatch.setattr(analyst.analysis_cache, 'ttl', 0.001)
+    time.sleep(0.01)
+    assert analyst.analysis_cache.lookup(key) is None
+    assert not os.path.exists(cache_file)
+
+    # 缓存过期后重新调用LLM分析
+    response = json.dumps(_analysis('新的A功能'), ensure_ascii=False)
+    analyst._chat = lambda message: response
+
+    assert analyst.analyze('文档A')['functional_requirements'] == ['新的A功能']
+
+
+def test_background_save_writes_snapshot(analyst):
+    """测试后台保存的是提交时的结果，调用方随后修改返回的结果不影响写入的内容"""
+    response = json.dumps(_analysis('A功能'), ensure_ascii=False)
+    analyst._chat = lambda message: response
+
+    result = analyst.analyze('文档A')
+    result['functional_requirements'].append('调用方追加的内容')
+    analyst.flush()
+
+    saved = analyst.agent_io.load_result('requirement_analyst')
+    assert saved['functional_requirements'] == ['A功能']
+    assert analyst.analysis_cache.lookup(analyst.analysis_cache.cache_key('文档A'))['functional_requirements'] == ['A功能']
@@ -4,43 +4,145 @@
 # @File: assistant.py
 # @Date: 2025/8/28 11:17
 """
-import json
-
+import asyncio
 import logging
 import os
 import re
-from typing import Dict, List
+from itertools import chain
+from typing import AsyncIterator, Dict, List
 
 import autogen
 from dotenv import load_dotenv
-
-from src.schemas.communication import TestCase
+from pydantic import TypeAdapter
+
+from src.schemas.communication import (
+    TestCase, RequirementAnalysisRequest, RequirementAnalysisResponse,
+    TestDesignRequest, TestDesignResponse, TestCaseWriteRequest,
+    TestCaseWriteResponse, QualityAssuranceRequest, QualityAssuranceResponse,
+    ErrorResponse, TestScenario
+)
 from .requirement_analyst import RequirementAnalystAgent
 from .test_designer import TestDesignerAgent
 from .test_case_writer import TestCaseWriterAgent
 from .quality_assurance import QualityAssuranceAgent
 from src.utils.json_parser import UnifiedJSONParser
+from src.utils.agent_io import AGENT_IO
+from src.utils.llm_cache import LLM_CACHE, SIMILARITY_CACHE
+from src.utils import json_codec
 
 
 
 load_dotenv()  # 加载环境变量
 logger = logging.getLogger(__name__)  # 获取日志记录器
 
+# 批量校验测试场景和测试用例列表，避免逐个构造模型
+_TEST_SCENARIOS_ADAPTER = TypeAdapter(List[TestScenario])
+_TEST_CASES_ADAPTER = TypeAdapter(List[TestCase])
+
+# 工作流程各阶段：(阶段名, 代理类型)
+_PHASES = (
+    ('需求分析', RequirementAnalystAgent),
+    ('测试设计', TestDesignerAgent),
+    ('测试用例编写', TestCaseWriterAgent),
+    ('质量保证', QualityAssuranceAgent),
+)
+_PHASE_NAMES = tuple(phase for phase, _ in _PHASES)
+# 按下标读取当前阶段，所有阶段完成后为'completed'
+_CURRENT_PHASE_NAMES = _PHASE_NAMES + ('completed',)
+
+# 需求分析结果为空时使用的默认分析结果，预先序列化，使用时反序列化得到新的副本
+_DEFAULT_ANALYSIS_JSON = json_codec.dumps({
+    'functional_requirements': ["支持PDF和图片格式的文件上传", "支持批量拖动文件或点击批量文件上传",
+                                "后台任务执行完毕后可以查看整理结果", "下载整理结果为Word格式输出"],
+    'non_functional_requirements': ["上传文件后有状态标记和失败提示弹窗",
+                                    "查看结果时支持多表格展示及在线文档形式展示",
+                                    "通过AI识别提取资质证照内容并自动摘录成表格",
+                                    "溯源功能支持在提取内容中展示来源图片"],
+    'test_scenarios': [
+        {
+            'id': "TS001",
+            'description': "测试文件上传功能，包括pdf和图片格式的单个及批量上传",
+            'test_cases': []
+        },
+        {
+            'id': "TS002",
+            'description': "验证整理结果展示的正确性和多表格展示功能",
+            'test_cases': []
+        },
+        {
+            'id': "TS003",
+            'description': "测试溯源功能中的来源图片展示是否准确",
+            'test_cases': []
+        },
+        {
+            'id': "TS004",
+            'description': "检查下载结果的文件格式和命名是否符合要求",
+            'test_cases': []
+        }
+    ],
+    'risk_areas': ["文件上传失败可能导致用户体验不佳", "AI识别提取的准确性可能影响整理结果的质量",
+                   "多表格展示可能存在样式不一致问题", "溯源功能的性能可能影响系统响应速度"]
+}, indent=False)
+
+# 协调结果消息中的段落标题及其列表项对应的结果字段（当前阶段没有列表项）
+_SECTION_RE = re.compile(r'当前阶段|已分配任务|已完成任务|下一步')
+_BULLET_RE = re.compile(r'\s*-\s*(.*?)\s*$')
+_SECTION_FIELDS = {
+    '当前阶段': None,
+    '已分配任务': 'assigned_tasks',
+    '已完成任务': 'completed_tasks',
+    '下一步': 'next_steps',
+}
+
+# 去除LLM响应中包裹JSON的```json代码块标记
+_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$', re.MULTILINE)
+
 api_key = os.getenv("LLM_KEY")
 base_url = os.getenv("BASE_URL")
 model = os.getenv("LLM_MODEL")
 
+# LLM配置只依赖环境变量，模块加载时构建一次，所有协调代理共用
+_CONFIG_LIST = [
+    {
+        "model": model,
+        "api_key": api_key,
+        "base_url": base_url,
+    }
+]
+
+
+def _summarize(obj, max_len: int = 512) -> str:
+    """
+    生成用于日志的摘要，超过长度的部分截断并注明剩余字符数
+    :param obj: 要记录的对象
+    :param max_len: 保留的最大字符数
+    :return: 摘要字符串
+    """
+    text = obj if isinstance(obj, str) else repr(obj)
+    if len(text) <= max_len:
+        return text
+    return f"{text[:max_len]}...<{len(text) - max_len} more chars>"
+
+
+def _log_result(title: str, result) -> None:
+    """
+    记录代理的执行结果，只有INFO级别开启时才序列化结果，过长的结果截断记录
+    :param title: 日志标题
+    :param result: 结果字典或pydantic模型
+    :return:
+    """
+    if logger.isEnabledFor(logging.INFO):
+        if hasattr(result, 'model_dump'):
+            result = result.model_dump()
+        logger.info("%s，结果: %s", title,
+                    _summarize(json_codec.dumps(result, default=str, indent=False).decode('utf-8')))
+
 
 class AssistantAgent:
     def __init__(self, agents: List):
         """初始化协调代理"""
-        self.config_list = [
-            {
-                "model": model,
-                "api_key": api_key,
-                "base_url": base_url,
-            }
-        ]
+        # 协调代理保存各自的对话历史，不能在多个实例之间共享，这里只复用LLM配置
+        self.config_list = _CONFIG_LIST
         self.agent = autogen.AssistantAgent(
             name="coordinator",
             system_message="""你是一位项目协调员，负责管理不同测试代理之间的交互，
@@ -48,12 +150,75 @@ class AssistantAgent:
             llm_config={"config_list": self.config_list}
         )
 
+        # 任务提供者代理在多次工作流程之间复用，每次开始时重置对话状态
+        self.user_proxy = autogen.UserProxyAgent(
+            name="user_proxy",
+            system_message="任务提供者",
+            human_input_mode="NEVER",
+            code_execution_config={"use_docker": False}
+        )
+
         self.agents = agents
+        # 按类型和角色名索引各个代理，避免每次查找时线性遍历agents列表
+        self._agents_by_type = {}
+        for agent in agents:
+            for _, cls in _PHASES:
+                if isinstance(agent, cls):
+                    self._agents_by_type.setdefault(cls, agent)
+                    break
+        self._agents_by_role = {
+            'requirement_analyst': self._agents_by_type.get(RequirementAnalystAgent),
+            'test_designer': self._agents_by_type.get(TestDesignerAgent),
+            'test_case_writer': self._agents_by_type.get(TestCaseWriterAgent),
+            'quality_assurance': self._agents_by_type.get(QualityAssuranceAgent),
+        }
         # 初始化统一的JSON解析器
-        self.json_parse = UnifiedJSONParser()
+        self.json_parser = UnifiedJSONParser()
+        # 各代理结果的读写共用同一个AgentIO实例
+        self._agent_io = AGENT_IO
+        # 代理执行结果缓存，相同输入不再重复调用LLM
+        self.llm_cache = LLM_CACHE
+        # 需求分析的相似度缓存，内容相近的需求文档复用之前的分析结果
+        self.similarity_cache = SIMILARITY_CACHE
+        # 正在后台执行的任务
+        self._pending_tasks = set()
+        # 各阶段的完成状态，在工作流程中随阶段完成更新
+        self._phase_state = {}
+        self._completed_phases = 0
+        self._current_phase_idx = 0
+        self._reset_phase_state()
 
     async def coordinate_workflow(self, task: dict) -> dict:
-        """协调不同代理之间的工作流程。"""
+        """协调不同代理之间的工作流程，返回最终的协调结果。"""
+        result = None
+        async for event in self.coordinate_workflow_stream(task):
+            if event['phase'] == 'result':
+                result = event['data']
+        return result
+
+    def _reset_phase_state(self) -> None:
+        """将所有阶段重置为未开始"""
+        self._phase_state = {phase: {'status': 'pending', 'completion': 0} for phase in _PHASE_NAMES}
+        self._completed_phases = 0
+        # 第一个未完成阶段在_PHASE_NAMES中的下标，全部完成时指向末尾的'completed'
+        self._current_phase_idx = 0
+
+    def _mark_phase_completed(self, phase: str) -> None:
+        """标记阶段已完成，并将当前阶段推进到下一个未完成的阶段"""
+        if self._phase_state[phase]['status'] == 'completed':
+            return
+        self._phase_state[phase] = {'status': 'completed', 'completion': 100}
+        self._completed_phases += 1
+        while (self._current_phase_idx < len(_PHASE_NAMES)
+               and self._phase_state[_PHASE_NAMES[self._current_phase_idx]]['status'] == 'completed'):
+            self._current_phase_idx += 1
+
+    async def coordinate_workflow_stream(self, task: dict) -> AsyncIterator[dict]:
+        """协调不同代理之间的工作流程，每个阶段完成后立即产出该阶段的结果。
+
+        产出的事件格式为{'phase': 阶段名, 'data': 阶段结果}，阶段名依次为
+        requirements、design、test_cases、review，最后一个事件的阶段名为result，data为最终的协调结果。
+        """
         try:
             # 验证任务参数
             if not isinstance(task, dict):
@@ -62,17 +227,25 @@ class AssistantAgent:
             if not task.get('name') or not task.get('description'):
                 raise ValueError("任务参数必须包含name和description字段")
 
-            user_proxy = autogen.UserProxyAgent(
-                name="user_proxy",
-                system_message="任务提供者",
-                human_input_mode="NEVER",
-                code_execution_config={"use_docker": False}
-            )
+            self._reset_phase_state()
+
+            # 复用实例上的user_proxy，开始新的工作流程前清空上一次的对话历史
+            user_proxy = self.user_proxy
+            user_proxy.reset()
+            self.agent.reset()
+
+            # 1. 需求分析
+            requirement_analyst = self._agents_by_type.get(RequirementAnalystAgent)
+            if not requirement_analyst:
+                raise ValueError("找不到需求分析代理")
+
+            # 执行需求分析并获取结果
+            analysis_task = self._analyze_requirements(task['description'])
 
             # 开始协调
-            try:
-                # 使用异步方式调用initiate_chat
-                await user_proxy.a_initiate_chat(
+            # 协调对话的结果不参与后续流程，与需求分析并发执行，避免多等待一次LLM往返
+            chat_result, analysis_outcome = await asyncio.gather(
+                user_proxy.a_initiate_chat(
                     self.agent,
                     message=f"""
                     协调以下测试任务：
@@ -86,95 +259,68 @@ class AssistantAgent:
 
                     请立即开始执行需求分析阶段，无需等待进一步确认。""",
                     max_turns=1  # 限制对话轮次为1，避免死循环
-                )
-            except Exception as e:
-                logger.error(f"初始化对话错误: {str(e)}")
+                ),
+                analysis_task,
+                return_exceptions=True
+            )
+            if isinstance(chat_result, Exception):
+                logger.error(f"初始化对话错误: {str(chat_result)}")
                 # 即使初始化对话失败，我们也继续执行后续步骤
+            if isinstance(analysis_outcome, Exception):
+                raise analysis_outcome
 
             # 记录协调开始
             logger.info("开始协调测试任务流程")
 
-            # 1. 需求分析
-            requirement_analyst = next((agent for agent in self.agents if isinstance(agent, RequirementAnalystAgent)),
-                                       None)
-            if not requirement_analyst:
-                raise ValueError("找不到需求分析代理")
-            # 执行需求分析并获取结果
-            self._handle_agent_communication(
-                'coordinator',
-                'requirement_analyst',
-                {'doc_content': task['description']}
-            )
             # 直接从代理实例获取最新分析结果
             analysis_result = requirement_analyst.last_analysis
 
             # 如果分析结果为None，创建一个默认的分析结果
             if analysis_result is None:
-                analysis_result = {
-                    'functional_requirements': ["支持PDF和图片格式的文件上传", "支持批量拖动文件或点击批量文件上传",
-                                                "后台任务执行完毕后可以查看整理结果", "下载整理结果为Word格式输出"],
-                    'non_functional_requirements': ["上传文件后有状态标记和失败提示弹窗",
-                                                    "查看结果时支持多表格展示及在线文档形式展示",
-                                                    "通过AI识别提取资质证照内容并自动摘录成表格",
-                                                    "溯源功能支持在提取内容中展示来源图片"],
-                    'test_scenarios': [
-                        {
-                            'id': "TS001",
-                            'description': "测试文件上传功能，包括pdf和图片格式的单个及批量上传",
-                            'test_cases': []
-                        },
-                        {
-                            'id': "TS002",
-                            'description': "验证整理结果展示的正确性和多表格展示功能",
-                            'test_cases': []
-                        },
-                        {
-                            'id': "TS003",
-                            'description': "测试溯源功能中的来源图片展示是否准确",
-                            'test_cases': []
-                        },
-                        {
-                            'id': "TS004",
-                            'description': "检查下载结果的文件格式和命名是否符合要求",
-                            'test_cases': []
-                        }
-                    ],
-                    'risk_areas': ["文件上传失败可能导致用户体验不佳", "AI识别提取的准确性可能影响整理结果的质量",
-                                   "多表格展示可能存在样式不一致问题", "溯源功能的性能可能影响系统响应速度"]
-                }
+                analysis_result = json_codec.loads(_DEFAULT_ANALYSIS_JSON)
+
+            if requirement_analyst.last_analysis:
+                self._mark_phase_completed('需求分析')
+            yield {'phase': 'requirements', 'data': analysis_result}
 
             # 监控进度
             self._monitor_progress()
 
             # 等待需求分析结果确认
-            try:
-                # 使用异步方式调用initiate_chat
-                await user_proxy.a_initiate_chat(
-                    self.agent,
-                    message=f"""
-                    需求分析结果如下：
-                    {analysis_result}
-
-                    请确认需求分析结果是否正确。
-                    如果正确，请回复"正确"，我们将继续进行测试设计和用例编写。
-                    如果需要调整，请提供具体的修改建议。
-
-                    注意：如果没有收到明确回复，系统将默认结果正确并继续执行。
-                    """,
-                    max_turns=1  # 限制对话轮次为1，避免死循环
-                )
-            except Exception as e:
-                logger.error(f"确认需求分析结果错误: {str(e)}")
-                # 即使确认失败，我们也继续执行后续步骤
+            # 确认对话只在需要人工确认时进行，否则回复总会被视为确认，省去一次LLM往返
+            if task.get('require_human_confirmation'):
+                try:
+                    # 使用异步方式调用initiate_chat
+                    await user_proxy.a_initiate_chat(
+                        self.agent,
+                        message=f"""
+                        需求分析结果如下：
+                        {analysis_result}
+
+                        请确认需求分析结果是否正确。
+                        如果正确，请回复"正确"，我们将继续进行测试设计和用例编写。
+                        如果需要调整，请提供具体的修改建议。
+
+                        注意：如果没有收到明确回复，系统将默认结果正确并继续执行。
+                        """,
+                        max_turns=1  # 限制对话轮次为1，避免死循环
+                    )
+                except Exception as e:
+                    logger.error(f"确认需求分析结果错误: {str(e)}")
+                    # 即使确认失败，我们也继续执行后续步骤
 
-            # 检查确认结果
-            confirmation = user_proxy.last_message()
-            logger.info(f"用户确认消息: {confirmation}")
+                # 检查确认结果
+                confirmation = user_proxy.last_message()
+                logger.info(f"用户确认消息: {confirmation}")
+            else:
+                confirmation = None
+                logger.info("无需人工确认，跳过需求分析结果确认对话")
 
             # 如果用户明确表示需要调整，则返回需要修改的状态
             if confirmation and ('需要调整' in confirmation or '不正确' in confirmation):
                 logger.info("需求分析结果需要调整")
-                return {'status': 'needs_revision', 'message': confirmation}
+                yield {'phase': 'result', 'data': {'status': 'needs_revision', 'message': confirmation}}
+                return
 
             # 如果用户明确表示正确或请求开始设计/编写测试用例，或者消息为空，则继续执行
             # 空消息表示自动回复，我们将其视为确认
@@ -187,10 +333,10 @@ class AssistantAgent:
             # 不再需要额外的确认对话，直接继续执行后续步骤
 
             # 2. 测试设计
-            test_designer = next((agent for agent in self.agents if isinstance(agent, TestDesignerAgent)), None)
+            test_designer = self._agents_by_type.get(TestDesignerAgent)
             if not test_designer:
                 raise ValueError("找不到测试设计代理")
-            design_result = self._handle_agent_communication(
+            design_result = await self._handle_agent_communication(
                 'requirement_analyst',
                 'test_designer',
                 {
@@ -199,25 +345,30 @@ class AssistantAgent:
                 }
             )
 
+            if design_result:
+                self._mark_phase_completed('测试设计')
+            yield {'phase': 'design', 'data': design_result}
+
             # 监控进度
             self._monitor_progress()
 
             # 检查测试设计结果是否为空
             if not design_result or (isinstance(design_result, dict) and not any(design_result.values())):
                 logger.warning("测试设计结果为空，流程结束")
-                return {
+                yield {'phase': 'result', 'data': {
                     "status": "completed",
                     "message": "测试设计结果为空，流程结束",
                     "requirements": analysis_result,
                     "test_strategy": None,
                     "test_cases": None
-                }
+                }}
+                return
 
             # 3. 测试用例编写
-            test_case_writer = next((agent for agent in self.agents if isinstance(agent, TestCaseWriterAgent)), None)
+            test_case_writer = self._agents_by_type.get(TestCaseWriterAgent)
             if not test_case_writer:
                 raise ValueError("找不到测试用例编写代理")
-            test_cases = self._handle_agent_communication(
+            test_cases = await self._handle_agent_communication(
                 'test_designer',
                 'test_case_writer',
                 {'test_strategy': design_result}
@@ -226,22 +377,27 @@ class AssistantAgent:
             # 检查测试用例生成结果
             if test_cases is None:
                 logger.warning("测试用例生成失败，因为测试策略无效，流程终止")
-                return {
+                yield {'phase': 'result', 'data': {
                     "status": "completed",
                     "message": "测试策略无效，流程终止",
                     "requirements": analysis_result,
                     "test_strategy": design_result,
                     "test_cases": None
-                }
+                }}
+                return
+
+            if test_cases:
+                self._mark_phase_completed('测试用例编写')
+            yield {'phase': 'test_cases', 'data': test_cases}
 
             # 监控进度
             self._monitor_progress()
 
             # 4. 质量保证
-            quality_assurance = next((agent for agent in self.agents if isinstance(agent, QualityAssuranceAgent)), None)
+            quality_assurance = self._agents_by_type.get(QualityAssuranceAgent)
             if not quality_assurance:
                 raise ValueError("找不到质量保证代理")
-            review_result = self._handle_agent_communication(
+            review_result = await self._handle_agent_communication(
                 'test_case_writer',
                 'quality_assurance',
                 {'test_cases': test_cases}
@@ -249,23 +405,15 @@ class AssistantAgent:
 
             # 将审查结果传递给测试用例编写者进行改进
             if review_result and isinstance(review_result, dict) and 'reviewed_cases' in review_result:
-                test_case_writer = next((agent for agent in self.agents if isinstance(agent, TestCaseWriterAgent)),
-                                        None)
                 if test_case_writer:
                     # 确保review_comments是有效的字典或字符串
                     review_comments = review_result.get('review_comments', {})
                     # 确保test_cases是List[Dict]类型
                     if isinstance(test_cases, list):
-                        improved_cases = test_case_writer.improve_test_cases(test_cases, review_comments)
-                        if improved_cases:
-                            test_cases = improved_cases
-                            logger.info("测试用例已根据质量审查意见进行改进")
-
-                            # 确保改进后的测试用例被保存到agent_results目录
-                            from src.utils.agent_io import AgentIO
-                            agent_io = AgentIO()
-                            agent_io.save_result("test_case_writer", {"test_cases": improved_cases})
-                            logger.info("改进后的测试用例已保存到agent_results目录")
+                        # 改进结果只写入agent_results目录，不影响本次返回，放到后台执行
+                        self._run_in_background(
+                            self._finalize_improvement(test_case_writer, test_cases, review_comments)
+                        )
                     else:
                         logger.warning(f"test_cases不是列表类型: {type(test_cases)}，跳过改进")
                 else:
@@ -273,15 +421,50 @@ class AssistantAgent:
             else:
                 logger.warning("质量审查结果为空或格式不正确，跳过测试用例改进")
 
+            if review_result:
+                self._mark_phase_completed('质量保证')
+            yield {'phase': 'review', 'data': {'review': review_result, 'test_cases': test_cases}}
+
             # 监控进度
             self._monitor_progress()
 
-            return self._process_coordination_result(self.agent.last_message())
+            yield {'phase': 'result', 'data': self._process_coordination_result(self.agent.last_message())}
 
         except Exception as e:
             logger.error(f"工作流程协调错误: {str(e)}")
             raise
 
+    async def _finalize_improvement(self, test_case_writer, test_cases: List[Dict], review_comments) -> None:
+        """根据质量审查意见改进测试用例，并保存到agent_results目录"""
+        try:
+            improved_cases = await asyncio.to_thread(
+                test_case_writer.improve_test_cases, test_cases, review_comments
+            )
+            if improved_cases:
+                logger.info("测试用例已根据质量审查意见进行改进")
+
+                # improve_test_cases返回新列表时已经把改进结果保存到了agent_results目录，
+                # 只有返回原始用例时才需要在这里保存，避免重复序列化和写入同一个文件
+                if improved_cases is test_cases:
+                    await asyncio.to_thread(
+                        self._agent_io.save_result, "test_case_writer", {"test_cases": improved_cases}
+                    )
+                logger.info("改进后的测试用例已保存到agent_results目录")
+        except Exception as e:
+            logger.error(f"改进测试用例时出错: {str(e)}")
+
+    def _run_in_background(self, coro) -> asyncio.Task:
+        """在后台执行协程，并保留任务引用，避免任务在完成前被回收"""
+        task = asyncio.create_task(coro)
+        self._pending_tasks.add(task)
+        task.add_done_callback(self._pending_tasks.discard)
+        return task
+
+    async def drain(self) -> None:
+        """等待所有后台任务完成，需要读取改进后的测试用例时先调用"""
+        while self._pending_tasks:
+            await asyncio.gather(*self._pending_tasks, return_exceptions=True)
+
     def _process_coordination_result(self, message) -> dict:
         """处理协调结果。
         解析协调器的响应消息，提取工作流程状态和任务分配信息。
@@ -299,7 +482,8 @@ class AssistantAgent:
             # 检查message类型
             if isinstance(message, dict):
                 # 如果message是字典，直接返回一个基本结果
-                logger.info(f"协调结果是字典类型: {message}")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("协调结果是字典类型: %s", _summarize(message))
                 return {
                     'status': 'completed',
                     'current_phase': 'completed',
@@ -308,33 +492,20 @@ class AssistantAgent:
                     'next_steps': []
                 }
 
-            # 解析消息内容
-            lines = message.split('\n') if isinstance(message, str) else []
-            current_section = None
-
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-
-                # 识别不同部分
-                if '当前阶段' in line:
-                    current_section = 'phase'
-                    result['current_phase'] = line.split(':', 1)[1].strip() if ':' in line else line
-                elif '已分配任务' in line:
-                    current_section = 'assigned'
-                elif '已完成任务' in line:
-                    current_section = 'completed'
-                elif '下一步' in line:
-                    current_section = 'next'
-                elif line.startswith('-') and current_section:
-                    # 根据当前部分添加内容
-                    if current_section == 'assigned':
-                        result['assigned_tasks'].append(line[1:].strip())
-                    elif current_section == 'completed':
-                        result['completed_tasks'].append(line[1:].strip())
-                    elif current_section == 'next':
-                        result['next_steps'].append(line[1:].strip())
+            # 解析消息内容：每行只做一次标题匹配，列表项追加到当前段落对应的字段
+            current_field = None
+            for line in message.splitlines() if isinstance(message, str) else ():
+                # 识别不同部分（空行两个模式都不会匹配，直接跳过）
+                match = _SECTION_RE.search(line)
+                if match:
+                    section = match.group()
+                    current_field = _SECTION_FIELDS[section]
+                    if section == '当前阶段':
+                        line = line.strip()
+                        result['current_phase'] = line.split(':', 1)[1].strip() if ':' in line else line
+                elif current_field and (bullet := _BULLET_RE.match(line)):
+                    # 根据当前部分添加内容，列表项两端的空白由正则去除
+                    result[current_field].append(bullet.group(1))
 
             # 更新状态
             if len(result['completed_tasks']) == 4:  # 所有阶段都完成
@@ -346,32 +517,19 @@ class AssistantAgent:
             logger.error(f"处理协调结果错误: {str(e)}")
             return {'status': 'error', 'error': str(e)}
 
-    def _handle_agent_communication(self, from_agent: str, to_agent: str, message: dict):
-        """处理代理之间的结构化JSON通信"""
-        from src.schemas.communication import (
-            AgentMessage, RequirementAnalysisRequest, RequirementAnalysisResponse,
-            TestDesignRequest, TestDesignResponse, TestCaseWriteRequest,
-            TestCaseWriteResponse, QualityAssuranceRequest, QualityAssuranceResponse,
-            ErrorResponse, TestScenario
-        )
-        from src.utils.agent_io import AgentIO
-
-        # 初始化AgentIO用于读取各个agent的结果
-        agent_io = AgentIO()
-
+    async def _handle_agent_communication(self, from_agent: str, to_agent: str, message: dict):
+        """处理代理之间的结构化JSON通信，代理方法中的阻塞LLM调用放到线程中执行"""
         try:
             # 根据代理类型查找，而不是名称
             if to_agent == 'requirement_analyst':
-                target_agent = next((agent for agent in self.agents if isinstance(agent, RequirementAnalystAgent)),
-                                    None)
+                target_agent = self._agents_by_role['requirement_analyst']
                 if target_agent is None:
                     logger.error("找不到需求分析代理")
                     return None
                 # 验证请求消息格式
                 request = RequirementAnalysisRequest(**message)
                 logger.info("开始需求分析")
-                # 使用同步方式调用analyze
-                result = target_agent.analyze(request.doc_content)
+                result = await self._call_agent('requirement_analyst', target_agent.analyze, request.doc_content)
                 # 验证响应消息格式
                 # 确保结果转换为字典格式
                 validated_result = result if isinstance(result, dict) else {
@@ -386,26 +544,17 @@ class AssistantAgent:
 
                 # 确保test_scenarios是TestScenario对象列表
                 if 'test_scenarios' in validated_result and isinstance(validated_result['test_scenarios'], list):
-                    # 如果test_scenarios是字典列表，将其转换为TestScenario对象列表
+                    # 如果test_scenarios是字典列表，先整理为统一结构，再批量转换为TestScenario对象列表
                     test_scenarios = []
                     for scenario in validated_result['test_scenarios']:
                         if isinstance(scenario, dict):
                             # 确保字典包含所有必需的字段
                             if 'id' in scenario and 'description' in scenario:
-                                test_cases = scenario.get('test_cases', [])
-                                test_scenarios.append(TestScenario(
-                                    id=scenario['id'],
-                                    description=scenario['description'],
-                                    test_cases=test_cases
-                                ))
+                                test_scenarios.append({'id': scenario['id'], 'description': scenario['description']})
                         elif isinstance(scenario, str):
-                            # 如果是字符串，创建一个默认的TestScenario对象
-                            test_scenarios.append(TestScenario(
-                                id=f"TS{len(test_scenarios) + 1:03d}",
-                                description=scenario,
-                                test_cases=[]
-                            ))
-                    validated_result['test_scenarios'] = test_scenarios
+                            # 如果是字符串，创建一个默认的测试场景
+                            test_scenarios.append({'id': f"TS{len(test_scenarios) + 1:03d}", 'description': scenario})
+                    validated_result['test_scenarios'] = _TEST_SCENARIOS_ADAPTER.validate_python(test_scenarios)
 
                 # 如果test_scenarios为空，添加一个默认的TestScenario对象
                 if 'test_scenarios' not in validated_result or not validated_result['test_scenarios']:
@@ -425,11 +574,12 @@ class AssistantAgent:
                     "risk_areas": validated_result.get('risk_areas', [])
                 }
                 response = RequirementAnalysisResponse(**response_data)
-                logger.info(f"需求分析完成，结果: {response.dict()}")
-                return response.dict()
+                result_data = response.model_dump()
+                _log_result("需求分析完成", result_data)
+                return result_data
 
             elif to_agent == 'test_designer':
-                target_agent = next((agent for agent in self.agents if isinstance(agent, TestDesignerAgent)), None)
+                target_agent = self._agents_by_role['test_designer']
                 # 验证请求消息格式
                 request = TestDesignRequest(**message)
                 logger.info("开始测试设计")
@@ -445,17 +595,21 @@ class AssistantAgent:
                 if not hasattr(target_agent, 'design'):
                     logger.error("测试设计代理没有design方法")
                     return None
-                # 使用同步方式调用design
-                result = target_agent.design(complete_requirements)
+                result = await self._call_agent('test_designer', target_agent.design, complete_requirements)
 
                 # 记录原始结果，用于调试
-                logger.info(f"测试设计原始结果: {result}")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("测试设计原始结果: %s", _summarize(result))
 
                 # 尝试从响应中提取JSON数据
                 if isinstance(result, str):
                     try:
-                        # 使用统一的JSON解析器直接解析
-                        result = self.json_parser.parse(result, "test_design")
+                        # 先去除代码块标记直接解析，失败或结果不是对象时再使用统一的JSON解析器
+                        try:
+                            parsed = json_codec.loads(_FENCE_RE.sub('', result).strip())
+                        except ValueError:
+                            parsed = None
+                        result = parsed if isinstance(parsed, dict) else self.json_parser.parse(result, "test_design")
                         if not result:
                             logger.error("无法解析测试设计结果，使用默认值")
                             result = {
@@ -494,22 +648,24 @@ class AssistantAgent:
 
                 # 验证响应消息格式
                 response = TestDesignResponse(**result)
-                logger.info(f"测试设计完成，结果: {response.dict()}")
+                result_data = response.model_dump()
+                _log_result("测试设计完成", result_data)
 
                 # 确保测试设计结果被保存到target_agent.last_design属性中
                 # 这样后续流程可以直接从代理实例中获取最新的设计结果
                 if hasattr(target_agent, 'last_design'):
-                    target_agent.last_design = response.dict()
+                    target_agent.last_design = response.model_dump()
                     logger.info("测试设计结果已保存到代理实例中")
                 else:
                     logger.warning("测试设计代理没有last_design属性，无法保存设计结果")
 
-                return response.dict()
+                return result_data
             elif to_agent == 'test_case_writer':
-                target_agent = next((agent for agent in self.agents if isinstance(agent, TestCaseWriterAgent)), None)
+                target_agent = self._agents_by_role['test_case_writer']
 
                 # 记录传递给测试用例编写者的测试策略
-                logger.info(f"传递给测试用例编写者的测试策略: {message}")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("传递给测试用例编写者的测试策略: %s", _summarize(message))
 
                 # 验证请求消息格式
                 try:
@@ -553,9 +709,8 @@ class AssistantAgent:
                     logger.error("测试用例编写代理没有generate方法")
                     return None
 
-                # 使用同步方式调用generate
                 try:
-                    result = target_agent.generate(test_strategy)
+                    result = await self._call_agent('test_case_writer', target_agent.generate, test_strategy)
 
                     # 验证响应消息格式
                     # 确保test_cases是一个列表，并转换为TestCase对象列表
@@ -564,25 +719,24 @@ class AssistantAgent:
                     else:
                         test_cases = result if isinstance(result, list) else []
 
-                    # 将字典列表转换为TestCase对象列表
-                    test_case_objects = []
+                    # 将字典列表批量转换为TestCase对象列表
                     for case in test_cases:
                         if isinstance(case, dict):
                             # 确保字典包含必要的字段
-                            case['description'] = case.get('description', '')
-                            test_case_objects.append(TestCase(**case))
-                        elif isinstance(case, TestCase):
-                            test_case_objects.append(case)
+                            case.setdefault('description', '')
+                    test_case_objects = _TEST_CASES_ADAPTER.validate_python(
+                        [case for case in test_cases if isinstance(case, (dict, TestCase))]
+                    )
 
                     response = TestCaseWriteResponse(test_cases=test_case_objects)
-                    logger.info(f"测试用例生成完成，结果: {response.dict()}")
+                    _log_result("测试用例生成完成", response)
                     return test_cases  # 直接返回test_cases列表，而不是整个响应字典
                 except Exception as e:
                     logger.error(f"测试用例生成失败: {str(e)}")
                     return []  # 返回空列表表示生成失败
 
             elif to_agent == 'quality_assurance':
-                target_agent = next((agent for agent in self.agents if isinstance(agent, QualityAssuranceAgent)), None)
+                target_agent = self._agents_by_role['quality_assurance']
                 # 验证请求消息格式
                 request = QualityAssuranceRequest(**message)
                 logger.info("开始质量保证审查")
@@ -593,19 +747,19 @@ class AssistantAgent:
                 if not hasattr(target_agent, 'review'):
                     logger.error("质量保证代理没有review方法")
                     return None
-                # 使用同步方式调用review
-                result = target_agent.review(request.test_cases)
+                result = await self._call_agent('quality_assurance', target_agent.review, request.test_cases)
                 # 验证响应消息格式
+                # 按类别分组的审查意见展开为一个列表
+                review_comments = result.get('review_comments', [])
+                if isinstance(review_comments, dict):
+                    review_comments = list(chain.from_iterable(review_comments.values()))
                 response = QualityAssuranceResponse(**{
                     'reviewed_cases': result.get('reviewed_cases', []),
-                    'review_comments': [
-                        comment
-                        for category in result.get('review_comments', {}).values()
-                        for comment in category
-                    ] if isinstance(result.get('review_comments'), dict) else result.get('review_comments', [])
+                    'review_comments': review_comments
                 })
-                logger.info(f"质量保证审查完成，结果: {response.dict()}")
-                return response.dict()
+                result_data = response.model_dump()
+                _log_result("质量保证审查完成", result_data)
+                return result_data
             else:
                 target_agent = None
 
@@ -615,7 +769,7 @@ class AssistantAgent:
                     error_code="AGENT_NOT_FOUND",
                     error_message=f"找不到指定的代理: {to_agent}"
                 )
-                raise ValueError(error_response.dict())
+                raise ValueError(error_response.model_dump())
 
             logger.info(f"成功找到代理: {from_agent} -> {to_agent}")
             return None
@@ -626,64 +780,83 @@ class AssistantAgent:
                 error_code="COMMUNICATION_ERROR",
                 error_message=str(e)
             )
-            raise ValueError(error_response.dict())
+            raise ValueError(error_response.model_dump())
+
+    async def _analyze_requirements(self, doc_content: str):
+        """执行需求分析，启用相似度缓存时内容相近的需求文档直接复用之前的分析结果"""
+        if self.similarity_cache.enabled:
+            cached = self.similarity_cache.get(doc_content)
+            if cached is not None:
+                logger.info("需求文档与已分析的文档相似，复用之前的需求分析结果")
+                await asyncio.to_thread(self._restore_agent_state, 'requirement_analyst', cached)
+                return cached
+
+        result = await self._handle_agent_communication(
+            'coordinator',
+            'requirement_analyst',
+            {'doc_content': doc_content}
+        )
+
+        requirement_analyst = self._agents_by_type.get(RequirementAnalystAgent)
+        if self.similarity_cache.enabled and requirement_analyst is not None and requirement_analyst.last_analysis:
+            self.similarity_cache.set(doc_content, requirement_analyst.last_analysis)
+        return result
+
+    async def _call_agent(self, role: str, func, *args):
+        """在线程中调用代理方法，相同输入命中缓存时直接返回上次的结果。
+
+        命中缓存时不会执行代理方法，因此需要恢复代理实例上的最新结果和持久化的结果文件，
+        保证后续流程读取到的是本次的结果。
+        """
+        if not self.llm_cache.enabled:
+            return await asyncio.to_thread(func, *args)
+
+        key = self.llm_cache.cache_key(role, args)
+        cached = self.llm_cache.get(key)
+        if cached is not None:
+            logger.info(f"{role}命中结果缓存，跳过LLM调用")
+            await asyncio.to_thread(self._restore_agent_state, role, cached)
+            return cached
+
+        result = await asyncio.to_thread(func, *args)
+        # 只缓存有效的结果，失败的结果下次重新调用
+        if result and not (isinstance(result, dict) and 'error' in result):
+            self.llm_cache.set(key, result)
+        return result
+
+    def _restore_agent_state(self, role: str, result) -> None:
+        """将缓存的结果写回代理实例和持久化存储"""
+        agent = self._agents_by_role.get(role)
+        if role == 'requirement_analyst':
+            attr, saved = 'last_analysis', result
+        elif role == 'test_designer':
+            attr, saved = 'last_design', result
+        elif role == 'test_case_writer':
+            attr, saved = 'last_cases', {"test_cases": result}
+        else:
+            attr, saved = 'last_review', result
+            result = result.get('reviewed_cases')
+
+        if agent is not None:
+            setattr(agent, attr, result)
+        self._agent_io.save_result(role, saved)
 
     def _monitor_progress(self):
         """监控测试工作流程的进度。
         跟踪各个阶段的完成情况，更新整体进度状态。
         """
         try:
+            # 各阶段状态、完成数和当前阶段由coordinate_workflow_stream在阶段完成时更新，这里只读取快照
             progress = {
-                'total_phases': 4,
-                'completed_phases': 0,
-                'current_phase': '',
-                'phase_status': {
-                    '需求分析': {'status': 'pending', 'completion': 0},
-                    '测试设计': {'status': 'pending', 'completion': 0},
-                    '测试用例编写': {'status': 'pending', 'completion': 0},
-                    '质量保证': {'status': 'pending', 'completion': 0}
-                }
+                'total_phases': len(_PHASE_NAMES),
+                'completed_phases': self._completed_phases,
+                'current_phase': _CURRENT_PHASE_NAMES[self._current_phase_idx],
+                'phase_status': {phase: dict(status) for phase, status in self._phase_state.items()}
             }
 
-            # 更新各阶段状态
-            for agent in self.agents:
-                if isinstance(agent, RequirementAnalystAgent):
-                    # 检查需求分析代理是否有last_analysis属性
-                    if hasattr(agent, 'last_analysis') and agent.last_analysis:
-                        progress['phase_status']['需求分析']['status'] = 'completed'
-                        progress['phase_status']['需求分析']['completion'] = 100
-                        progress['completed_phases'] += 1
-                elif isinstance(agent, TestDesignerAgent):
-                    # 检查测试设计代理是否有last_design属性
-                    if hasattr(agent, 'last_design') and agent.last_design:
-                        progress['phase_status']['测试设计']['status'] = 'completed'
-                        progress['phase_status']['测试设计']['completion'] = 100
-                        progress['completed_phases'] += 1
-                elif isinstance(agent, TestCaseWriterAgent):
-                    # 检查测试用例编写代理是否有last_cases属性
-                    if hasattr(agent, 'last_cases') and agent.last_cases:
-                        progress['phase_status']['测试用例编写']['status'] = 'completed'
-                        progress['phase_status']['测试用例编写']['completion'] = 100
-                        progress['completed_phases'] += 1
-                elif isinstance(agent, QualityAssuranceAgent):
-                    # 检查质量保证代理是否有last_review属性
-                    if hasattr(agent, 'last_review') and agent.last_review:
-                        progress['phase_status']['质量保证']['status'] = 'completed'
-                        progress['phase_status']['质量保证']['completion'] = 100
-                        progress['completed_phases'] += 1
-
-            # 更新当前阶段
-            for phase, status in progress['phase_status'].items():
-                if status['status'] == 'pending':
-                    progress['current_phase'] = phase
-                    break
-
-            # 如果所有阶段都完成，设置当前阶段为'完成'
-            if progress['completed_phases'] == progress['total_phases']:
-                progress['current_phase'] = 'completed'
-
             logger.info(
                 f"当前进度: {progress['completed_phases']}/{progress['total_phases']} - 当前阶段: {progress['current_phase']}")
+            logger.info(f"结果缓存命中: {self.llm_cache.stats['hits']}，未命中: {self.llm_cache.stats['misses']}")
             return progress
 
         except Exception as e:
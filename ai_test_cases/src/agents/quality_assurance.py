@@ -5,15 +5,23 @@
 # @Date: 2025/8/28 11:01
 """
 
+import asyncio
+import concurrent.futures
+import copy
+import functools
+import heapq
+import json
 import logging
 import os
-import concurrent.futures
 from typing import Dict, List
 
-import autogen
 from dotenv import load_dotenv
-from src.utils.agent_io import AgentIO
+from openai import AsyncOpenAI
+from src.utils import json_codec
+from src.utils.agent_io import AGENT_IO
 from src.utils.json_parser import UnifiedJSONParser
+from src.utils.llm_cache import ResultCache
+from src.utils.review_feedback import FEEDBACK_SECTIONS, parse_feedback_sections
 
 load_dotenv()  # 加载环境变量
 logger = logging.getLogger(__name__)  # 获取日志记录器
@@ -22,6 +30,55 @@ api_key = os.getenv("LLM_KEY")
 base_url = os.getenv("BASE_URL")
 model = os.getenv("LLM_MODEL")
 
+# 完整性改进时需要补齐为列表的字段
+_REQUIRED_FIELDS = ('preconditions', 'steps', 'expected_results')
+
+# 从反馈文本中的指定位置开始解码JSON
+_JSON_DECODER = json.JSONDecoder()
+
+# 质量保证代理的系统提示词，用于异步审查调用
+_SYSTEM_MESSAGE = """你是一位专业的质量保证工程师，负责审查和改进测试用例。
+            你的职责是确保测试用例的完整性、清晰度、可执行性，并关注边界情况和错误场景。
+
+            在审查测试用例时，请重点关注以下方面并以JSON格式返回审查结果：
+            {
+                "review_comments": {
+                    "completeness": ["完整性相关的改进建议1", "完整性相关的改进建议2"],
+                    "clarity": ["清晰度相关的改进建议1", "清晰度相关的改进建议2"],
+                    "executability": ["可执行性相关的改进建议1", "可执行性相关的改进建议2"],
+                    "boundary_cases": ["边界情况相关的改进建议1", "边界情况相关的改进建议2"],
+                    "error_scenarios": ["错误场景相关的改进建议1", "错误场景相关的改进建议2"]
+                }
+            }
+
+            注意事项：
+            1. 必须严格按照上述JSON格式返回审查结果
+            2. 每个类别至少包含一条具体的改进建议
+            3. 所有建议必须清晰、具体、可执行
+            4. 不要返回任何JSON格式之外的文本内容
+            5. 返回的内容必须是中文回复，不要英文回复
+            6. review_comments等键名必须按照json里的格式返回，如"review_comments": {"completeness": ["完整性相关的改进建议1", "完整性相关的改进建议2"]}这种"""
+
+
+def _as_list(value) -> List:
+    """将字段值规范为列表"""
+    return value if isinstance(value, list) else [value]
+
+
+def _clean_steps(steps) -> List[str]:
+    """去除步骤两端的空白并过滤空步骤"""
+    return [step.strip() for step in steps if step]
+
+
+def _merge_unique(existing: List, new_items: List) -> List:
+    """返回在已有列表后追加新条目（跳过已存在的条目）的新列表，不修改原列表"""
+    # 用集合判断条目是否已存在，已有条目不可哈希时退回列表查找
+    try:
+        seen = set(existing).__contains__
+    except TypeError:
+        seen = existing.__contains__
+    return existing + [item for item in new_items if not seen(item)]
+
 
 class QualityAssuranceAgent:
     def __init__(self, concurrent_workers: int = 1):
@@ -40,38 +97,18 @@ class QualityAssuranceAgent:
         self.concurrent_workers = max(1, concurrent_workers)  # 确保至少为1
         logger.info(f"质量保证代理初始化，并发工作线程数: {self.concurrent_workers}")
 
-        # 初始化AgentIO用于保存和加载审查结果
-        self.agent_io = AgentIO()
+        # 使用共享的AgentIO保存和加载审查结果，读写经由json_codec（安装orjson时使用orjson）
+        self.agent_io = AGENT_IO
 
         # 初始化统一的JSON解析器
         self.json_parser = UnifiedJSONParser()
 
-        # 初始化agent
-        self.agent = autogen.AssistantAgent(
-            name="quality_assurance",
-            system_message="""你是一位专业的质量保证工程师，负责审查和改进测试用例。
-            你的职责是确保测试用例的完整性、清晰度、可执行性，并关注边界情况和错误场景。
-
-            在审查测试用例时，请重点关注以下方面并以JSON格式返回审查结果：
-            {
-                "review_comments": {
-                    "completeness": ["完整性相关的改进建议1", "完整性相关的改进建议2"],
-                    "clarity": ["清晰度相关的改进建议1", "清晰度相关的改进建议2"],
-                    "executability": ["可执行性相关的改进建议1", "可执行性相关的改进建议2"],
-                    "boundary_cases": ["边界情况相关的改进建议1", "边界情况相关的改进建议2"],
-                    "error_scenarios": ["错误场景相关的改进建议1", "错误场景相关的改进建议2"]
-                }
-            }
+        # 审查评论的解析结果按反馈文本缓存，缓存随实例释放
+        self._parse_review_comments_cached = functools.lru_cache(maxsize=16)(self._parse_review_comments)
 
-            注意事项：
-            1. 必须严格按照上述JSON格式返回审查结果
-            2. 每个类别至少包含一条具体的改进建议
-            3. 所有建议必须清晰、具体、可执行
-            4. 不要返回任何JSON格式之外的文本内容
-            5. 返回的内容必须是中文回复，不要英文回复
-            6. review_comments等键名必须按照json里的格式返回，如"review_comments": {"completeness": ["完整性相关的改进建议1", "完整性相关的改进建议2"]}这种""",
-            llm_config={"config_list": self.config_list}
-        )
+        # 审查结果的持久化缓存，相同的测试用例再次审查时直接返回之前的结果
+        # 默认不启用，设置QA_CACHE_TTL(缓存有效期，秒)后启用
+        self.review_cache = ResultCache(self.agent_io, "qa_cache", ttl=float(os.getenv("QA_CACHE_TTL", "0")))
 
         # 添加last_review属性，用于跟踪最近的审查结果
         self.last_review = None
@@ -92,7 +129,9 @@ class QualityAssuranceAgent:
     def review(self, test_cases: List[Dict]) -> Dict:
         """审查和改进测试用例。
 
-        使用并发处理方式提高处理效率，并发数由concurrent_workers参数控制。
+        测试用例按concurrent_workers分批，各批次的LLM审查请求在同一个事件循环中并发发出，
+        并发数由concurrent_workers参数控制。该方法是同步方法，在运行中的事件循环线程里调用时会在工作线程中
+        执行审查并阻塞当前线程，在异步代码中应通过asyncio.to_thread调用。
         """
         try:
             # 验证输入参数
@@ -100,86 +139,32 @@ class QualityAssuranceAgent:
                 logger.warning("输入的测试用例为空或格式不正确")
                 return {"error": "输入的测试用例为空或格式不正确", "reviewed_cases": []}
 
-            user_proxy = autogen.UserProxyAgent(
-                name="user_proxy",
-                system_message="测试用例提供者",
-                human_input_mode="NEVER",
-                code_execution_config={"use_docker": False}
-            )
-
-            # 审查测试用例
-            user_proxy.initiate_chat(
-                self.agent,
-                message=f"""请审查以下测试用例并提供改进建议：
-
-                测试用例: {test_cases}
-
-                检查以下方面：
-                1. 完整性
-                2. 清晰度
-                3. 可执行性
-                4. 边界情况
-                5. 错误场景""",
-                max_turns=1  # 限制对话轮次为1，避免死循环
-            )
-
-            # 获取审查反馈
-            review_feedback = self.agent.last_message()
-
-            # 确保反馈是字符串格式
-            if not review_feedback:
-                logger.warning("审查反馈为空")
-                review_feedback = ""
-            elif isinstance(review_feedback, dict):
-                if 'content' in review_feedback:
-                    review_feedback = review_feedback['content']
-                else:
-                    logger.warning("无法从反馈字典中提取内容，使用空字符串")
-                    review_feedback = ""
-            elif not isinstance(review_feedback, str):
-                logger.warning(f"审查反馈格式不正确: {type(review_feedback)}，转换为字符串")
-                review_feedback = str(review_feedback)
-
-            # 提取反馈中的关键改进建议
-            review_comments = self._extract_review_comments(review_feedback)
-
-            # 使用并发方式处理测试用例
-            if self.concurrent_workers > 1:
-                logger.info(f"使用并发方式处理测试用例，并发数: {self.concurrent_workers}")
-                reviewed_cases = self._process_review_concurrent(test_cases, review_feedback)
-            else:
-                logger.info("使用顺序方式处理测试用例")
-                # 调用原有的处理方法
-                reviewed_cases = self._process_review(test_cases, review_feedback)
-
-            # 创建包含审查反馈和改进后测试用例的结果
-            result = {
-                "reviewed_cases": reviewed_cases,
-                "review_comments": review_comments,
-                "review_date": self._get_current_timestamp(),
-                "review_status": "completed"
-            }
-
-            # 验证结果数据的完整性
-            if not self._validate_result(result):
-                logger.warning("审查结果数据不完整，可能影响后续处理")
-                result["review_status"] = "incomplete"
-
-            # 将审查结果保存到文件
-            try:
-                self.agent_io.save_result("quality_assurance", result)
-                logger.info("质量审查结果已成功保存")
-            except Exception as e:
-                logger.error(f"保存质量审查结果时出错: {str(e)}")
-                # 即使保存失败，仍然返回结果
-
-            # 保存审查结果到last_review属性
-            self.last_review = reviewed_cases
-            logger.info(f"测试用例审查完成，共审查 {len(test_cases)} 个测试用例")
-
-            # 清理临时批次文件
-            self._delete_batch_files()
+            # 测试用例全部为空时没有可审查的内容，直接返回
+            if not any(test_cases):
+                logger.info("测试用例内容均为空，跳过LLM审查")
+                self.last_review = list(test_cases)
+                return {
+                    "reviewed_cases": list(test_cases),
+                    "review_comments": {category: [] for category in FEEDBACK_SECTIONS.values()},
+                    "review_date": self._get_current_timestamp(),
+                    "review_status": "completed_trivial"
+                }
 
+            # 相同的测试用例已经审查过时直接返回缓存的结果，跳过LLM调用
+            cache_key = self.review_cache.cache_key(test_cases)
+            cached = self.review_cache.lookup(cache_key)
+            if cached is not None:
+                logger.info("命中质量审查缓存，跳过LLM审查")
+                # 审查日期使用本次返回结果的时间，而不是缓存写入时的时间
+                cached["review_date"] = self._get_current_timestamp()
+                self.last_review = cached.get("reviewed_cases", [])
+                return cached
+
+            result = self._run_review(test_cases)
+
+            # 只缓存完整的审查结果
+            if result.get("review_status") == "completed":
+                self.review_cache.update(cache_key, result)
             return result
 
         except Exception as e:
@@ -192,6 +177,185 @@ class QualityAssuranceAgent:
             }
             return error_result
 
+    def _run_review(self, test_cases: List[Dict]) -> Dict:
+        """
+        执行异步审查。当前线程已有运行中的事件循环时asyncio.run会抛出RuntimeError，此时在工作线程中执行
+        :param test_cases: 测试用例列表
+        :return: 审查结果
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._review_async(test_cases))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="qa_review") as pool:
+            return pool.submit(asyncio.run, self._review_async(test_cases)).result()
+
+    async def _review_async(self, test_cases: List[Dict]) -> Dict:
+        """
+        异步审查测试用例：每个批次发出一次LLM请求，各批次并发执行，按完成顺序逐批处理
+        :param test_cases: 测试用例列表
+        :return: 审查结果
+        """
+        # 所有测试用例完全相同时只审查第一个，审查结果再复制给其余测试用例
+        identical = len(test_cases) > 1 and all(case == test_cases[0] for case in test_cases[1:])
+        cases_to_review = test_cases[:1] if identical else test_cases
+        if identical:
+            logger.info(f"{len(test_cases)}个测试用例内容完全相同，只审查其中一个")
+
+        # 根据并发数确定批次，每个批次对应一次LLM请求；按用例大小均衡分配，避免个别大批次拖慢整体
+        total_cases = len(cases_to_review)
+        batch_indices = self._balance_batches(cases_to_review, min(total_cases, self.concurrent_workers))
+        batches = [[cases_to_review[idx] for idx in indices] for indices in batch_indices]
+        logger.info(
+            f"将{total_cases}个测试用例分成{len(batches)}批进行审查，每批约{-(-total_cases // len(batches))}个用例，"
+            f"并发数: {self.concurrent_workers}")
+
+        # 每批审查完成后立即改进该批次，不必等待所有请求返回。结果列表按用例总数预先分配，
+        # 每批完成后按原始下标写回对应位置，保持原有顺序；初始内容为原始测试用例，审查失败的批次即保留原始测试用例
+        reviewed_cases = list(cases_to_review)
+        batch_comments = [{}] * len(batches)
+        errors = []
+        # 中间结果每完成K个批次保存一次，减少序列化和磁盘写入次数
+        checkpoint_every = max(1, len(batches) // 10)
+        pending = []
+        completed = 0
+        async for i, feedback in self._iter_batch_feedback(batches):
+            if isinstance(feedback, Exception):
+                logger.error(f"审查第{i + 1}批测试用例时出错: {str(feedback)}")
+                errors.append(feedback)
+            else:
+                batch_cases, batch_comments[i] = self._process_batch(i, batches[i], feedback)
+                for idx, case in zip(batch_indices[i], batch_cases):
+                    reviewed_cases[idx] = case
+                pending.append((batch_cases, batch_comments[i]))
+
+            completed += 1
+            if pending and (completed % checkpoint_every == 0 or completed == len(batches)):
+                self._save_checkpoint(-(-completed // checkpoint_every), pending, f"{completed}/{len(batches)}")
+                pending = []
+
+        # 所有批次都失败时按审查出错处理
+        if len(errors) == len(batches):
+            raise errors[0]
+
+        if identical:
+            reviewed_cases += [copy.deepcopy(reviewed_cases[0]) for _ in range(len(test_cases) - 1)]
+
+        review_comments = {
+            "completeness": [],
+            "clarity": [],
+            "executability": [],
+            "boundary_cases": [],
+            "error_scenarios": []
+        }
+        for comments_by_category in batch_comments:
+            for category, comments in comments_by_category.items():
+                review_comments.setdefault(category, []).extend(comments)
+
+        # 各批次的审查意见可能重复，去重并保持原有顺序
+        review_comments = {k: list(dict.fromkeys(v)) for k, v in review_comments.items()}
+
+        # 创建包含审查反馈和改进后测试用例的结果
+        result = {
+            "reviewed_cases": reviewed_cases,
+            "review_comments": review_comments,
+            "review_date": self._get_current_timestamp(),
+            "review_status": "completed"
+        }
+
+        # 验证结果数据的完整性，有批次审查失败时结果同样不完整
+        if errors or not self._validate_result(result):
+            logger.warning("审查结果数据不完整，可能影响后续处理")
+            result["review_status"] = "incomplete"
+
+        # 将审查结果保存到文件
+        try:
+            self.agent_io.save_result("quality_assurance", result)
+            logger.info("质量审查结果已成功保存")
+        except Exception as e:
+            logger.error(f"保存质量审查结果时出错: {str(e)}")
+            # 即使保存失败，仍然返回结果
+
+        # 保存审查结果到last_review属性
+        self.last_review = reviewed_cases
+        logger.info(f"测试用例审查完成，共审查 {len(test_cases)} 个测试用例")
+
+        # 清理临时批次文件
+        self._delete_batch_files()
+
+        return result
+
+    @staticmethod
+    def _balance_batches(test_cases: List[Dict], num_batches: int) -> List[List[int]]:
+        """
+        按序列化后的长度把测试用例均衡分配到各批次：从大到小依次放入当前总长度最小的批次
+        :param test_cases: 测试用例列表
+        :param num_batches: 批次数
+        :return: 每个批次包含的测试用例下标，批次内保持原有顺序
+        """
+        sizes = [len(json_codec.dumps(case, default=str, indent=False)) for case in test_cases]
+        batches = [[] for _ in range(num_batches)]
+        loads = [(0, i) for i in range(num_batches)]
+        for idx in sorted(range(len(test_cases)), key=sizes.__getitem__, reverse=True):
+            load, batch_index = heapq.heappop(loads)
+            batches[batch_index].append(idx)
+            heapq.heappush(loads, (load + sizes[idx], batch_index))
+        return [sorted(batch) for batch in batches if batch]
+
+    async def _iter_batch_feedback(self, batches: List[List[Dict]]):
+        """
+        并发请求审查所有批次，按完成顺序逐批产出审查反馈，信号量限制同时进行的请求数
+        :param batches: 分好批次的测试用例
+        :return: 异步生成器，产出(批次序号, 审查反馈)，请求失败时审查反馈为异常对象
+        """
+        semaphore = asyncio.Semaphore(self.concurrent_workers)
+        async with AsyncOpenAI(api_key=api_key, base_url=base_url) as client:
+            async def _review_batch(batch_index: int, batch_cases: List[Dict]):
+                try:
+                    return batch_index, await self._request_review(client, semaphore, batch_cases)
+                except Exception as e:
+                    return batch_index, e
+
+            for future in asyncio.as_completed([_review_batch(i, batch) for i, batch in enumerate(batches)]):
+                yield await future
+
+    async def _request_review(self, client: AsyncOpenAI, semaphore: asyncio.Semaphore,
+                              test_cases: List[Dict]) -> str:
+        """
+        请求LLM审查一批测试用例
+        :param client: 异步LLM客户端
+        :param semaphore: 限制并发请求数的信号量
+        :param test_cases: 本批次的测试用例
+        :return: 审查反馈文本
+        """
+        # 以紧凑的JSON发送测试用例，比Python的repr更短，减少输入token
+        cases_json = json_codec.dumps(test_cases, default=str, indent=False).decode('utf-8')
+        async with semaphore:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": _SYSTEM_MESSAGE},
+                    {"role": "user", "content": f"""请审查以下测试用例并提供改进建议：
+
+                测试用例: {cases_json}
+
+                检查以下方面：
+                1. 完整性
+                2. 清晰度
+                3. 可执行性
+                4. 边界情况
+                5. 错误场景"""}
+                ]
+            )
+
+        # 在此处统一将反馈规范为字符串，后续解析无需再判断类型
+        review_feedback = response.choices[0].message.content if response.choices else None
+        if not review_feedback:
+            logger.warning("审查反馈为空")
+            return ""
+        return review_feedback if isinstance(review_feedback, str) else str(review_feedback)
+
     def _merge_feature_test_cases(self, batch_count: int) -> Dict:
         """合并多个批次的测试用例结果
 
@@ -223,9 +387,8 @@ class QualityAssuranceAgent:
                             if category in batch_result["review_comments"]:
                                 all_review_comments[category].extend(batch_result["review_comments"][category])
 
-            # 去重评论
-            for category in all_review_comments.keys():
-                all_review_comments[category] = list(set(all_review_comments[category]))
+            # 去重评论，保持原有顺序
+            all_review_comments = {k: list(dict.fromkeys(v)) for k, v in all_review_comments.items()}
 
             # 创建合并结果
             merged_result = {
@@ -247,7 +410,14 @@ class QualityAssuranceAgent:
             return {"error": str(e), "review_status": "error"}
 
     def _extract_review_comments(self, feedback: str) -> Dict:
-        """从字符串格式的反馈中提取结构化的审查评论。"""
+        """从字符串格式的反馈中提取结构化的审查评论，相同的反馈只解析一次。"""
+        if not feedback or not isinstance(feedback, str):
+            return self._parse_review_comments(feedback)
+        # 缓存中的结果会被多次返回，复制后再交给调用方
+        return {k: list(v) for k, v in self._parse_review_comments_cached(feedback).items()}
+
+    def _parse_review_comments(self, feedback: str) -> Dict:
+        """解析反馈文本，优先按JSON解析，失败时按章节文本解析。"""
         review_comments = {
             "completeness": [],
             "clarity": [],
@@ -261,8 +431,16 @@ class QualityAssuranceAgent:
             return review_comments
 
         try:
-            # 使用统一的JSON解析器
-            parsed_feedback = self.json_parser.parse(feedback, "quality_assurance_review")
+            # 先从第一个"{"开始直接解码，格式正确的JSON无需经过正则提取；失败时再使用统一的JSON解析器
+            parsed_feedback = None
+            start = feedback.find('{')
+            if start >= 0:
+                try:
+                    parsed_feedback, _ = _JSON_DECODER.raw_decode(feedback, start)
+                except json.JSONDecodeError:
+                    parsed_feedback = None
+            if not isinstance(parsed_feedback, dict) or 'review_comments' not in parsed_feedback:
+                parsed_feedback = self.json_parser.parse(feedback, "quality_assurance_review")
 
             if parsed_feedback and 'review_comments' in parsed_feedback:
                 extracted_comments = parsed_feedback['review_comments']
@@ -276,32 +454,7 @@ class QualityAssuranceAgent:
             logger.warning(f"JSON解析失败，将使用文本解析方式: {str(e)}")
 
         # 如果JSON解析失败，回退到文本解析方式
-        feedback_sections = [line.strip() for line in feedback.split('\n') if line.strip()]
-        current_section = None
-
-        # 提取各个方面的改进建议
-        for line in feedback_sections:
-            # 识别章节标题
-            section_mapping = {
-                '1. 完整性': 'completeness',
-                '2. 清晰度': 'clarity',
-                '3. 可执行性': 'executability',
-                '4. 边界情况': 'boundary_cases',
-                '5. 错误场景': 'error_scenarios'
-            }
-
-            for title, section in section_mapping.items():
-                if title in line:
-                    current_section = section
-                    break
-
-            # 提取建议内容
-            if current_section and (line.startswith('-') or line.startswith('•')):
-                content = line[1:].strip()
-                if content:  # 确保内容不为空
-                    review_comments[current_section].append(content)
-
-        return review_comments
+        return parse_feedback_sections(feedback)
 
     def _get_current_timestamp(self) -> str:
         """获取当前时间戳"""
@@ -325,176 +478,65 @@ class QualityAssuranceAgent:
 
         return True
 
-    def _process_review_concurrent(self, original_cases: List[Dict], review_feedback) -> List[Dict]:
-        """使用并发方式处理审查反馈并更新测试用例。
-        根据concurrent_workers参数控制并发数。
+    def _parse_feedback_once(self, feedback: str) -> Dict[str, List[str]]:
         """
-        if not original_cases:
-            logger.warning("没有测试用例需要处理")
-            return []
-
-        # 确定批次大小和批次数
-        total_cases = len(original_cases)
-        # 根据并发工作线程数确定批次数，每个工作线程至少处理一个批次
-        num_batches = min(total_cases, self.concurrent_workers * 2)  # 每个工作线程处理约2个批次
-        batch_size = max(1, total_cases // num_batches)  # 确保每批至少有1个用例
-
-        batches = [original_cases[i:i + batch_size] for i in range(0, total_cases, batch_size)]
-        logger.info(
-            f"将{total_cases}个测试用例分成{len(batches)}批进行处理，每批约{batch_size}个用例，并发工作线程数: {self.concurrent_workers}")
-
-        # 使用线程池并发处理测试用例
-        all_reviewed_cases = []
-
-        # 定义批处理函数
-        def process_batch(batch_index, batch_cases):
-            logger.info(f"开始处理第{batch_index + 1}批测试用例，共{len(batch_cases)}个")
-            batch_reviewed_cases = []
-            for case in batch_cases:
-                improved_case = self._improve_test_case(case, review_feedback)
-                batch_reviewed_cases.append(improved_case)
-
-            # 保存中间结果，防止因超时丢失数据
-            temp_result = {
-                "reviewed_cases": batch_reviewed_cases,  # 只保存当前批次的结果，而不是累积结果
-                "review_comments": self._extract_review_comments(review_feedback) if isinstance(review_feedback,
-                                                                                                str) else review_feedback,
-                "review_date": self._get_current_timestamp(),
-                "review_status": "in_progress",
-                "batch_progress": f"{batch_index + 1}/{len(batches)}"
-            }
-            try:
-                self.agent_io.save_result(f"quality_assurance_batch_{batch_index + 1}", temp_result)
-                logger.info(f"已保存第{batch_index + 1}批质量审查结果")
-            except Exception as e:
-                logger.error(f"保存第{batch_index + 1}批质量审查结果时出错: {str(e)}")
-
-            logger.info(f"第{batch_index + 1}批测试用例处理完成")
-            return batch_reviewed_cases
-
-        # 使用线程池执行器并发处理批次
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrent_workers) as executor:
-            # 提交所有批次任务
-            future_to_batch = {executor.submit(process_batch, i, batch): i for i, batch in enumerate(batches)}
-
-            # 收集结果
-            for future in concurrent.futures.as_completed(future_to_batch):
-                batch_index = future_to_batch[future]
-                try:
-                    batch_result = future.result()
-                    all_reviewed_cases.extend(batch_result)
-                    logger.info(f"已合并第{batch_index + 1}批测试用例结果")
-                except Exception as e:
-                    logger.error(f"处理第{batch_index + 1}批测试用例时出错: {str(e)}")
-
-        logger.info(f"所有测试用例处理完成，共改进{len(all_reviewed_cases)}个测试用例")
-        return all_reviewed_cases
+        解析审查反馈，按类别提取改进建议，每批反馈只需解析一次
+        :param feedback: 审查反馈文本，_request_review已将其规范为字符串
+        :return: 各类别的改进建议
+        """
+        return parse_feedback_sections(feedback)
 
-    def _improve_test_case(self, test_case: Dict, feedback) -> Dict:
-        """根据反馈改进测试用例。"""
+    def _improve_test_case(self, test_case: Dict, improvements: Dict[str, List[str]]) -> Dict:
+        """
+        根据预先解析好的改进建议改进测试用例
+        :param test_case: 测试用例
+        :param improvements: _parse_feedback_once返回的各类别改进建议
+        :return: 改进后的测试用例
+        """
         try:
             if not test_case:
                 logger.warning("测试用例为空")
                 return test_case
 
-            if not feedback:
-                logger.warning("反馈为空")
+            if not improvements or not any(improvements.values()):
+                logger.debug("反馈中没有可应用的改进建议")
                 return test_case
 
-            # 创建改进后的测试用例副本
-            improved_case = test_case.copy()
-
-            # 检查feedback类型
-            if isinstance(feedback, dict):
-                # 如果是字典类型，尝试从content字段获取内容
-                if 'content' in feedback:
-                    feedback = feedback['content']
-                else:
-                    logger.error(f"无法从字典中提取反馈内容: {feedback}")
-                    return test_case
-
-            # 确保feedback是字符串类型
-            if not isinstance(feedback, str):
-                logger.error(f"反馈不是字符串类型: {type(feedback)}")
-                return test_case
-
-            # 解析反馈内容
-            feedback_sections = [line.strip() for line in feedback.split('\n') if line.strip()]
-            current_section = None
-            improvements = {
-                'completeness': [],
-                'clarity': [],
-                'executability': [],
-                'boundary_cases': [],
-                'error_scenarios': []
-            }
+            # 只计算需要更新的字段，最后一次性构造新的测试用例，不修改原测试用例及其中的列表
+            updates = {}
 
-            # 提取各个方面的改进建议
-            for line in feedback_sections:
-                # 识别章节标题
-                section_mapping = {
-                    '1. 完整性': 'completeness',
-                    '2. 清晰度': 'clarity',
-                    '3. 可执行性': 'executability',
-                    '4. 边界情况': 'boundary_cases',
-                    '5. 错误场景': 'error_scenarios'
-                }
-
-                for title, section in section_mapping.items():
-                    if title in line:
-                        current_section = section
-                        break
-
-                # 提取建议内容
-                if current_section and (line.startswith('-') or line.startswith('•')):
-                    content = line[1:].strip()
-                    if content:  # 确保内容不为空
-                        improvements[current_section].append(content)
-
-            # 根据反馈改进测试用例
             # 完整性改进
             if improvements['completeness']:
-                required_fields = ['preconditions', 'steps', 'expected_results']
-                for field in required_fields:
-                    if field not in improved_case:
-                        improved_case[field] = []
-                    elif not isinstance(improved_case[field], list):
-                        improved_case[field] = [improved_case[field]]
+                updates.update((field, _as_list(test_case.get(field, []))) for field in _REQUIRED_FIELDS)
 
             # 清晰度改进
             if improvements['clarity']:
                 # 确保标题清晰明确
-                if 'title' in improved_case:
-                    improved_case['title'] = improved_case['title'].strip() if improved_case['title'] else ''
+                if 'title' in test_case:
+                    updates['title'] = test_case['title'].strip() if test_case['title'] else ''
                 # 确保步骤描述清晰
-                if 'steps' in improved_case:
-                    improved_case['steps'] = [step.strip() for step in improved_case['steps'] if step]
+                if 'steps' in updates or 'steps' in test_case:
+                    updates['steps'] = _clean_steps(updates.get('steps', test_case.get('steps')))
 
             # 可执行性改进
             if improvements['executability']:
-                steps = improved_case.get('steps', [])
-                results = improved_case.get('expected_results', [])
+                steps = updates.get('steps', test_case.get('steps', []))
+                results = updates.get('expected_results', test_case.get('expected_results', []))
                 if steps:
                     # 确保每个步骤都有对应的预期结果
-                    if len(steps) > len(results):
-                        results.extend(['待补充'] * (len(steps) - len(results)))
-                    improved_case['expected_results'] = results
+                    updates['expected_results'] = results + ['待补充'] * (len(steps) - len(results))
 
-            # 边界情况改进
+            # 边界情况改进，去重并添加新的边界条件
             if improvements['boundary_cases']:
-                boundary_conditions = improved_case.setdefault('boundary_conditions', [])
-                # 去重并添加新的边界条件
-                new_conditions = [cond for cond in improvements['boundary_cases']
-                                  if cond not in boundary_conditions]
-                boundary_conditions.extend(new_conditions)
+                updates['boundary_conditions'] = _merge_unique(test_case.get('boundary_conditions', []),
+                                                               improvements['boundary_cases'])
 
-            # 错误场景改进
+            # 错误场景改进，去重并添加新的错误场景
             if improvements['error_scenarios']:
-                error_scenarios = improved_case.setdefault('error_scenarios', [])
-                # 去重并添加新的错误场景
-                new_scenarios = [scenario for scenario in improvements['error_scenarios']
-                                 if scenario not in error_scenarios]
-                error_scenarios.extend(new_scenarios)
+                updates['error_scenarios'] = _merge_unique(test_case.get('error_scenarios', []),
+                                                           improvements['error_scenarios'])
+
+            improved_case = {**test_case, **updates}
 
             # 验证改进后的测试用例
             if not self._validate_improvements(test_case, improved_case):
@@ -509,73 +551,75 @@ class QualityAssuranceAgent:
 
     def _validate_improvements(self, original: Dict, improved: Dict) -> bool:
         """验证改进是否保持测试用例的完整性。"""
-        return all(key in improved for key in original.keys())
+        return original.keys() <= improved.keys()
 
     def _delete_batch_files(self) -> None:
         """删除质量审查过程中生成的临时批次文件。
         在测试用例审查完成后调用此函数清理中间文件。
         """
         try:
-            import os
-            import glob
-
-            # 查找所有质量审查批次的临时文件
-            pattern = os.path.join(self.agent_io.output_dir, "quality_assurance_batch_*_result.json")
-            batch_files = glob.glob(pattern)
-
-            # 删除找到的所有批次文件
-            for file_path in batch_files:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"已删除临时质量审查批次文件: {file_path}")
-
-            if batch_files:
-                logger.info(f"所有临时质量审查批次文件已清理完毕，共删除 {len(batch_files)} 个文件")
+            # 遍历输出目录按文件名匹配批次文件，直接删除，每个文件只需一次系统调用
+            prefix, suffix = "quality_assurance_batch_", "_result.json"
+            deleted_count = 0
+            with os.scandir(self.agent_io.output_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith(prefix) and entry.name.endswith(suffix):
+                        try:
+                            os.unlink(entry.path)
+                        except FileNotFoundError:
+                            continue
+                        deleted_count += 1
+                        logger.info(f"已删除临时质量审查批次文件: {entry.path}")
+
+            if deleted_count:
+                logger.info(f"所有临时质量审查批次文件已清理完毕，共删除 {deleted_count} 个文件")
             else:
                 logger.info("未找到需要清理的临时质量审查批次文件")
         except Exception as e:
             logger.error(f"删除临时质量审查批次文件时出错: {str(e)}")
 
-    def _process_review(self, original_cases: List[Dict], review_feedback) -> List[Dict]:
-        """处理审查反馈并更新测试用例。
-        优化：将测试用例分批次进行改进，避免一次处理过多导致超时或输出不完整。
+    def _process_batch(self, batch_index: int, batch_cases: List[Dict], review_feedback: str) -> tuple:
         """
-        if not original_cases:
-            logger.warning("没有测试用例需要处理")
-            return []
-
-        # 将测试用例分成3批进行处理，避免一次处理过多
-        batch_size = max(1, len(original_cases) // 3)  # 确保至少每批1个用例
-        batches = [original_cases[i:i + batch_size] for i in range(0, len(original_cases), batch_size)]
-        logger.info(f"将{len(original_cases)}个测试用例分成{len(batches)}批进行处理，每批约{batch_size}个用例")
-
-        # 分批处理测试用例
-        all_reviewed_cases = []
-        for i, batch in enumerate(batches):
-            logger.info(f"开始处理第{i + 1}批测试用例，共{len(batch)}个")
-            batch_reviewed_cases = []
-            for case in batch:
-                improved_case = self._improve_test_case(case, review_feedback)
-                batch_reviewed_cases.append(improved_case)
-
-            # 将当前批次的结果添加到总结果中
-            all_reviewed_cases.extend(batch_reviewed_cases)
-            logger.info(f"第{i + 1}批测试用例处理完成")
-
-            # 保存中间结果，防止因超时丢失数据
-            temp_result = {
-                "reviewed_cases": batch_reviewed_cases,  # 只保存当前批次的结果，而不是累积结果
-                "review_comments": self._extract_review_comments(review_feedback) if isinstance(review_feedback,
-                                                                                                str) else review_feedback,
-                "review_date": self._get_current_timestamp(),
-                "review_status": "in_progress",
-                "batch_progress": f"{i + 1}/{len(batches)}"
-            }
-            try:
-                self.agent_io.save_result(f"quality_assurance_batch_{i + 1}", temp_result)
-                logger.info(f"已保存第{i + 1}批质量审查结果")
-            except Exception as e:
-                logger.error(f"保存第{i + 1}批质量审查结果时出错: {str(e)}")
-
-        logger.info(f"所有测试用例处理完成，共改进{len(all_reviewed_cases)}个测试用例")
-        return all_reviewed_cases
+        根据一个批次的审查反馈改进该批次的测试用例
+        :param batch_index: 批次序号，从0开始
+        :param batch_cases: 本批次的测试用例
+        :param review_feedback: 本批次的审查反馈
+        :return: (改进后的测试用例, 审查评论)
+        """
+        logger.info(f"开始处理第{batch_index + 1}批测试用例，共{len(batch_cases)}个")
+
+        # 审查反馈对批次内所有测试用例相同，只解析一次
+        improvements = self._parse_feedback_once(review_feedback)
+        review_comments = self._extract_review_comments(review_feedback)
+        batch_reviewed_cases = [self._improve_test_case(case, improvements) for case in batch_cases]
+
+        logger.info(f"第{batch_index + 1}批测试用例处理完成")
+        return batch_reviewed_cases, review_comments
+
+    def _save_checkpoint(self, checkpoint_index: int, pending: List[tuple], batch_progress: str) -> None:
+        """
+        将自上次保存以来完成的批次合并保存为一个中间结果，防止因超时丢失数据
+        :param checkpoint_index: 中间结果序号，从1开始
+        :param pending: 待保存批次的(改进后的测试用例, 审查评论)列表
+        :param batch_progress: 已完成批次数/批次总数
+        :return:
+        """
+        reviewed_cases = []
+        review_comments = {}
+        for batch_cases, batch_comments in pending:
+            reviewed_cases.extend(batch_cases)
+            for category, comments in batch_comments.items():
+                review_comments.setdefault(category, []).extend(comments)
+
+        temp_result = {
+            "reviewed_cases": reviewed_cases,  # 只保存本次中间结果包含的批次，而不是累积结果
+            "review_comments": review_comments,
+            "review_date": self._get_current_timestamp(),
+            "review_status": "in_progress",
+            "batch_progress": batch_progress
+        }
+        try:
+            self.agent_io.save_result(f"quality_assurance_batch_{checkpoint_index}", temp_result)
+            logger.info(f"已保存第{checkpoint_index}份质量审查中间结果，进度: {batch_progress}")
+        except Exception as e:
+            logger.error(f"保存第{checkpoint_index}份质量审查中间结果时出错: {str(e)}")
@@ -5,17 +5,23 @@
 # @Date: 2025/8/27 14:30
 """
 
+import concurrent.futures
+import copy
+import functools
+import json
 import logging
 import os
 import re
 import time
-from typing import Dict, List
+from datetime import datetime
+from typing import Dict, List, Optional
 
 import autogen
 from dotenv import load_dotenv
 from src.utils.agent_io import AgentIO
 from src.schemas.communication import TestScenario
 from src.utils.json_parser import UnifiedJSONParser
+from src.utils.llm_cache import ResultCache
 
 load_dotenv()  # 加载环境变量
 logger = logging.getLogger(__name__)  # 获取日志记录器
@@ -24,6 +30,141 @@ api_key = os.getenv("LLM_KEY")
 base_url = os.getenv("BASE_URL")
 model = os.getenv("LLM_MODEL")
 
+# 功能需求文本解析使用的正则，模块加载时编译一次
+# 带编号的条目（支持中文数字），如"1."、"(a)"、"一、"
+_NUMBERED_RE = re.compile(r'^[(（\[【]?[\dA-Za-z一二三四五六七八九十][\]）】\.、]')
+# 项目符号（中英文符号）
+_BULLET_RE = re.compile(r'^[\-\*•›➢▷✓✔⦿◉◆◇■□●○]')
+# 需要清理的特殊字符（含表情符号😀-🙏），供str.translate逐字符删除
+_CLEAN_TABLE = dict.fromkeys(map(ord, '【】〖〗“”‘’§※★☆♀♂'))
+_CLEAN_TABLE.update(dict.fromkeys(range(ord('😀'), ord('🙏') + 1)))
+# 以冒号结尾的小标题
+_TRAILING_COLON_RE = re.compile(r'[：:]$')
+
+# 非空行，逐个匹配而不是一次分割出整条消息的所有行
+_LINE_RE = re.compile(r'[^\n]+')
+
+# markdown代码块标记
+_FENCE_RE = re.compile(r'^```(?:json)?|```$', re.M)
+# 从字符串开头解码JSON，忽略其后多余的内容
+_JSON_DECODER = json.JSONDecoder()
+
+# 删除控制字符（码位小于32）的转换表，供str.translate使用
+_CTRL_TABLE = dict.fromkeys(range(32))
+
+# 功能需求部分的标题关键词（扩展匹配范围）和结束关键词，匹配前行内容已转为小写并去除空格
+_FUNCTIONAL_TITLE_MARKERS = (
+    '功能需求', 'functionalrequirements', '功能列表', '功能点',
+    'feature', 'functional spec', '功能规格', '核心功能'
+)
+_FUNCTIONAL_EXIT_MARKERS = (
+    '非功能需求', 'non-functional', '非功能性需求',
+    '性能需求', '约束条件', '测试场景'
+)
+# 关键词编译为一个正则，一次搜索即可判断是否包含任一关键词
+_FUNCTIONAL_TITLE_RE = re.compile('|'.join(map(re.escape, _FUNCTIONAL_TITLE_MARKERS)))
+_FUNCTIONAL_EXIT_RE = re.compile('|'.join(map(re.escape, _FUNCTIONAL_EXIT_MARKERS)))
+# 有效功能需求应包含的业务动词
+_BUSINESS_VERB_RE = re.compile('应|需要|支持|实现|提供|确保|允许')
+
+
+@functools.lru_cache(maxsize=4096)
+def _classify_functional_line(cleaned_line: str) -> Optional[str]:
+    """
+    判断一行是否为功能需求部分的标题或结束标题，结果按行内容缓存，重复出现的行不再逐个匹配关键词
+    :param cleaned_line: 转为小写并去除空格的行
+    :return: 'enter'表示标题，'exit'表示结束标题，其他行返回None
+    """
+    if _FUNCTIONAL_TITLE_RE.search(cleaned_line):
+        return 'enter'
+    if _FUNCTIONAL_EXIT_RE.search(cleaned_line):
+        return 'exit'
+    return None
+
+
+# 分析结果必需的字段，元组用于按固定顺序填充，集合用于一次判断是否齐全
+_REQUIRED_KEYS = ('functional_requirements', 'non_functional_requirements', 'test_scenarios', 'risk_areas')
+_REQUIRED_KEY_SET = frozenset(_REQUIRED_KEYS)
+
+# 默认分析结果的模板，使用不可变的元组，测试场景为(id, description)
+_DEFAULT_RESULT = {
+    "functional_requirements": ("需要提供具体的功能需求",),
+    "non_functional_requirements": ("需要提供具体的非功能需求",),
+    "test_scenarios": (("TS001", "需要提供具体的测试场景"),),
+    "risk_areas": ("需要评估具体的风险领域",),
+}
+
+
+def _make_default_result() -> Dict:
+    """按模板生成新的默认分析结果，调用方可以随意修改其中的列表"""
+    result = {key: list(values) for key, values in _DEFAULT_RESULT.items()}
+    result["test_scenarios"] = [
+        TestScenario(id=scenario_id, description=description, test_cases=[])
+        for scenario_id, description in _DEFAULT_RESULT["test_scenarios"]
+    ]
+    return result
+
+
+def _markers_re(*markers: str) -> re.Pattern:
+    """将多个关键词编译为一个忽略大小写的正则，一次搜索即可判断是否包含任一关键词"""
+    return re.compile('|'.join(map(re.escape, markers)), re.IGNORECASE)
+
+
+# 其余部分的解析规则：(进入标题正则, 结束标题正则, 需要过滤的内容前缀)
+_SECTION_RULES = {
+    'non_functional_requirements': (
+        _markers_re('2. 非功能需求', '非功能需求:', '非功能需求：', '### 2. 非功能需求'),
+        _markers_re('3. 测试场景', '测试场景:', '测试场景：', '### 3. 测试场景'),
+        ('2.', '二、', '非功能需求', '需求', '要求', '**', '#')
+    ),
+    'test_scenarios': (
+        _markers_re('3. 测试场景', '测试场景:', '测试场景：', '### 3. 测试场景'),
+        _markers_re('4. 风险领域', '风险领域:', '风险领域：', '### 4. 风险领域'),
+        ('3.', '三、', '测试场景', '场景', '**', '#')
+    ),
+    'risk_areas': (
+        _markers_re('4. 风险领域', '风险领域:', '风险领域：', '### 4. 风险领域'),
+        re.compile(r'^5\.'),  # 以"5."开头的行表示风险领域部分结束
+        ('4.', '四、', '风险领域', '风险', '**', '#')
+    ),
+}
+
+
+def _leading_digit(line: str) -> bool:
+    """
+    判断前两个字符中是否含有数字（带编号的条目）
+    使用str.isdigit判断，①、²等Unicode数字编号同样识别为数字
+    :param line: 已清理的行
+    :return: 含有数字时返回True
+    """
+    return any(char.isdigit() for char in line[:2])
+
+
+def _clean_section_item(line: str, skip_prefixes: tuple) -> str:
+    """
+    去除条目的编号、破折号等标记
+    :param line: 已清理的行
+    :param skip_prefixes: 需要过滤的内容前缀（标题行、特殊标记）
+    :return: 条目内容，需要过滤时返回空字符串
+    """
+    content = line
+    # 处理带有编号、破折号或其他标记的行
+    if content.startswith(('-', '*', '•')):
+        content = content[1:].strip()
+    elif _leading_digit(line):
+        for sep in ['.', '、', '）', ')', ']']:
+            if sep in line:
+                content = line.split(sep, 1)[1]
+                break
+    content = content.strip()
+    # 过滤掉标题行、空内容和特殊标记（前缀中没有字母，无需转换大小写）
+    if not content or content.startswith(skip_prefixes):
+        return ''
+    # 如果内容以破折号开头，去掉破折号
+    if content.startswith('-'):
+        content = content[1:].strip()
+    return content
+
 
 class RequirementAnalystAgent:
 
@@ -42,6 +183,10 @@ class RequirementAnalystAgent:
         # 初始化统一的JSON解析器
         self.json_parser = UnifiedJSONParser()
 
+        # 分析结果的持久化缓存，相同的需求文档再次分析时直接返回之前的结果，过期的缓存文件会被删除
+        # 默认不启用，设置RA_CACHE_TTL(缓存有效期，秒)后启用
+        self.analysis_cache = ResultCache(self.agent_io, "ra_cache", ttl=float(os.getenv("RA_CACHE_TTL", "0")))
+
         self.agent = autogen.AssistantAgent(
             name="requirement_analyst",
             system_message=
@@ -101,6 +246,18 @@ class RequirementAnalystAgent:
             llm_config={"config_list": self.config_list},
         )
 
+        # 结果在单个后台线程中按提交顺序写盘，分析结果不必等待写文件即可返回
+        self._io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ra_io")
+        self._pending_writes: List[concurrent.futures.Future] = []
+
+        # 用户代理只创建一次，每次分析时复用
+        self.user_proxy = autogen.UserProxyAgent(
+            name="user_proxy",
+            system_message="需求文档提供者",
+            human_input_mode="NEVER",
+            code_execution_config={"use_docker": False}
+        )
+
         # 添加last_analysis属性，用于跟踪最近的分析结果
         self.last_analysis = None
 
@@ -111,29 +268,18 @@ class RequirementAnalystAgent:
             # 检查输入文档是否为空
             if not doc_content or not doc_content.strip():
                 logger.warning("输入文档为空，返回默认分析结果")
-                from src.schemas.communication import TestScenario
-                default_result = {
-                    "functional_requirements": ["需要提供具体的功能需求"],
-                    "non_functional_requirements": ["需要提供具体的非功能需求"],
-                    "test_scenarios": [
-                        TestScenario(
-                            id="TS001",
-                            description="需要提供具体的测试场景",
-                            test_cases=[]
-                        )
-                    ],
-                    "risk_areas": ["需要评估具体的风险领域"]
-                }
-                self.last_analysis = default_result
-                return default_result
-
-            # 创建用户代理进行交互
-            user_proxy = autogen.UserProxyAgent(
-                name="user_proxy",
-                system_message="需求文档提供者",
-                human_input_mode="NEVER",
-                code_execution_config={"use_docker": False}
-            )
+                return self._get_default_result()
+
+            # 相同的需求文档已经分析过时直接返回缓存的结果，跳过LLM调用
+            cache_key = self.analysis_cache.cache_key(doc_content)
+            cached = self.analysis_cache.lookup(cache_key)
+            if cached is not None:
+                logger.info("命中需求分析缓存，跳过LLM分析")
+                # 缓存以JSON保存，测试场景需要重新构建为TestScenario对象
+                structured_result = self._build_structured_result(cached)
+                self._save_in_background(structured_result)
+                self.last_analysis = structured_result
+                return structured_result
 
             # 构建消息内容
             message_content = "请分析以下需求文档并提取关键测试点，必须以JSON格式返回结果：\n\n"
@@ -154,32 +300,21 @@ class RequirementAnalystAgent:
             message_content += "4. 不要添加任何额外的说明文字\n"
 
             # 初始化需求分析对话
-            user_proxy.initiate_chat(
-                self.agent,
-                message=message_content,
-                max_turns=1
-            )
+            response_str = self._chat(message_content)
 
             # 处理代理响应并生成标准JSON
             try:
-                response = self.agent.last_message()
-                if not response:
+                if not response_str:
                     logger.warning("需求分析代理返回空响应")
                     return self._get_default_result()
 
-                # 确保response是字符串类型
-                if isinstance(response, dict) and 'content' in response:
-                    response_str = response['content']
-                else:
-                    response_str = str(response)
-
                 logger.info(f"AI响应内容: {response_str[:200]}...")  # 只打印前200个字符避免日志过长
 
-                # 导入TestScenario类
-                from src.schemas.communication import TestScenario
-
                 # 使用统一的JSON解析器
                 structured_result = self.json_parser.parse(response_str, "requirement_analysis")
+                if not structured_result:
+                    # 响应本身是JSON时先尝试修复后重新解析，避免进入逐行的文本解析
+                    structured_result = self._reparse_json_response(response_str)
 
                 if structured_result:
                     # 构建结构化结果
@@ -187,13 +322,8 @@ class RequirementAnalystAgent:
                     logger.info("成功从JSON响应中提取分析结果")
                 else:
                     logger.warning("无法从响应中提取有效的JSON，尝试使用文本解析方法")
-                    # 使用文本解析方法作为备用方案
-                    structured_result = {
-                        "functional_requirements": self._extract_functional_reqs(response_str),
-                        "non_functional_requirements": self._extract_non_functional_reqs(response_str),
-                        "test_scenarios": self._extract_test_scenarios(response_str),
-                        "risk_areas": self._extract_risk_areas(response_str)
-                    }
+                    # 使用文本解析方法作为备用方案，单次遍历提取所有部分
+                    structured_result = self._extract_all_sections(response_str)
 
                     # 验证结果并填充缺失字段
                 if not self._validate_analysis_result(structured_result):
@@ -201,7 +331,7 @@ class RequirementAnalystAgent:
                     self._fill_missing_requirements(structured_result)
 
                     # 保存分析结果
-                self.agent_io.save_result('requirement_analyst', structured_result)
+                self._save_in_background(structured_result, cache_key)
 
                 # 保存到last_analysis属性
                 self.last_analysis = structured_result
@@ -219,324 +349,318 @@ class RequirementAnalystAgent:
             logger.error(f"需求分析错误: {str(e)}")
             raise
 
-    def _extract_functional_reqs(self, message: str) -> List[str]:
-        """从代理消息中提取功能需求。"""
-        try:
-            if not message:
-                logger.warning("输入消息为空")
-                return []
-
-            # 将消息分割成段落并找到功能需求部分
-            sections = message.split('\n')
-            functional_reqs = []
-            in_functional_section = False
-
-            for line in sections:
-                # 清理特殊字符和空白
-                line = ''.join(char for char in line.strip() if ord(char) >= 32)
-                if not line:
-                    continue
-
-                # 支持多种标题格式（增强匹配逻辑）
-                cleaned_line = line.lower().replace('：', ':').replace(' ', '')
-                # 扩展标题关键词匹配范围
-                title_patterns = [
-                    '功能需求', 'functionalrequirements', '功能列表', '功能点',
-                    'feature', 'functional spec', '功能规格', '核心功能'
-                ]
-                exit_patterns = [
-                    '非功能需求', 'non-functional', '非功能性需求',
-                    '性能需求', '约束条件', '测试场景'
-                ]
-
-                if any(marker in cleaned_line for marker in title_patterns):
-                    in_functional_section = True
-                    logger.debug(f"进入功能需求解析区块: {line}")
-                    continue
-                elif any(marker in cleaned_line for marker in exit_patterns):
-                    in_functional_section = False
-                    logger.debug(f"退出功能需求解析区块: {line}")
-                    break
-                elif in_functional_section:
-                    # 改进内容提取逻辑（支持更多格式）
-                    content = line.strip()
-
-                    # 处理带编号的条目（增强正则表达式，支持中文数字）
-                    numbered_pattern = r'^[(（\[【]?[\dA-Za-z一二三四五六七八九十][\]）】\.、]'
-                    if re.match(numbered_pattern, content):
-                        content = re.sub(numbered_pattern, '', content).strip()
-                        logger.debug(f"处理编号内容: {content}")
-
-                    # 处理项目符号（扩展符号列表，增加中英文符号）
-                    bullet_pattern = r'^[\-\*•›➢▷✓✔⦿◉◆◇■□●○]'
-                    if re.match(bullet_pattern, content):
-                        content = content[1:].strip()
-                        logger.debug(f"处理项目符号内容: {content}")
-
-                    # 清理特殊字符（增加现代符号过滤）
-                    content = re.sub(r'[【】〖〗“”‘’😀-🙏§※★☆♀♂]', '', content).strip()
-
-                    # 智能过滤条件（增加业务动词校验）
-                    business_verbs = ['应', '需要', '支持', '实现', '提供', '确保', '允许']
-                    if content and 3 < len(content) < 100 and any(verb in content for verb in business_verbs):
-                        logger.info(f"有效功能需求: {content}")
-                        functional_reqs.append(content)
-                        continue
-
-                    # 记录过滤详情便于调试
-                    logger.warning(
-                        f"过滤无效内容 | 原句: {line} | 处理后: {content} | 原因: {'长度不符' if len(content) <= 3 or len(content) >= 100 else '缺少业务动词'}")
-                    content = re.sub(r'[【】〖〗“”‘’😀-🙏]', '', content).strip()
-                    content = re.sub(r'[【】〖〗“”‘’]', '', content).strip()
-
-                    # 智能过滤条件（保留包含动词的条目）
-                    if content and len(content) > 3 and not re.search(r'[：:]$', content):
-                        # 记录解析过程
-                        logger.debug(f"提取到功能需求条目: {content}")
-                        functional_reqs.append(content)
-                        continue
-
-                    logger.debug(f"过滤无效内容: {line}")
-                    # 如果内容以破折号开头，去掉破折号
-                    if content.startswith('-'):
-                        content = content[1:].strip()
-                    functional_reqs.append(content)
-
-            # 如果没有找到任何功能需求，返回默认值
-            if not functional_reqs:
-                logger.warning("未找到有效的功能需求，使用默认值")
-                functional_reqs = ["需要提供具体的功能需求"]
+    def analyze_batch(self, docs: List[str]) -> List[Dict]:
+        """
+        批量分析多个需求文档，未命中缓存的文档合并为一次LLM调用，分摊每次调用的网络延迟
+        批量响应中缺少某个文档的结果时，单独调用analyze补充分析
+        :param docs: 需求文档内容列表
+        :return: 与docs顺序一致的分析结果列表
+        """
+        results: List[Optional[Dict]] = [None] * len(docs)
+        pending = []
+        for i, doc in enumerate(docs):
+            if not doc or not doc.strip():
+                results[i] = self._get_default_result()
+                continue
+            cached = self.analysis_cache.lookup(self.analysis_cache.cache_key(doc))
+            if cached is not None:
+                results[i] = self._build_structured_result(cached)
             else:
-                logger.info(f"成功提取{len(functional_reqs)}个功能需求")
-
-            return functional_reqs
-        except Exception as e:
-            logger.error(f"提取功能需求错误: {str(e)}")
-            return []
-
-    def _extract_non_functional_reqs(self, message: str) -> List[str]:
-        """从代理消息中提取非功能需求。"""
-        try:
-            if not message:
-                logger.warning("输入消息为空")
-                return []
+                pending.append(i)
 
-            sections = message.split('\n')
-            non_functional_reqs = []
-            in_non_functional_section = False
-
-            for line in sections:
-                line = ''.join(char for char in line.strip() if ord(char) >= 32)
-                if not line:
-                    continue
-
-                # 支持多种标题格式
-                if any(marker in line.lower() for marker in
-                       ['2. 非功能需求', '非功能需求:', '非功能需求：', '### 2. 非功能需求']):
-                    in_non_functional_section = True
+        if len(pending) > 1:
+            logger.info(f"批量分析{len(pending)}个需求文档")
+            try:
+                parsed_results = self._request_batch_analysis([docs[i] for i in pending])
+            except Exception as e:
+                logger.error(f"批量需求分析错误: {str(e)}")
+                parsed_results = []
+            for i, parsed in zip(pending, parsed_results):
+                if not parsed:
                     continue
-                elif any(marker in line.lower() for marker in
-                         ['3. 测试场景', '测试场景:', '测试场景：', '### 3. 测试场景']):
-                    in_non_functional_section = False
-                    break
-                elif in_non_functional_section:
-                    # 过滤掉编号和空行
-                    content = line
-                    # 处理带有编号、破折号或其他标记的行
-                    if content.startswith(('-', '*', '•')):
-                        content = content[1:].strip()
-                    elif any(char.isdigit() for char in line[:2]):
-                        for sep in ['.', '、', '）', ')', ']']:
-                            if sep in line:
-                                try:
-                                    content = line.split(sep, 1)[1]
-                                    break
-                                except IndexError:
-                                    continue
-                    content = content.strip()
-                    # 过滤掉标题行、空内容和特殊标记
-                    if content and not any(content.lower().startswith(prefix.lower()) for prefix in
-                                           ['2.', '二、', '非功能需求', '需求', '要求', '**', '#']):
-                        # 如果内容以破折号开头，去掉破折号
-                        if content.startswith('-'):
-                            content = content[1:].strip()
-                        non_functional_reqs.append(content)
-
-            return non_functional_reqs
-        except Exception as e:
-            logger.error(f"提取非功能需求错误: {str(e)}")
-            return []
+                structured_result = self._build_structured_result(parsed)
+                if not self._validate_analysis_result(structured_result):
+                    self._fill_missing_requirements(structured_result)
+                # 写入的是结果的副本，调用方修改返回的结果不会影响写入的内容
+                self._pending_writes.append(self._io_pool.submit(
+                    self.analysis_cache.update, self.analysis_cache.cache_key(docs[i]), copy.deepcopy(structured_result)))
+                results[i] = structured_result
+
+        for i in pending:
+            if results[i] is None:
+                results[i] = self.analyze(docs[i])
+
+        if results:
+            self._save_in_background(results[-1])
+            self.last_analysis = results[-1]
+        return results
+
+    def _request_batch_analysis(self, docs: List[str]) -> List[Optional[Dict]]:
+        """
+        在一条消息中发送多个需求文档，并按文档序号拆分返回的分析结果
+        :param docs: 需求文档内容列表
+        :return: 与docs顺序一致的解析结果，缺失的文档为None
+        """
+        message_content = f"请分别分析以下{len(docs)}个需求文档并提取关键测试点，每个文档以\"---DOC 序号---\"开头：\n"
+        for i, doc in enumerate(docs):
+            message_content += f"\n---DOC {i}---\n{doc}\n"
+        message_content += "\n\n你必须严格按照以下JSON格式返回所有文档的分析结果，results中每一项对应一个文档：\n"
+        message_content += """
+    {
+        "results": [
+            {
+                "doc_index": 0, #文档序号
+                "functional_requirements": [], #功能需求
+                "non_functional_requirements": [], #非功能需求
+                "test_scenarios": [], #测试场景
+                "risk_areas": [] #风险点
+            }
+        ]
+    }
+                """
+        message_content += "\n\n注意：\n"
+        message_content += "1. 必须返回有效的JSON格式\n"
+        message_content += "2. 所有文本必须使用双引号\n"
+        message_content += "3. 每个文档都必须有对应的分析结果\n"
+        message_content += "4. 不要添加任何额外的说明文字\n"
+
+        response_str = self._chat(message_content)
+        parsed = None
+        if response_str:
+            parsed = (self.json_parser.parse(response_str, "requirement_analysis_batch")
+                      or self._reparse_json_response(response_str))
+        items = parsed.get("results") if isinstance(parsed, dict) else None
+        if not isinstance(items, list):
+            logger.warning("无法从批量分析响应中提取结果列表")
+            return [None] * len(docs)
+
+        results: List[Optional[Dict]] = [None] * len(docs)
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            # 优先按doc_index对应文档，缺少序号时按返回顺序对应
+            index = item.get("doc_index", position)
+            if isinstance(index, int) and 0 <= index < len(docs) and results[index] is None:
+                results[index] = item
+        return results
+
+    def _chat(self, message_content: str) -> Optional[str]:
+        """
+        向需求分析代理发送消息
+        :param message_content: 消息内容
+        :return: 代理响应文本，没有响应时返回None
+        """
+        # 复用实例上的user_proxy，开始新的对话前清空上一次的对话历史
+        self.user_proxy.reset()
+        self.user_proxy.initiate_chat(
+            self.agent,
+            message=message_content,
+            max_turns=1
+        )
 
-    def _extract_test_scenarios(self, message: str) -> List[TestScenario]:
-        """从代理消息中提取测试场景，并转换为TestScenario对象列表。"""
+        response = self.agent.last_message()
+        if not response:
+            return None
+        # 确保response是字符串类型
+        if isinstance(response, dict) and 'content' in response:
+            return response['content']
+        return str(response)
+
+    def _save_in_background(self, structured_result: Dict, cache_key: Optional[str] = None):
+        """
+        在后台线程中保存分析结果，并在给定缓存键时写入分析缓存
+        :param structured_result: 分析结果
+        :param cache_key: 分析缓存的键，为None时不写入缓存
+        :return: 保存任务的Future
+        """
+        # 结果会返回给调用方并可能被修改，提交前先复制一份，保证写入的是此刻的内容
+        snapshot = copy.deepcopy(structured_result)
+
+        def _save():
+            self.agent_io.save_result('requirement_analyst', snapshot)
+            if cache_key is not None:
+                self.analysis_cache.update(cache_key, snapshot)
+
+        # save_result出错时会自行记录日志
+        future = self._io_pool.submit(_save)
+        self._pending_writes.append(future)
+        return future
+
+    def flush(self) -> None:
+        """等待所有已提交的结果写入完成。"""
+        pending, self._pending_writes = self._pending_writes, []
+        concurrent.futures.wait(pending)
+
+    def close(self) -> None:
+        """等待结果写入完成后关闭后台写入线程，关闭后不能再分析需求文档。"""
+        self.flush()
+        self._io_pool.shutdown(wait=True)
+
+    def _reparse_json_response(self, response_str: str) -> Optional[Dict]:
+        """
+        去掉markdown代码块标记后重新解析以"{"开头的响应
+        :param response_str: 代理响应
+        :return: 解析出的字典，响应不是JSON或仍无法解析时返回None
+        """
+        unfenced = _FENCE_RE.sub('', response_str).strip()
+        if not unfenced.startswith('{'):
+            return None
+
+        # 从开头直接解码，可以忽略JSON之后多余的说明文字
+        try:
+            parsed, _ = _JSON_DECODER.raw_decode(unfenced)
+            if isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+        if unfenced == response_str:
+            return None
+        return self.json_parser.parse(unfenced, "requirement_analysis")
+
+    def _extract_all_sections(self, message: str) -> Dict:
+        """单次遍历代理消息，同时提取功能需求、非功能需求、测试场景和风险领域。
+
+        四个部分各自维护解析状态，每行只分割和清理一次，再交给尚未结束的部分处理，
+        结果与分别遍历整条消息时相同。
+        """
+        functional_reqs = []
+        sections = {key: [] for key in _SECTION_RULES}
         try:
             if not message:
                 logger.warning("输入消息为空")
-                return []
-
-            sections = message.split('\n')
-            scenario_descriptions = []
-            in_scenarios_section = False
-
-            for line in sections:
-                line = ''.join(char for char in line.strip() if ord(char) >= 32)
-                if not line:
-                    continue
+            else:
+                # 各部分的解析状态：None表示尚未进入，True表示正在解析，False表示已结束
+                functional_state = None
+                states = dict.fromkeys(_SECTION_RULES)
+                # 已结束的部分数量，每个部分只会结束一次
+                ended = 0
+
+                # 逐行惰性匹配，提前结束时不必为剩余内容创建子串
+                for match in _LINE_RE.finditer(message):
+                    # 清理特殊字符和空白
+                    line = match.group().strip().translate(_CTRL_TABLE)
+                    if not line:
+                        continue
 
-                # 支持多种标题格式
-                if any(marker in line.lower() for marker in
-                       ['3. 测试场景', '测试场景:', '测试场景：', '### 3. 测试场景']):
-                    in_scenarios_section = True
-                    continue
-                elif any(marker in line.lower() for marker in
-                         ['4. 风险领域', '风险领域:', '风险领域：', '### 4. 风险领域']):
-                    in_scenarios_section = False
-                    break
-                elif in_scenarios_section:
-                    # 过滤掉编号和空行
-                    content = line
-                    # 处理带有编号、破折号或其他标记的行
-                    if content.startswith(('-', '*', '•')):
-                        content = content[1:].strip()
-                    elif any(char.isdigit() for char in line[:2]):
-                        for sep in ['.', '、', '）', ')', ']']:
-                            if sep in line:
-                                try:
-                                    content = line.split(sep, 1)[1]
-                                    break
-                                except IndexError:
-                                    continue
-                    content = content.strip()
-                    # 过滤掉标题行、空内容和特殊标记
-                    if content and not any(content.lower().startswith(prefix.lower()) for prefix in
-                                           ['3.', '三、', '测试场景', '场景', '**', '#']):
-                        # 如果内容以破折号开头，去掉破折号
-                        if content.startswith('-'):
-                            content = content[1:].strip()
-                        scenario_descriptions.append(content)
-
-            # 将提取的描述转换为TestScenario对象
-            test_scenarios = []
-            for i, description in enumerate(scenario_descriptions):
-                scenario_id = f"TS{(i + 1):03d}"  # 生成格式为TS001, TS002的ID
-                test_scenarios.append(TestScenario(
-                    id=scenario_id,
-                    description=description,
-                    test_cases=[]
-                ))
+                    if functional_state is not False:
+                        functional_state = self._scan_functional_line(line, functional_state, functional_reqs)
+
+                    for key, (enter_re, exit_re, skip_prefixes) in _SECTION_RULES.items():
+                        if states[key] is False:
+                            continue
+                        # 支持多种标题格式
+                        if enter_re.search(line):
+                            states[key] = True
+                        elif exit_re.search(line):
+                            states[key] = False
+                            ended += 1
+                        elif states[key]:
+                            content = _clean_section_item(line, skip_prefixes)
+                            if content:
+                                sections[key].append(content)
+
+                    # 所有部分都已结束时不再继续遍历
+                    if functional_state is False and ended == len(states):
+                        break
+        except Exception as e:
+            logger.error(f"提取分析结果错误: {str(e)}")
 
-            # 如果没有提取到任何场景，添加一个默认场景
-            if not test_scenarios:
-                test_scenarios.append(TestScenario(
-                    id="TS001",
-                    description="需要提供具体的测试场景",
-                    test_cases=[]
-                ))
+        # 如果没有找到任何功能需求，返回默认值
+        if not functional_reqs:
+            logger.warning("未找到有效的功能需求，使用默认值")
+            functional_reqs = ["需要提供具体的功能需求"]
+        else:
+            logger.info(f"成功提取{len(functional_reqs)}个功能需求")
 
-            return test_scenarios
-        except Exception as e:
-            logger.error(f"提取测试场景错误: {str(e)}")
-            # 返回一个默认的TestScenario对象
-            return [TestScenario(
+        # 将提取的描述转换为TestScenario对象，生成格式为TS001, TS002的ID
+        test_scenarios = [
+            TestScenario(id=f"TS{(i + 1):03d}", description=description, test_cases=[])
+            for i, description in enumerate(sections['test_scenarios'])
+        ]
+        # 如果没有提取到任何场景，添加一个默认场景
+        if not test_scenarios:
+            test_scenarios.append(TestScenario(
                 id="TS001",
-                description="提取测试场景时发生错误",
+                description="需要提供具体的测试场景",
                 test_cases=[]
-            )]
+            ))
 
-    def _extract_risk_areas(self, message: str) -> List[str]:
-        """从代理消息中提取风险领域。"""
-        try:
-            if not message:
-                logger.warning("输入消息为空")
-                return []
-
-            sections = message.split('\n')
-            risk_areas = []
-            in_risks_section = False
-
-            for line in sections:
-                line = ''.join(char for char in line.strip() if ord(char) >= 32)
-                if not line:
-                    continue
+        return {
+            "functional_requirements": functional_reqs,
+            "non_functional_requirements": sections['non_functional_requirements'],
+            "test_scenarios": test_scenarios,
+            "risk_areas": sections['risk_areas']
+        }
 
-                # 支持多种标题格式
-                if any(marker in line.lower() for marker in
-                       ['4. 风险领域', '风险领域:', '风险领域：', '### 4. 风险领域']):
-                    in_risks_section = True
-                    continue
-                elif line.startswith('5.') or not line.strip():
-                    in_risks_section = False
-                    break
-                elif in_risks_section:
-                    # 过滤掉编号和空行
-                    content = line
-                    # 处理带有编号、破折号或其他标记的行
-                    if content.startswith(('-', '*', '•')):
-                        content = content[1:].strip()
-                    elif any(char.isdigit() for char in line[:2]):
-                        for sep in ['.', '、', '）', ')', ']']:
-                            if sep in line:
-                                try:
-                                    content = line.split(sep, 1)[1]
-                                    break
-                                except IndexError:
-                                    continue
-                    content = content.strip()
-                    # 过滤掉标题行、空内容和特殊标记
-                    if content and not any(content.lower().startswith(prefix.lower()) for prefix in
-                                           ['4.', '四、', '风险领域', '风险', '**', '#']):
-                        # 如果内容以破折号开头，去掉破折号
-                        if content.startswith('-'):
-                            content = content[1:].strip()
-                        risk_areas.append(content)
-
-            return risk_areas
-        except Exception as e:
-            logger.error(f"提取风险领域错误: {str(e)}")
-            return []
+    def _scan_functional_line(self, line: str, in_functional_section, functional_reqs: List[str]):
+        """
+        处理一行功能需求部分的内容
+        :param line: 已清理的行
+        :param in_functional_section: 当前解析状态，None为尚未进入，True为正在解析
+        :param functional_reqs: 提取到的功能需求，有效条目追加到其中
+        :return: 新的解析状态，False表示功能需求部分已结束
+        """
+        # 支持多种标题格式（增强匹配逻辑）
+        line_type = _classify_functional_line(line.lower().replace('：', ':').replace(' ', ''))
+        if line_type == 'enter':
+            logger.debug(f"进入功能需求解析区块: {line}")
+            return True
+        if line_type == 'exit':
+            logger.debug(f"退出功能需求解析区块: {line}")
+            return False
+        if not in_functional_section:
+            return in_functional_section
+
+        # 改进内容提取逻辑（支持更多格式）
+        content = line.strip()
+
+        # 处理带编号的条目（增强正则表达式，支持中文数字）
+        numbered = _NUMBERED_RE.match(content)
+        if numbered:
+            content = content[numbered.end():].strip()
+            logger.debug(f"处理编号内容: {content}")
+
+        # 处理项目符号（扩展符号列表，增加中英文符号）
+        if _BULLET_RE.match(content):
+            content = content[1:].strip()
+            logger.debug(f"处理项目符号内容: {content}")
+
+        # 清理特殊字符（增加现代符号过滤）
+        content = content.translate(_CLEAN_TABLE).strip()
+
+        # 智能过滤条件：包含业务动词且长度合适的条目，或不是以冒号结尾的小标题的条目
+        if content and len(content) > 3 and (
+                (len(content) < 100 and _BUSINESS_VERB_RE.search(content))
+                or not _TRAILING_COLON_RE.search(content)):
+            logger.debug(f"提取到功能需求条目: {content}")
+            functional_reqs.append(content)
+        else:
+            logger.debug(f"过滤无效内容: {line}")
+        return True
 
     def _validate_analysis_result(self, result: Dict) -> bool:
         """验证分析结果的完整性。"""
-        required_keys = ['functional_requirements', 'non_functional_requirements',
-                         'test_scenarios', 'risk_areas']
-
-        # 检查所有必需的键是否存在且不为空
-        for key in required_keys:
-            if key not in result or not isinstance(result[key], list):
-                return False
-        return True
+        # 检查所有必需的键是否存在且为列表
+        if not result.keys() >= _REQUIRED_KEY_SET:
+            return False
+        return all(isinstance(result[key], list) for key in _REQUIRED_KEYS)
 
     def _fill_missing_requirements(self, result: Dict):
         """填充缺失的需求字段。"""
         default_value = ["需要补充具体内容"]
-        required_keys = ['functional_requirements', 'non_functional_requirements',
-                         'test_scenarios', 'risk_areas']
 
-        for key in required_keys:
+        for key in _REQUIRED_KEYS:
             if key not in result or not result[key]:
                 result[key] = default_value.copy()
 
     def _get_default_result(self):
         """返回默认的分析结果。"""
-        from src.schemas.communication import TestScenario
-        default_result = {
-            "functional_requirements": ["需要提供具体的功能需求"],
-            "non_functional_requirements": ["需要提供具体的非功能需求"],
-            "test_scenarios": [
-                TestScenario(
-                    id="TS001",
-                    description="需要提供具体的测试场景",
-                    test_cases=[]
-                )
-            ],
-            "risk_areas": ["需要评估具体的风险领域"]
-        }
+        default_result = _make_default_result()
         self.last_analysis = default_result
         return default_result
 
     def _get_current_timestamp(self) -> str:
         """获取当前时间戳"""
-        from datetime import datetime
         return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     def _build_structured_result(self, parsed_result: Dict) -> Dict:
@@ -549,15 +673,16 @@ class RequirementAnalystAgent:
 
         # 处理test_scenarios字段
         if "test_scenarios" in parsed_result and isinstance(parsed_result["test_scenarios"], list):
-            test_scenarios = []
-            for scenario in parsed_result["test_scenarios"]:
-                if isinstance(scenario, dict):
-                    test_scenarios.append(TestScenario(
-                        id=scenario.get("id", f"TS{len(test_scenarios) + 1:03d}"),
-                        description=scenario.get("description", ""),
-                        test_cases=scenario.get("test_cases", [])
-                    ))
-            structured_result["test_scenarios"] = test_scenarios
+            # 只保留字典类型的场景，缺少id时按场景序号生成
+            scenarios = [scenario for scenario in parsed_result["test_scenarios"] if isinstance(scenario, dict)]
+            structured_result["test_scenarios"] = [
+                TestScenario(
+                    id=scenario.get("id", f"TS{i + 1:03d}"),
+                    description=scenario.get("description", ""),
+                    test_cases=scenario.get("test_cases", [])
+                )
+                for i, scenario in enumerate(scenarios)
+            ]
         else:
             structured_result["test_scenarios"] = [
                 TestScenario(
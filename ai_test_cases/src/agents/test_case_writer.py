@@ -5,16 +5,28 @@
 # @Date: 2025/8/28 09:35
 """
 
+import concurrent.futures
+import copy
+import functools
+import glob
 import logging
 import os
+import queue
 import re
 import json
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 
 import autogen
 from dotenv import load_dotenv
+from src.utils import json_codec
 from src.utils.agent_io import AgentIO
 from src.utils.json_parser import UnifiedJSONParser
+from src.utils.review_feedback import FEEDBACK_SECTIONS, parse_feedback_sections
+
+try:
+    import ahocorasick
+except ImportError:  # 未安装pyahocorasick时逐个功能点匹配标题
+    ahocorasick = None
 
 load_dotenv()  # 加载环境变量
 logger = logging.getLogger(__name__)  # 获取日志记录器
@@ -23,6 +35,116 @@ api_key = os.getenv("LLM_KEY")
 base_url = os.getenv("BASE_URL")
 model = os.getenv("LLM_MODEL")
 
+# markdown代码块标记
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*$', re.M)
+
+
+# 文本格式响应中的字段标识行，如"ID: TC001"、"Expected Results:"，匹配时忽略大小写
+_FIELD_RE = re.compile(r'(id|title|description|preconditions|steps|expected results|priority|category):(.*)',
+                       re.IGNORECASE)
+# 字段标识到测试用例字段名的映射
+_FIELD_KEYS = {
+    'id': 'id',
+    'title': 'title',
+    'description': 'description',
+    'preconditions': 'preconditions',
+    'steps': 'steps',
+    'expected results': 'expected_results',
+    'priority': 'priority',
+    'category': 'category',
+}
+# 内容在后续行中逐条列出的字段
+_LIST_FIELDS = frozenset(('preconditions', 'steps', 'expected_results'))
+# 空测试用例的原型，字段顺序与JSON格式的测试用例一致，列表字段在复制后替换为新列表
+_EMPTY_CASE = dict.fromkeys(
+    ('id', 'title', 'description', 'preconditions', 'steps', 'expected_results', 'priority', 'category'), ''
+)
+# 测试用例的必需字段
+_REQUIRED_CASE_FIELDS = frozenset(_EMPTY_CASE)
+
+
+def _find_covered_features(test_cases: List[Dict], features) -> set:
+    """
+    查找标题中包含功能点名称（忽略大小写）的功能点
+    安装了pyahocorasick时用所有功能点名称构建自动机，每个标题只需扫描一遍
+    :param test_cases: 测试用例列表
+    :param features: 功能点名称
+    :return: 被测试用例覆盖的功能点集合
+    """
+    # 功能点名称只转换一次小写，相同小写名称的功能点一起匹配
+    names_by_key: Dict[str, List[str]] = {}
+    for feature in features:
+        names_by_key.setdefault(feature.lower(), []).append(feature)
+    total = sum(len(names) for names in names_by_key.values())
+
+    covered = set()
+    if not test_cases:
+        return covered
+    # 空名称包含在任何标题中
+    covered.update(names_by_key.pop('', ()))
+
+    automaton = None
+    if ahocorasick is not None and names_by_key:
+        automaton = ahocorasick.Automaton()
+        for key, names in names_by_key.items():
+            automaton.add_word(key, names)
+        automaton.make_automaton()
+
+    for tc in test_cases:
+        # 从测试用例标题中提取可能的功能点
+        title = tc.get('title', '').lower()
+        if automaton is not None:
+            for _, names in automaton.iter(title):
+                covered.update(names)
+        else:
+            for key, names in names_by_key.items():
+                if key in title:
+                    covered.update(names)
+        # 所有功能点都已覆盖时不再检查剩余的测试用例
+        if len(covered) == total:
+            break
+    return covered
+
+
+def _format_priority_info(priorities: List[Dict]) -> str:
+    """
+    构建提示词中的测试优先级信息
+    :param priorities: 测试策略中的优先级定义
+    :return: 优先级信息文本
+    """
+    return "\n测试优先级:\n" + "".join(
+        f"- {item.get('level', '')}: {item.get('description', '')}\n" for item in priorities
+    )
+
+
+def _format_approach_info(test_approach: Dict) -> str:
+    """
+    构建提示词中的测试方法信息
+    :param test_approach: 测试策略中的测试方法
+    :return: 测试方法信息文本
+    """
+    if not isinstance(test_approach, dict):
+        return "\n测试方法:\n"
+    return "\n测试方法:\n" + "".join(
+        f"- {key}: {', '.join(value) if isinstance(value, list) else value}\n"
+        for key, value in test_approach.items()
+    )
+
+
+def _loads_test_cases(message: str) -> Optional[Dict]:
+    """
+    去掉markdown代码块标记后直接解析响应，响应是完整的测试用例JSON时无需经过统一解析器的多轮清理和修复
+    :param message: 代理响应
+    :return: 包含test_cases列表的字典，无法直接解析时返回None
+    """
+    try:
+        data = json_codec.loads(_FENCE_RE.sub('', message).strip())
+    except ValueError:
+        return None
+    if isinstance(data, dict) and isinstance(data.get('test_cases'), list):
+        return data
+    return None
+
 
 class TestCaseWriterAgent:
     def __init__(self, concurrent_workers: int = 1):
@@ -40,6 +162,13 @@ class TestCaseWriterAgent:
         # 初始化统一的JSON解析器
         self.json_parser = UnifiedJSONParser()
 
+        # 功能点中间结果在单个后台线程中按提交顺序写盘，不阻塞下一个功能点的LLM请求
+        self._io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="tcw_io")
+        self._pending_writes: List[concurrent.futures.Future] = []
+
+        # 按响应内容缓存JSON解析结果，重试和合并时遇到相同的响应不再重复解析
+        self._parse_json_cached = functools.lru_cache(maxsize=256)(self._parse_json_response)
+
         # 设置并发工作线程数
         self.concurrent_workers = max(1, concurrent_workers)  # 确保至少有一个线程
         logger.info(f"测试用例编写代理初始化，设置并发工作线程数为: {self.concurrent_workers}")
@@ -86,12 +215,32 @@ class TestCaseWriterAgent:
             llm_config={"config_list": self.config_list},
         )
 
+        # 生成测试用例时使用的用户代理只创建一次，每个并发工作线程一个，用完放回池中复用
+        self._user_proxy_pool = queue.Queue()
+        for _ in range(self.concurrent_workers):
+            self._user_proxy_pool.put(autogen.UserProxyAgent(
+                name="user_proxy",
+                system_message="测试策略提供者",
+                human_input_mode="NEVER",
+                code_execution_config={"use_docker": False}
+            ))
+
         # 添加last_cases属性，用于跟踪最近生成的测试用例
         self.last_cases = None
 
         # 尝试加载之前的测试用例结果
         self._load_last_cases()
 
+    def _acquire_user_proxy(self):
+        """从池中取出一个用户代理，池为空时等待其他线程归还，取出后清空上一次的对话历史。"""
+        user_proxy = self._user_proxy_pool.get()
+        user_proxy.reset()
+        return user_proxy
+
+    def _release_user_proxy(self, user_proxy) -> None:
+        """将用户代理放回池中。"""
+        self._user_proxy_pool.put(user_proxy)
+
     def _load_last_cases(self):
         """加载之前保存的测试用例结果"""
         try:
@@ -130,47 +279,31 @@ class TestCaseWriterAgent:
 
             logger.info(f"将按{len(feature_groups)}个功能点分批生成测试用例")
 
+            # 优先级和测试方法信息对所有功能点相同，只构建一次
+            priority_info = _format_priority_info(priorities)
+            approach_info = _format_approach_info(test_approach)
+
             # 根据并发工作线程数决定使用并发还是顺序处理
             if self.concurrent_workers > 1:
                 logger.info(f"使用并发方式处理功能点，并发数: {self.concurrent_workers}")
                 all_test_cases = self._generate_feature_test_cases_concurrent(
                     feature_groups=feature_groups,
-                    priorities=priorities,
-                    test_approach=test_approach
+                    priority_info=priority_info,
+                    approach_info=approach_info
                 )
             else:
                 logger.info("使用顺序方式处理功能点")
                 # 分批生成测试用例
                 all_test_cases = []
                 for i, (feature, items) in enumerate(feature_groups.items()):
-                    logger.info(f"开始为功能点 '{feature}' 生成测试用例 ({i + 1}/{len(feature_groups)})")
-
-                    # 为单个功能点生成测试用例
-                    feature_test_cases = self._generate_feature_test_cases(
+                    all_test_cases.extend(self._generate_feature_with_checkpoint(
+                        feature_index=i + 1,
+                        total_features=len(feature_groups),
                         feature=feature,
                         feature_items=items,
-                        priorities=priorities,
-                        test_approach=test_approach
-                    )
-
-                    if feature_test_cases:
-                        all_test_cases.extend(feature_test_cases)
-                        logger.info(f"功能点 '{feature}' 生成了 {len(feature_test_cases)} 个测试用例")
-
-                        # 保存中间结果，防止因超时丢失数据
-                        temp_result = {
-                            "test_cases": feature_test_cases,  # 只保存当前功能点的测试用例
-                            "generation_date": self._get_current_timestamp(),
-                            "generation_status": "in_progress",
-                            "feature_progress": f"{i + 1}/{len(feature_groups)}"
-                        }
-                        try:
-                            self.agent_io.save_result(f"test_case_writer_feature_{i + 1}", temp_result)
-                            logger.info(f"已保存功能点 '{feature}' 的测试用例生成结果")
-                        except Exception as e:
-                            logger.error(f"保存功能点 '{feature}' 的测试用例生成结果时出错: {str(e)}")
-                    else:
-                        logger.warning(f"功能点 '{feature}' 未能生成有效的测试用例")
+                        priority_info=priority_info,
+                        approach_info=approach_info
+                    ))
 
             # 如果没有生成任何测试用例，尝试使用整体生成方式
             if not all_test_cases:
@@ -187,7 +320,8 @@ class TestCaseWriterAgent:
             # 将测试用例保存到文件
             self.agent_io.save_result("test_case_writer", {"test_cases": all_test_cases})
 
-            # 合并所有功能点的测试用例文件
+            # 合并所有功能点的测试用例文件，合并前确保中间结果都已写入
+            self._flush_writes()
             self._merge_feature_test_cases(len(feature_groups))
 
             return all_test_cases
@@ -195,16 +329,14 @@ class TestCaseWriterAgent:
         except Exception as e:
             logger.error(f"测试用例生成错误: {str(e)}")
             raise
+        finally:
+            # 生成失败或提前返回时也等待中间结果写入完成，不留下未完成的写入任务
+            self._flush_writes()
 
     def _generate_all_test_cases(self, test_strategy: Dict) -> List[Dict]:
         """使用整体方式生成所有测试用例。"""
+        user_proxy = self._acquire_user_proxy()
         try:
-            user_proxy = autogen.UserProxyAgent(
-                name="user_proxy",
-                system_message="测试策略提供者",
-                human_input_mode="NEVER",
-                code_execution_config={"use_docker": False}
-            )
 
             # 提取测试覆盖矩阵和优先级信息
             coverage_matrix = test_strategy.get('coverage_matrix', [])
@@ -216,17 +348,8 @@ class TestCaseWriterAgent:
             for item in coverage_matrix:
                 coverage_info += f"- 功能: {item.get('feature', '')}, 测试类型: {item.get('test_type', '')}\n"
 
-            priority_info = "\n测试优先级:\n"
-            for item in priorities:
-                priority_info += f"- {item.get('level', '')}: {item.get('description', '')}\n"
-
-            approach_info = "\n测试方法:\n"
-            if isinstance(test_approach, dict):
-                for key, value in test_approach.items():
-                    if isinstance(value, list):
-                        approach_info += f"- {key}: {', '.join(value)}\n"
-                    else:
-                        approach_info += f"- {key}: {value}\n"
+            priority_info = _format_priority_info(priorities)
+            approach_info = _format_approach_info(test_approach)
 
             # 生成测试用例
             user_proxy.initiate_chat(
@@ -310,48 +433,15 @@ class TestCaseWriterAgent:
                     return []
 
             # 验证测试用例是否与测试覆盖矩阵对应
-            if coverage_matrix and test_cases:
-                # 提取功能点和测试类型的映射关系
-                feature_type_map = {}
-                for item in coverage_matrix:
-                    feature = item.get('feature', '')
-                    test_type = item.get('test_type', '')
-                    if feature not in feature_type_map:
-                        feature_type_map[feature] = set()
-                    if isinstance(test_type, str):
-                        for t in test_type.split(','):
-                            feature_type_map[feature].add(t.strip())
-                    else:
-                        feature_type_map[feature].add(test_type)
-
-                # 检查每个功能点是否被测试用例覆盖
-                covered_features = set()
-                for tc in test_cases:
-                    # 从测试用例标题中提取可能的功能点
-                    title = tc.get('title', '').lower()
-                    for feature in feature_type_map.keys():
-                        if feature.lower() in title:
-                            covered_features.add(feature)
-
-                # 记录覆盖情况
-                logger.info(f"测试覆盖矩阵测试点总数: {len(feature_type_map)}")
-                logger.info(f"已覆盖测试点数量: {len(covered_features)}")
-
-                # 检查是否有未覆盖的功能点
-                uncovered = set(feature_type_map.keys()) - covered_features
-                if uncovered:
-                    logger.warning(f"以下测试点未被测试用例覆盖: {uncovered}")
-
-                    # 如果覆盖率低于80%，记录警告
-                    coverage_rate = len(covered_features) / len(feature_type_map) if feature_type_map else 1.0
-                    if coverage_rate < 0.8:
-                        logger.warning(f"测试用例覆盖率过低: {coverage_rate:.2%}，建议增加测试用例数量")
+            self._validate_coverage(test_cases, coverage_matrix)
 
             return test_cases
 
         except Exception as e:
             logger.error(f"测试用例生成错误: {str(e)}")
             raise
+        finally:
+            self._release_user_proxy(user_proxy)
 
     def _parse_test_cases(self, message) -> List[Dict]:
         """解析Agent响应为结构化的测试用例。"""
@@ -370,8 +460,8 @@ class TestCaseWriterAgent:
                 logger.error(f"消息不是字符串类型: {type(message)}")
                 return []
 
-            # 使用统一的JSON解析器
-            json_data = self.json_parser.parse(message, "test_case_generation")
+            # 解析结果会在验证时被修改，使用缓存结果的副本
+            json_data = copy.deepcopy(self._parse_json_cached(message))
 
             if json_data and 'test_cases' in json_data and isinstance(json_data['test_cases'], list):
                 logger.info(f"成功从JSON响应中解析出 {len(json_data['test_cases'])} 个测试用例")
@@ -402,169 +492,49 @@ class TestCaseWriterAgent:
                 return validated_test_cases
 
             # 如果没有找到JSON格式的响应，尝试使用原来的解析方法
-            sections = message.split('\n')
             test_cases = []
             current_test_case = None
             current_field = None
 
-            for line in sections:
+            for line in message.split('\n'):
                 line = line.strip()
                 if not line:
                     continue
 
-                # 当找到ID时开始新的测试用例
-                if line.lower().startswith('id:'):
-                    if current_test_case:
-                        if self._validate_test_case(current_test_case):
-                            # 规范化优先级格式
-                            if 'priority' in current_test_case and not current_test_case['priority'].startswith('P'):
-                                current_test_case['priority'] = f"P{current_test_case['priority']}" if \
-                                    current_test_case['priority'].isdigit() else current_test_case['priority']
-                            test_cases.append(current_test_case)
-                    current_test_case = {
-                        'id': '',
-                        'title': '',
-                        'description': '',
-                        'preconditions': [],
-                        'steps': [],
-                        'expected_results': [],
-                        'priority': '',
-                        'category': ''
-                    }
-                    current_test_case['id'] = line.split(':', 1)[1].strip()
-                    current_field = 'id'
-
-                # 识别当前正在处理的字段
-                elif line.lower().startswith('title:'):
-                    # 如果遇到标题字段但当前测试用例为空，先创建一个新的测试用例
-                    if not current_test_case:
-                        current_test_case = {
-                            'id': f'TC{len(test_cases) + 1:03d}',  # 自动生成ID
-                            'title': '',
-                            'description': '',
-                            'preconditions': [],
-                            'steps': [],
-                            'expected_results': [],
-                            'priority': '',
-                            'category': ''
-                        }
-                    # 增加空值检查,避免split返回None
-                    title_parts = line.split(':', 1) if line else ['', '']
-                    current_test_case['title'] = title_parts[1].strip() if len(title_parts) > 1 else ''
-                    current_field = 'title'
-                elif line.lower().startswith('description:'):
-                    # 如果遇到描述字段但当前测试用例为空，先创建一个新的测试用例
-                    if not current_test_case:
-                        current_test_case = {
-                            'id': f'TC{len(test_cases) + 1:03d}',  # 自动生成ID
-                            'title': '',
-                            'description': '',
-                            'preconditions': [],
-                            'steps': [],
-                            'expected_results': [],
-                            'priority': '',
-                            'category': ''
-                        }
-                    current_test_case['description'] = line.split(':', 1)[1].strip() if len(
-                        line.split(':', 1)) > 1 else ''
-                    current_field = 'description'
-                elif line.lower().startswith('preconditions:'):
-                    # 如果遇到前置条件字段但当前测试用例为空，先创建一个新的测试用例
-                    if not current_test_case:
-                        current_test_case = {
-                            'id': f'TC{len(test_cases) + 1:03d}',  # 自动生成ID
-                            'title': '',
-                            'description': '',
-                            'preconditions': [],
-                            'steps': [],
-                            'expected_results': [],
-                            'priority': '',
-                            'category': ''
-                        }
-                    current_field = 'preconditions'
-                elif line.lower().startswith('steps:'):
-                    # 如果遇到步骤字段但当前测试用例为空，先创建一个新的测试用例
-                    if not current_test_case:
-                        current_test_case = {
-                            'id': f'TC{len(test_cases) + 1:03d}',  # 自动生成ID
-                            'title': '',
-                            'description': '',
-                            'preconditions': [],
-                            'steps': [],
-                            'expected_results': [],
-                            'priority': '',
-                            'category': ''
-                        }
-                    current_field = 'steps'
-                elif line.lower().startswith('expected results:'):
-                    # 如果遇到预期结果字段但当前测试用例为空，先创建一个新的测试用例
-                    if not current_test_case:
-                        current_test_case = {
-                            'id': f'TC{len(test_cases) + 1:03d}',  # 自动生成ID
-                            'title': '',
-                            'description': '',
-                            'preconditions': [],
-                            'steps': [],
-                            'expected_results': [],
-                            'priority': '',
-                            'category': ''
-                        }
-                    current_field = 'expected_results'
-                elif line.lower().startswith('priority:'):
-                    # 如果遇到优先级字段但当前测试用例为空，先创建一个新的测试用例
-                    if not current_test_case:
-                        current_test_case = {
-                            'id': f'TC{len(test_cases) + 1:03d}',  # 自动生成ID
-                            'title': '',
-                            'description': '',
-                            'preconditions': [],
-                            'steps': [],
-                            'expected_results': [],
-                            'priority': '',
-                            'category': ''
-                        }
-                    current_test_case['priority'] = line.split(':', 1)[1].strip()
-                    current_field = 'priority'
-                elif line.lower().startswith('category:'):
-                    # 如果遇到类别字段但当前测试用例为空，先创建一个新的测试用例
-                    if not current_test_case:
-                        current_test_case = {
-                            'id': f'TC{len(test_cases) + 1:03d}',  # 自动生成ID
-                            'title': '',
-                            'description': '',
-                            'preconditions': [],
-                            'steps': [],
-                            'expected_results': [],
-                            'priority': '',
-                            'category': ''
-                        }
-                    current_test_case['category'] = line.split(':', 1)[1].strip()
-                    current_field = 'category'
+                # 识别字段标识行，如"ID: TC001"、"Expected Results:"
+                field_match = _FIELD_RE.match(line)
+                if field_match:
+                    field = _FIELD_KEYS[field_match.group(1).lower()]
+                    if field == 'id':
+                        # 当找到ID时开始新的测试用例
+                        if current_test_case:
+                            self._append_parsed_case(test_cases, current_test_case)
+                        current_test_case = self._blank_case('')
+                    elif not current_test_case:
+                        # 遇到其他字段但当前测试用例为空，先创建一个新的测试用例并自动生成ID
+                        current_test_case = self._blank_case(f'TC{len(test_cases) + 1:03d}')
+                    # 列表字段的内容在后续行中，其余字段的值在冒号之后
+                    if field not in _LIST_FIELDS:
+                        current_test_case[field] = field_match.group(2).strip()
+                    current_field = field
 
                 # 添加内容到当前字段
                 elif current_test_case and current_field:
-                    if current_field in ['preconditions', 'steps', 'expected_results']:
-                        if line.strip().startswith('-'):
-                            current_test_case[current_field].append(line.strip()[1:].strip())
-                        elif line.strip().startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.', '0.')):
-                            current_test_case[current_field].append(line.strip().split('.', 1)[1].strip())
-                    elif current_field in ['description', 'title']:
-                        # 对于字符串字段，如果当前行不是新的字段标识，则追加到现有内容
-                        if not any(line.lower().startswith(field + ':') for field in
-                                   ['id:', 'title:', 'description:', 'preconditions:', 'steps:', 'expected results:',
-                                    'priority:', 'category:']):
-                            if current_test_case[current_field]:  # 如果已有内容，添加换行
-                                current_test_case[current_field] += ' ' + line.strip()
-                            else:  # 如果没有内容，直接设置
-                                current_test_case[current_field] = line.strip()
+                    if current_field in _LIST_FIELDS:
+                        if line.startswith('-'):
+                            current_test_case[current_field].append(line[1:].strip())
+                        elif line.startswith(('1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.', '0.')):
+                            current_test_case[current_field].append(line.split('.', 1)[1].strip())
+                    elif current_field in ('description', 'title'):
+                        # 对于字符串字段，将当前行追加到现有内容
+                        if current_test_case[current_field]:
+                            current_test_case[current_field] += ' ' + line
+                        else:
+                            current_test_case[current_field] = line
 
             # 如果存在最后一个测试用例则添加
-            if current_test_case and self._validate_test_case(current_test_case):
-                # 规范化优先级格式
-                if 'priority' in current_test_case and not current_test_case['priority'].startswith('P'):
-                    current_test_case['priority'] = f"P{current_test_case['priority']}" if current_test_case[
-                        'priority'].isdigit() else current_test_case['priority']
-                test_cases.append(current_test_case)
+            if current_test_case:
+                self._append_parsed_case(test_cases, current_test_case)
 
             # 如果没有解析出任何测试用例，返回空列表
             if not test_cases:
@@ -576,58 +546,76 @@ class TestCaseWriterAgent:
             logger.error(f"解析测试用例错误: {str(e)}")
             return []
 
+    def _parse_json_response(self, message: str) -> Optional[Dict]:
+        """先直接解析响应，失败时再使用统一的JSON解析器。"""
+        return _loads_test_cases(message) or self.json_parser.parse(message, "test_case_generation")
+
+    def _blank_case(self, case_id: str) -> Dict:
+        """创建字段均为空的测试用例。"""
+        test_case = _EMPTY_CASE.copy()
+        test_case['id'] = case_id
+        # 列表字段每次新建，避免多个测试用例共用同一个列表
+        for field in _LIST_FIELDS:
+            test_case[field] = []
+        return test_case
+
+    def _append_parsed_case(self, test_cases: List[Dict], test_case: Dict) -> None:
+        """验证从文本中解析出的测试用例，通过验证时规范化优先级格式后加入列表。"""
+        if not self._validate_test_case(test_case):
+            return
+        if not test_case['priority'].startswith('P') and test_case['priority'].isdigit():
+            test_case['priority'] = f"P{test_case['priority']}"
+        test_cases.append(test_case)
+
     def _validate_test_case(self, test_case: Dict) -> bool:
         """验证测试用例的结构和内容。"""
         try:
             # 检查是否所有必需字段都存在
-            required_fields = [
-                "id", "title", "description", "preconditions", "steps",
-                "expected_results", "priority", "category"
-            ]
-            if not all(field in test_case for field in required_fields):
-                logger.warning(
-                    f"测试用例缺少必需字段: {[field for field in required_fields if field not in test_case]}")
+            missing_fields = _REQUIRED_CASE_FIELDS - test_case.keys()
+            if missing_fields:
+                logger.warning(f"测试用例缺少必需字段: {sorted(missing_fields)}")
                 return False
+            case_id = test_case['id']
 
             # 验证字段内容
             if not test_case["id"] or not test_case["title"]:
-                logger.warning(f"测试用例ID或标题为空: {test_case.get('id', 'unknown')}")
+                logger.warning(f"测试用例ID或标题为空: {case_id}")
                 return False
 
             # 验证描述字段
             if not test_case["description"]:
-                logger.warning(f"测试用例描述为空: {test_case.get('id', 'unknown')}")
+                logger.warning(f"测试用例描述为空: {case_id}")
                 return False
 
             # 确保步骤和预期结果不为空
             if not test_case["steps"] or not test_case["expected_results"]:
-                logger.warning(f"测试用例步骤或预期结果为空: {test_case.get('id', 'unknown')}")
+                logger.warning(f"测试用例步骤或预期结果为空: {case_id}")
                 return False
 
             # 验证优先级格式（如 P0, P1, P2）
             # 注意：我们在解析时会规范化优先级格式，所以这里不再严格要求格式
             if not test_case["priority"]:
-                logger.warning(f"测试用例优先级为空: {test_case.get('id', 'unknown')}")
+                logger.warning(f"测试用例优先级为空: {case_id}")
                 return False
 
             # 验证类别不为空
             if not test_case["category"]:
-                logger.warning(f"测试用例类别为空: {test_case.get('id', 'unknown')}")
+                logger.warning(f"测试用例类别为空: {case_id}")
                 return False
 
             # 验证前置条件是否为列表
             if not isinstance(test_case["preconditions"], list):
-                logger.warning(f"测试用例前置条件不是列表: {test_case.get('id', 'unknown')}")
+                logger.warning(f"测试用例前置条件不是列表: {case_id}")
                 test_case["preconditions"] = [test_case["preconditions"]] if test_case["preconditions"] else []
 
             # 验证步骤是否为列表
             if not isinstance(test_case["steps"], list):
-                logger.warning(f"测试用例步骤不是列表: {test_case.get('id', 'unknown')}")
+                logger.warning(f"测试用例步骤不是列表: {case_id}")
                 test_case["steps"] = [test_case["steps"]] if test_case["steps"] else []
 
             # 验证预期结果是否为列表
             if not isinstance(test_case["expected_results"], list):
-                logger.warning(f"测试用例预期结果不是列表: {test_case.get('id', 'unknown')}")
+                logger.warning(f"测试用例预期结果不是列表: {case_id}")
                 test_case["expected_results"] = [test_case["expected_results"]] if test_case["expected_results"] else []
 
             return True
@@ -637,75 +625,27 @@ class TestCaseWriterAgent:
 
     def _parse_string_feedback(self, feedback: str) -> Dict:
         """从字符串格式的反馈中提取结构化的审查评论。"""
-        review_comments = {
-            "completeness": [],
-            "clarity": [],
-            "executability": [],
-            "boundary_cases": [],
-            "error_scenarios": []
-        }
-
         if not feedback:
-            return review_comments
-
-        # 解析反馈内容
-        feedback_sections = [line.strip() for line in feedback.split('\n') if line.strip()]
-        current_section = None
-
-        # 提取各个方面的改进建议
-        for line in feedback_sections:
-            # 识别章节标题
-            section_mapping = {
-                '1. 完整性': 'completeness',
-                '2. 清晰度': 'clarity',
-                '3. 可执行性': 'executability',
-                '4. 边界情况': 'boundary_cases',
-                '5. 错误场景': 'error_scenarios'
-            }
+            return {category: [] for category in FEEDBACK_SECTIONS.values()}
+        return parse_feedback_sections(feedback)
 
-            for title, section in section_mapping.items():
-                if title in line:
-                    current_section = section
-                    break
+    def _generate_feature_test_cases(self, feature: str, feature_items: List[Dict], priority_info: str,
+                                     approach_info: str) -> List[Dict]:
+        """为单个功能点生成测试用例。
 
-            # 提取建议内容
-            if current_section and (line.startswith('-') or line.startswith('•')):
-                content = line[1:].strip()
-                if content:  # 确保内容不为空
-                    review_comments[current_section].append(content)
-
-        return review_comments
-
-    def _generate_feature_test_cases(self, feature: str, feature_items: List[Dict], priorities: List[Dict],
-                                     test_approach: Dict) -> List[Dict]:
-        """为单个功能点生成测试用例。"""
+        Args:
+            feature: 功能点名称
+            feature_items: 该功能点在测试覆盖矩阵中的条目
+            priority_info: 预先构建的测试优先级信息
+            approach_info: 预先构建的测试方法信息
+        """
+        user_proxy = self._acquire_user_proxy()
         try:
-            user_proxy = autogen.UserProxyAgent(
-                name="user_proxy",
-                system_message="测试策略提供者",
-                human_input_mode="NEVER",
-                code_execution_config={"use_docker": False}
-            )
 
             # 构建功能点特定的提示信息
-            coverage_info = f"\n功能点 '{feature}' 的测试覆盖:\n"
-            for item in feature_items:
-                test_type = item.get('test_type', '')
-                coverage_info += f"- 测试类型: {test_type}\n"
-
-            # 构建优先级信息
-            priority_info = "\n测试优先级:\n"
-            for item in priorities:
-                priority_info += f"- {item.get('level', '')}: {item.get('description', '')}\n"
-
-            # 构建测试方法信息
-            approach_info = "\n测试方法:\n"
-            if isinstance(test_approach, dict):
-                for key, value in test_approach.items():
-                    if isinstance(value, list):
-                        approach_info += f"- {key}: {', '.join(value)}\n"
-                    else:
-                        approach_info += f"- {key}: {value}\n"
+            coverage_info = f"\n功能点 '{feature}' 的测试覆盖:\n" + "".join(
+                f"- 测试类型: {item.get('test_type', '')}\n" for item in feature_items
+            )
 
             # 生成功能点特定的测试用例
             prompt = f"""请为功能点 '{feature}' 创建详细的测试用例：
@@ -810,6 +750,8 @@ class TestCaseWriterAgent:
         except Exception as e:
             logger.error(f"为功能点 '{feature}' 生成测试用例时出错: {str(e)}")
             return []
+        finally:
+            self._release_user_proxy(user_proxy)
 
     def _validate_coverage(self, test_cases: List[Dict], coverage_matrix: List[Dict]) -> None:
         """验证测试用例是否与测试覆盖矩阵对应。"""
@@ -830,13 +772,7 @@ class TestCaseWriterAgent:
                 feature_type_map[feature].add(test_type)
 
         # 检查每个功能点是否被测试用例覆盖
-        covered_features = set()
-        for tc in test_cases:
-            # 从测试用例标题中提取可能的功能点
-            title = tc.get('title', '').lower()
-            for feature in feature_type_map.keys():
-                if feature.lower() in title:
-                    covered_features.add(feature)
+        covered_features = _find_covered_features(test_cases, feature_type_map.keys())
 
         # 记录覆盖情况
         logger.info(f"测试覆盖矩阵测试点总数: {len(feature_type_map)}")
@@ -876,16 +812,17 @@ class TestCaseWriterAgent:
         except Exception as e:
             logger.error(f"删除临时测试用例文件时出错: {str(e)}")
 
-    def delete_improved_batch_files(self) -> None:
+    @classmethod
+    def delete_improved_batch_files(cls, output_dir: str = "agent_results") -> None:
         """删除测试用例改进过程中生成的临时批次文件。
-        在测试用例导出到Excel后调用此函数清理中间文件。
+        在测试用例导出到Excel后调用此函数清理中间文件，无需创建代理实例。
+
+        Args:
+            output_dir: 保存Agent结果的目录，默认为'agent_results'
         """
         try:
-            import os
-            import glob
-
             # 查找所有改进批次的临时文件
-            pattern = os.path.join(self.agent_io.output_dir, "test_case_writer_improved_batch_*_result.json")
+            pattern = os.path.join(output_dir, "test_case_writer_improved_batch_*_result.json")
             batch_files = glob.glob(pattern)
 
             # 删除找到的所有批次文件
@@ -901,101 +838,97 @@ class TestCaseWriterAgent:
         except Exception as e:
             logger.error(f"删除临时改进批次文件时出错: {str(e)}")
 
-    def _generate_feature_test_cases_concurrent(self, feature_groups: Dict, priorities: List[Dict],
-                                                test_approach: Dict) -> List[Dict]:
-        """使用并发方式为多个功能点生成测试用例。
-        根据concurrent_workers参数控制并发数。
+    def _generate_feature_with_checkpoint(self, feature_index: int, total_features: int, feature: str,
+                                          feature_items: List[Dict], priority_info: str,
+                                          approach_info: str) -> List[Dict]:
+        """为单个功能点生成测试用例，并保存该功能点的中间结果。
+
+        Args:
+            feature_index: 功能点序号，从1开始，用于命名中间结果文件
+            total_features: 功能点总数
+            feature: 功能点名称
+            feature_items: 该功能点在测试覆盖矩阵中的条目
+            priority_info: 预先构建的测试优先级信息
+            approach_info: 预先构建的测试方法信息
         """
-        if not feature_groups:
-            logger.warning("没有功能点需要处理")
+        logger.info(f"开始为功能点 '{feature}' 生成测试用例 ({feature_index}/{total_features})")
+
+        # 为单个功能点生成测试用例
+        feature_test_cases = self._generate_feature_test_cases(
+            feature=feature,
+            feature_items=feature_items,
+            priority_info=priority_info,
+            approach_info=approach_info
+        )
+
+        if not feature_test_cases:
+            logger.warning(f"功能点 '{feature}' 未能生成有效的测试用例")
             return []
 
-        # 确定批次大小和批次数
-        total_features = len(feature_groups)
-        # 根据并发工作线程数确定批次数，每个工作线程至少处理一个批次
-        num_batches = min(total_features, self.concurrent_workers * 2)  # 每个工作线程处理约2个批次
-        batch_size = max(1, total_features // num_batches)  # 确保每批至少有1个功能点
+        logger.info(f"功能点 '{feature}' 生成了 {len(feature_test_cases)} 个测试用例")
 
-        # 将功能点分成批次
-        feature_items = list(feature_groups.items())
-        batches = [feature_items[i:i + batch_size] for i in range(0, total_features, batch_size)]
-        logger.info(
-            f"将{total_features}个功能点分成{len(batches)}批进行处理，每批约{batch_size}个功能点，并发工作线程数: {self.concurrent_workers}")
+        # 保存中间结果，防止因超时丢失数据
+        temp_result = {
+            "test_cases": feature_test_cases,  # 只保存当前功能点的测试用例
+            "generation_date": self._get_current_timestamp(),
+            "generation_status": "in_progress",
+            "feature_progress": f"{feature_index}/{total_features}"
+        }
 
-        # 使用线程池并发处理功能点
-        all_test_cases = []
-        import concurrent.futures
+        def _save():
+            try:
+                self.agent_io.save_result(f"test_case_writer_feature_{feature_index}", temp_result)
+                logger.info(f"已保存功能点 '{feature}' 的测试用例生成结果")
+            except Exception as e:
+                logger.error(f"保存功能点 '{feature}' 的测试用例生成结果时出错: {str(e)}")
 
-        # 定义批处理函数
-        def process_batch(batch_index, batch_features):
-            logger.info(f"开始处理第{batch_index + 1}批功能点，共{len(batch_features)}个")
-            batch_test_cases = []
-
-            for i, (feature, items) in enumerate(batch_features):
-                logger.info(
-                    f"开始为功能点 '{feature}' 生成测试用例 (批次{batch_index + 1}，功能点{i + 1}/{len(batch_features)})")
-
-                # 为单个功能点生成测试用例
-                feature_test_cases = self._generate_feature_test_cases(
-                    feature=feature,
-                    feature_items=items,
-                    priorities=priorities,
-                    test_approach=test_approach
-                )
+        self._pending_writes.append(self._io_pool.submit(_save))
+        return feature_test_cases
 
-                if feature_test_cases:
-                    batch_test_cases.extend(feature_test_cases)
-                    logger.info(f"功能点 '{feature}' 生成了 {len(feature_test_cases)} 个测试用例")
+    def _flush_writes(self) -> None:
+        """等待所有已提交的中间结果写入完成。"""
+        pending, self._pending_writes = self._pending_writes, []
+        concurrent.futures.wait(pending)
 
-                    # 保存中间结果，防止因超时丢失数据
-                    feature_index = batch_index * batch_size + i + 1
-                    temp_result = {
-                        "test_cases": feature_test_cases,  # 只保存当前功能点的测试用例
-                        "generation_date": self._get_current_timestamp(),
-                        "generation_status": "in_progress",
-                        "feature_progress": f"{feature_index}/{total_features}"
-                    }
-                    try:
-                        self.agent_io.save_result(f"test_case_writer_feature_{feature_index}", temp_result)
-                        logger.info(f"已保存功能点 '{feature}' 的测试用例生成结果")
-                    except Exception as e:
-                        logger.error(f"保存功能点 '{feature}' 的测试用例生成结果时出错: {str(e)}")
-                else:
-                    logger.warning(f"功能点 '{feature}' 未能生成有效的测试用例")
+    def close(self) -> None:
+        """等待中间结果写入完成后关闭后台写入线程，关闭后不能再生成测试用例。"""
+        self._flush_writes()
+        self._io_pool.shutdown(wait=True)
+
+    def _generate_feature_test_cases_concurrent(self, feature_groups: Dict, priority_info: str,
+                                                approach_info: str) -> List[Dict]:
+        """使用并发方式为多个功能点生成测试用例。
+        每个功能点作为一个独立任务，先全部提交到线程池再统一收集结果，
+        同时进行的LLM请求数由concurrent_workers参数控制。
+        """
+        if not feature_groups:
+            logger.warning("没有功能点需要处理")
+            return []
 
-            logger.info(f"第{batch_index + 1}批功能点处理完成，共生成{len(batch_test_cases)}个测试用例")
-            return batch_test_cases
+        total_features = len(feature_groups)
+        logger.info(f"将{total_features}个功能点提交到线程池并发处理，并发工作线程数: {self.concurrent_workers}")
 
-        # 使用线程池执行器并发处理批次
-        batch_results = []  # 初始化为空列表，而不是[None] * len(batches)
+        # 按功能点顺序存放结果，保证合并后的测试用例顺序与顺序处理时一致
+        feature_results: List[List[Dict]] = [[] for _ in range(total_features)]
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrent_workers) as executor:
-            # 提交所有批次任务
-            future_to_batch = {executor.submit(process_batch, i, batch): i for i, batch in enumerate(batches)}
+            # 先提交所有功能点任务，工作线程空闲时立即开始下一个功能点
+            future_to_index = {
+                executor.submit(
+                    self._generate_feature_with_checkpoint,
+                    i + 1, total_features, feature, items, priority_info, approach_info
+                ): i
+                for i, (feature, items) in enumerate(feature_groups.items())
+            }
 
-            # 收集结果但不立即合并
-            for future in concurrent.futures.as_completed(future_to_batch):
-                batch_index = future_to_batch[future]
+            # 再统一收集结果
+            for future in concurrent.futures.as_completed(future_to_index):
+                index = future_to_index[future]
                 try:
-                    batch_result = future.result()
-                    # 确保batch_results有足够的元素
-                    while len(batch_results) <= batch_index:
-                        batch_results.append(None)
-                    batch_results[batch_index] = batch_result  # 存储批次结果
-                    logger.info(f"第{batch_index + 1}批测试用例处理完成并保存")
+                    feature_results[index] = future.result()
                 except Exception as e:
-                    logger.error(f"处理第{batch_index + 1}批测试用例时出错: {str(e)}")
-                    # 如果处理失败，使用原始批次
-                    # 确保batch_results有足够的元素
-                    while len(batch_results) <= batch_index:
-                        batch_results.append(None)
-                    batch_results[batch_index] = batches[batch_index]
-
-        # 所有批次处理完成后，统一合并结果
-        for batch_result in batch_results:
-            if batch_result:
-                all_test_cases.extend(batch_result)
-        logger.info(f"所有批次测试用例结果已合并完成")
+                    logger.error(f"处理第{index + 1}个功能点时出错: {str(e)}")
 
+        all_test_cases = [tc for feature_test_cases in feature_results for tc in feature_test_cases]
         logger.info(f"所有测试用例处理完成，共生成{len(all_test_cases)}个测试用例")
         return all_test_cases
 
@@ -1146,7 +1079,6 @@ class TestCaseWriterAgent:
 
         # 使用线程池并发处理测试用例
         all_improved_cases = []
-        import concurrent.futures
 
         # 定义批处理函数
         def process_improvement_batch(batch_index, batch_cases):
@@ -6,6 +6,7 @@
 """
 import re
 
+import functools
 import logging
 from pathlib import Path
 from typing import List
@@ -13,9 +14,46 @@ import pandas as pd
 import os
 from ..models.template import Template
 
+try:
+    import xlsxwriter
+except ImportError:  # 未安装xlsxwriter时回退到openpyxl引擎
+    xlsxwriter = None
+
 
 logger = logging.getLogger(__name__)
 
+# 标准列与测试用例字段的映射：(列名, 字段名, 默认值, 是否为需要按行拼接的列表字段)
+_STANDARD_FIELDS = (
+    ('ID', 'id', '', False),
+    ('Title', 'title', '', False),
+    ('Description', 'description', '', False),
+    ('Preconditions', 'preconditions', [], True),
+    ('Steps', 'steps', [], True),
+    ('Expected Results', 'expected_results', [], True),
+    ('Priority', 'priority', '', False),
+    ('Category', 'category', '', False),
+    ('Status', 'status', 'Draft', False),
+    ('Created At', 'created_at', '', False),
+    ('Updated At', 'updated_at', '', False),
+    ('Created By', 'created_by', '', False),
+    ('Last Updated By', 'last_updated_by', '', False),
+)
+_STANDARD_COLUMNS = tuple(col for col, _, _, _ in _STANDARD_FIELDS)
+_STANDARD_FIELD_SPECS = tuple((key, default, joined) for _, key, default, joined in _STANDARD_FIELDS)
+
+
+def _cell_value(value):
+    """
+    转换单元格的值，xlsxwriter无法直接写入列表、字典等非标量值（如列表类型的自定义字段），转换为字符串
+    :param value: 单元格的值
+    :return: 可以写入单元格的值
+    """
+    if isinstance(value, (list, tuple, set)):
+        return '\n'.join(map(str, value))
+    if isinstance(value, dict):
+        return str(value)
+    return value
+
 
 class ExportService:
     """
@@ -67,7 +105,20 @@ class ExportService:
     async def export_to_excel(self,
                               test_cases: List,
                               template: Template,
-                              output_path: str) -> str:
+                              output_path: str | os.PathLike) -> str:
+        return self.export_to_excel_sync(test_cases, template, output_path)
+
+    def export_to_excel_sync(self,
+                             test_cases: List,
+                             template: Template,
+                             output_path: str | os.PathLike) -> str:
+        """
+        同步导出测试用例到Excel，不依赖事件循环，可在线程中并行执行
+        :param test_cases:
+        :param template:
+        :param output_path:
+        :return: 导出文件路径
+        """
         try:
             # 验证输出路径
             path = Path(output_path)
@@ -141,49 +192,27 @@ class ExportService:
         :param template:
         :return:
         """
+        # 列与字段的映射在循环外确定，循环内只做取值
+        custom_fields = tuple(f for f in template.custom_fields if f not in _STANDARD_COLUMNS)
+        columns = [*_STANDARD_COLUMNS, *custom_fields]
+
         data = []
         for test_case in test_cases:
-            # 检查test_case是否为字典类型
+            # 字典类型的测试用例按键取值，TestCase对象按属性取值
             if isinstance(test_case, dict):
-                # 如果是字典类型，直接使用字典的值
-                row = {
-                    'ID': test_case.get('id', ''),
-                    'Title': test_case.get('title', ''),
-                    'Description': test_case.get('description', ''),
-                    'Preconditions': '\n'.join(test_case.get('preconditions', [])),
-                    'Steps': '\n'.join(test_case.get('steps', [])),
-                    'Expected Results': '\n'.join(test_case.get('expected_results', [])),
-                    'Priority': test_case.get('priority', ''),
-                    'Category': test_case.get('category', ''),
-                    'Status': test_case.get('status', 'Draft'),
-                    'Created At': test_case.get('created_at', ''),
-                    'Updated At': test_case.get('updated_at', ''),
-                    'Created By': test_case.get('created_by', ''),
-                    'Last Updated By': test_case.get('last_updated_by', '')
-                }
+                get = test_case.get
             else:
-                # 如果是TestCase对象，使用对象的属性
-                row = {
-                    'ID': getattr(test_case, 'id', ''),
-                    'Title': getattr(test_case, 'title', ''),
-                    'Description': getattr(test_case, 'description', ''),
-                    'Preconditions': '\n'.join(getattr(test_case, 'preconditions', [])),
-                    'Steps': '\n'.join(getattr(test_case, 'steps', [])),
-                    'Expected Results': '\n'.join(getattr(test_case, 'expected_results', [])),
-                    'Priority': getattr(test_case, 'priority', ''),
-                    'Category': getattr(test_case, 'category', ''),
-                    'Status': getattr(test_case, 'status', 'Draft'),
-                    'Created At': getattr(test_case, 'created_at', ''),
-                    'Updated At': getattr(test_case, 'updated_at', ''),
-                    'Created By': getattr(test_case, 'created_by', ''),
-                    'Last Updated By': getattr(test_case, 'last_updated_by', '')
-                }
+                get = functools.partial(getattr, test_case)
+
+            row = [
+                '\n'.join(get(key, default)) if joined else get(key, default)
+                for key, default, joined in _STANDARD_FIELD_SPECS
+            ]
             # 添加自定义字段
-            for field in template.custom_fields:
-                row[field] = getattr(test_case, field, '')
+            row.extend(get(f, '') for f in custom_fields)
             data.append(row)
 
-        return pd.DataFrame(data)
+        return pd.DataFrame(data, columns=columns)
 
     def _apply_template_style(self,
                               df: pd.DataFrame,
@@ -225,12 +254,65 @@ class ExportService:
 
         return df
 
+    def _column_width(self, df: pd.DataFrame, col: str, template: Template | None = None) -> int:
+        """
+        计算列宽：优先使用模板中定义的宽度，否则按内容自动调整
+        :param df:
+        :param col:
+        :param template:
+        :return:
+        """
+        # 如果模板中定义了该列的宽度，则使用模板中定义的宽度
+        if template and col in template.column_widths:
+            return template.column_widths[col]
+        # 否则自动调整列宽
+        max_length = max(
+            df[col].astype(str).map(len).max(),
+            len(col)
+        )
+        # 设置最小和最大列宽
+        return min(max(max_length + 2, 10), 50)
+
     def _save_to_excel(self,
                        df: pd.DataFrame,
                        path: Path,
                        template: Template | None = None):
         """
         将DataFrame导出到Excel
+        使用xlsxwriter的constant_memory模式逐行写出，写完的行立即落盘，内存占用不随行数增长
+        :param df:
+        :param path:
+        :param template:
+        :return:
+        """
+        if xlsxwriter is None:
+            self._save_to_excel_openpyxl(df, path, template)
+            return
+
+        df = df.fillna('')
+        workbook = xlsxwriter.Workbook(str(path), {'constant_memory': True, 'strings_to_urls': False})
+        try:
+            worksheet = workbook.add_worksheet('Test Cases')
+            # 格式对象只创建一次，在所有行之间复用
+            header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+
+            # 应用列宽
+            for idx, col in enumerate(df.columns):
+                worksheet.set_column(idx, idx, self._column_width(df, col, template))
+
+            # constant_memory模式要求按行号递增的顺序写入
+            worksheet.write_row(0, 0, list(df.columns), header_format)
+            for row_idx, row in enumerate(df.itertuples(index=False, name=None), start=1):
+                worksheet.write_row(row_idx, 0, [_cell_value(value) for value in row])
+        finally:
+            workbook.close()
+
+    def _save_to_excel_openpyxl(self,
+                                df: pd.DataFrame,
+                                path: Path,
+                                template: Template | None = None):
+        """
+        使用openpyxl引擎将DataFrame导出到Excel
         :param df:
         :param path:
         :param template:
@@ -242,15 +324,4 @@ class ExportService:
             # 应用列宽
             worksheet = writer.sheets['Test Cases']
             for idx, col in enumerate(df.columns):
-                # 如果模板中定义了该列的宽度，则使用模板中定义的宽度
-                if template and col in template.column_widths:
-                    worksheet.column_dimensions[chr(65 + idx)].width = template.column_widths[col]
-                else:
-                    # 否则自动调整列宽
-                    max_length = max(
-                        df[col].astype(str).map(len).max(),
-                        len(col)
-                    )
-                    # 设置最小和最大列宽
-                    adjusted_width = min(max(max_length + 2, 10), 50)
-                    worksheet.column_dimensions[chr(65 + idx)].width = adjusted_width
+                worksheet.column_dimensions[chr(65 + idx)].width = self._column_width(df, col, template)
@@ -4,13 +4,19 @@
 # @File: agent_io.py
 # @Date: 2025/8/26 15:40
 """
-import json
 import os
+import copy
 import logging
-from typing import Dict, List, Optional, Any
+from typing import Dict, Optional, Any, Tuple
+
+from src.utils import json_codec
 
 logger = logging.getLogger(__name__)
 
+# 已加载结果的内存缓存：文件路径 -> (修改时间, 结果)，文件未变化时不再重复读取和解析
+# 缓存中的对象不直接交给调用方，每次返回副本，避免调用方修改结果后污染缓存
+_cache: Dict[str, Tuple[float, Any]] = {}
+
 
 class AgentIO:
     """AgentIO结果的序列化和番序列化
@@ -45,10 +51,15 @@ class AgentIO:
                     return obj.dict()
                 if hasattr(obj, 'model_dump') and callable(getattr(obj, 'model_dump')):
                     return obj.model_dump()
+                # numpy数组/标量（orjson可直接序列化，这里兼容标准库json）
+                if hasattr(obj, 'tolist') and callable(getattr(obj, 'tolist')):
+                    return obj.tolist()
                 raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
 
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2, default=pydantic_encoder)
+            with open(file_path, 'wb') as f:
+                f.write(json_codec.dumps(result, default=pydantic_encoder))
+            # 文件已更新，丢弃旧的缓存
+            _cache.pop(file_path, None)
             logger.info(f"已保存{agent_name}的执行结果到{file_path}")
             return file_path
         except Exception as e:
@@ -67,11 +78,37 @@ class AgentIO:
             return None
 
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                result = json.load(f)
+            mtime = os.path.getmtime(file_path)
+            cached = _cache.get(file_path)
+            if cached is not None and cached[0] == mtime:
+                return copy.deepcopy(cached[1])
+
+            result = json_codec.load_file(file_path)
+            _cache[file_path] = (mtime, result)
             logger.info(f"已加载{agent_name}的执行结果")
-            return result
+            return copy.deepcopy(result)
         except Exception as e:
             logger.error(f"加载{agent_name}结果时出错: {str(e)}")
             return None
 
+    def delete_result(self, agent_name: str) -> bool:
+        """
+        删除指定Agent的结果文件
+        :param agent_name: Agent的名称，用于查找文件
+        :return: 文件存在并已删除时返回True
+        """
+        file_path = os.path.join(self.output_dir, f"{agent_name}_result.json")
+        _cache.pop(file_path, None)
+        try:
+            os.remove(file_path)
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"删除{agent_name}结果时出错: {str(e)}")
+            return False
+
+
+
+# 模块级共享实例，供只需读写默认目录的调用方复用
+AGENT_IO = AgentIO()
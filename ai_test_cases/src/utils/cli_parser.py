@@ -6,6 +6,7 @@
 """
 
 import argparse
+import functools
 import os
 from pathlib import Path
 import logging
@@ -93,7 +94,12 @@ class CLIParser:
         return args
 
 
+@functools.lru_cache(maxsize=1)
+def _build_parser() -> CLIParser:
+    """构建命令行参数解析器，只在首次调用时创建"""
+    return CLIParser()
+
+
 def get_cli_args():
     """获取命令行参数的便捷函数"""
-    parser = CLIParser()
-    return parser.parse_args()
+    return _build_parser().parse_args()
@@ -0,0 +1,56 @@
+"""
+# -*- coding:utf-8 -*-
+# @Author: Beck
+# @File: json_codec.py
+# @Date: 2026/10/15 10:12
+"""
+
+import json
+from typing import Any, Callable, Optional
+
+try:
+    import orjson
+except ImportError:  # 未安装orjson时回退到标准库json
+    orjson = None
+
+
+def loads(data: bytes | str) -> Any:
+    """
+    解析JSON数据，优先使用orjson
+    :param data: JSON字节串或字符串
+    :return: 解析后的对象
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any, default: Optional[Callable] = None, indent: bool = True, sort_keys: bool = False) -> bytes:
+    """
+    将对象序列化为UTF-8编码的JSON字节串，优先使用orjson
+    :param obj: 要序列化的对象
+    :param default: 无法直接序列化的对象的转换函数
+    :param indent: 是否使用两个空格缩进，不缩进时输出紧凑格式
+    :param sort_keys: 是否按键排序输出
+    :return: JSON字节串
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=default, option=option)
+    # 不缩进时使用紧凑分隔符，与orjson的输出保持一致
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None, default=default,
+                      separators=None if indent else (',', ':'), sort_keys=sort_keys).encode('utf-8')
+
+
+def load_file(file_path: str) -> Any:
+    """
+    以二进制方式读取并解析JSON文件
+    :param file_path: 文件路径
+    :return: 解析后的对象
+    """
+    with open(file_path, 'rb') as f:
+        return loads(f.read())
@@ -0,0 +1,278 @@
+"""
+# -*- coding:utf-8 -*-
+# @Author: Beck
+# @File: llm_cache.py
+# @Date: 2026/10/15 14:20
+"""
+import copy
+import hashlib
+import logging
+import math
+import os
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from src.utils import json_codec
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCache:
+    """LLM响应的内存缓存
+
+    以(代理角色, 输入内容)的哈希作为键缓存代理的执行结果，相同输入再次执行时直接返回缓存，
+    避免重复的LLM调用。缓存项超过ttl秒后失效，数量超过maxsize时淘汰最久未使用的项。
+    maxsize或ttl小于等于0时不启用。
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: float = 3600):
+        """初始化LLM缓存
+
+        Args:
+            maxsize: 最多缓存的结果数量
+            ttl: 缓存有效期(秒)，小于等于0时不缓存
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0}
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用缓存"""
+        return self.maxsize > 0 and self.ttl > 0
+
+    @staticmethod
+    def cache_key(role: str, message: Any) -> str:
+        """
+        计算缓存键
+        :param role: 代理角色名
+        :param message: 代理的输入内容
+        :return: sha256十六进制摘要
+        """
+        payload = json_codec.dumps({'role': role, 'msg': message}, default=str, indent=False, sort_keys=True)
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        读取缓存，返回结果的副本，避免调用方修改缓存内容
+        :param key: 缓存键
+        :return: 缓存的结果，未命中或已过期时返回None
+        """
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.stats['misses'] += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.stats['hits'] += 1
+        return copy.deepcopy(item[1])
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        写入缓存
+        :param key: 缓存键
+        :param value: 要缓存的结果
+        :return:
+        """
+        if not self.enabled:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._data.clear()
+
+
+class SimilarityCache:
+    """按文本相似度匹配的结果缓存
+
+    用字符三元组的词频向量表示文本，查找时返回余弦相似度不低于阈值且最相似的缓存结果，
+    使内容相近（如仅有措辞差异）的需求文档可以复用之前的结果。阈值不在(0, 1]范围内时不启用。
+    """
+
+    def __init__(self, threshold: float = 0.0, maxsize: int = 64):
+        """初始化相似度缓存
+
+        Args:
+            threshold: 命中所需的最低余弦相似度
+            maxsize: 最多缓存的结果数量，超过时淘汰最久未使用的项
+        """
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[Counter, float, Any]]" = OrderedDict()
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0}
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用相似度缓存"""
+        return 0 < self.threshold <= 1 and self.maxsize > 0
+
+    @staticmethod
+    def _vectorize(text: str) -> Tuple[Counter, float]:
+        """将文本转换为字符三元组词频向量及其模长"""
+        grams = Counter(text[i:i + 3] for i in range(max(len(text) - 2, 1)))
+        return grams, math.sqrt(sum(v * v for v in grams.values()))
+
+    @staticmethod
+    def _cosine(a: Tuple[Counter, float], b: Tuple[Counter, float]) -> float:
+        """计算两个向量的余弦相似度"""
+        (grams_a, norm_a), (grams_b, norm_b) = a, b
+        if not norm_a or not norm_b:
+            return 0.0
+        if len(grams_a) > len(grams_b):
+            grams_a, grams_b = grams_b, grams_a
+        return sum(v * grams_b.get(k, 0) for k, v in grams_a.items()) / (norm_a * norm_b)
+
+    def get(self, text: str) -> Optional[Any]:
+        """
+        查找与文本最相似的缓存结果
+        :param text: 查询文本
+        :return: 缓存结果的副本，没有足够相似的结果时返回None
+        """
+        # 完全相同的文本直接命中，不受浮点误差影响（阈值为1时余弦值可能略小于1）
+        best_key, best_score = hashlib.sha256(text.encode('utf-8')).hexdigest(), 1.0
+        if best_key not in self._data:
+            vector = self._vectorize(text)
+            best_key, best_score = None, self.threshold
+            for key, (grams, norm, _) in self._data.items():
+                score = self._cosine(vector, (grams, norm))
+                if score >= best_score:
+                    best_key, best_score = key, score
+
+        if best_key is None:
+            self.stats['misses'] += 1
+            return None
+
+        self._data.move_to_end(best_key)
+        self.stats['hits'] += 1
+        logger.info(f"相似度缓存命中，相似度: {best_score:.3f}")
+        return copy.deepcopy(self._data[best_key][2])
+
+    def set(self, text: str, value: Any) -> None:
+        """
+        写入缓存
+        :param text: 文本
+        :param value: 要缓存的结果
+        :return:
+        """
+        if not self.enabled:
+            return
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        grams, norm = self._vectorize(text)
+        self._data[key] = (grams, norm, copy.deepcopy(value))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class ResultCache:
+    """基于AgentIO的持久化结果缓存
+
+    以输入内容的哈希作为键，将结果保存为AgentIO输出目录中的{prefix}_{key}结果文件，进程重启后仍然有效。
+    过期的缓存文件在读取或写入缓存时删除。对外只提供lookup/update两个方法，以后可以替换为LRU或Redis等其他后端。
+    """
+
+    def __init__(self, agent_io, prefix: str, ttl: float = 0):
+        """初始化持久化结果缓存
+
+        Args:
+            agent_io: 用于读写结果文件的AgentIO实例
+            prefix: 缓存文件名前缀
+            ttl: 缓存有效期(秒)，小于等于0时不缓存(默认)
+        """
+        self.agent_io = agent_io
+        self.prefix = prefix
+        self.ttl = ttl
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def cache_key(data: Any) -> str:
+        """
+        计算缓存键
+        :param data: 输入内容
+        :return: sha256十六进制摘要
+        """
+        return hashlib.sha256(json_codec.dumps(data, default=str, indent=False, sort_keys=True)).hexdigest()
+
+    def lookup(self, key: str) -> Optional[Any]:
+        """
+        读取缓存
+        :param key: 缓存键
+        :return: 缓存结果的副本，未命中或已过期时返回None
+        """
+        name = f"{self.prefix}_{key}"
+        # 先检查文件是否存在，避免未命中时load_result输出找不到文件的警告
+        if self.ttl <= 0 or not os.path.exists(os.path.join(self.agent_io.output_dir, f"{name}_result.json")):
+            self.stats['misses'] += 1
+            return None
+
+        entry = self.agent_io.load_result(name)
+        if not isinstance(entry, dict) or 'value' not in entry or time.time() - entry.get('cached_at', 0) > self.ttl:
+            # 过期或内容无效的缓存不会再被使用，直接删除
+            self.agent_io.delete_result(name)
+            self.stats['misses'] += 1
+            return None
+
+        self.stats['hits'] += 1
+        return copy.deepcopy(entry['value'])
+
+    def update(self, key: str, value: Any) -> None:
+        """
+        写入缓存
+        :param key: 缓存键
+        :param value: 要缓存的结果
+        :return:
+        """
+        if self.ttl <= 0:
+            return
+        self.purge_expired()
+        try:
+            self.agent_io.save_result(f"{self.prefix}_{key}", {'cached_at': time.time(), 'value': value})
+        except Exception as e:
+            logger.warning(f"写入结果缓存时出错: {str(e)}")
+
+    def purge_expired(self) -> int:
+        """
+        删除输出目录中已过期的缓存文件，按文件修改时间判断是否过期
+        :return: 删除的文件数量
+        """
+        prefix, suffix = f"{self.prefix}_", "_result.json"
+        deadline = time.time() - self.ttl
+        removed = 0
+        try:
+            with os.scandir(self.agent_io.output_dir) as entries:
+                expired = [
+                    entry.name[:-len(suffix)] for entry in entries
+                    if entry.name.startswith(prefix) and entry.name.endswith(suffix)
+                    and entry.stat().st_mtime < deadline
+                ]
+        except OSError as e:
+            logger.warning(f"清理过期结果缓存时出错: {str(e)}")
+            return 0
+
+        for name in expired:
+            removed += self.agent_io.delete_result(name)
+        if removed:
+            logger.info(f"已删除{removed}个过期的结果缓存")
+        return removed
+
+
+# 模块级共享实例，多次运行工作流程时复用缓存
+# 默认不启用，避免重复运行时静默返回旧的结果，设置LLM_CACHE_SIZE(如512)后启用
+LLM_CACHE = LLMCache(
+    maxsize=int(os.getenv("LLM_CACHE_SIZE", "0")),
+    ttl=float(os.getenv("LLM_CACHE_TTL", "3600"))
+)
+
+# 需求分析的相似度缓存，默认不启用，设置LLM_SIMILARITY_THRESHOLD(如0.92)后启用
+SIMILARITY_CACHE = SimilarityCache(
+    threshold=float(os.getenv("LLM_SIMILARITY_THRESHOLD", "0")),
+    maxsize=int(os.getenv("LLM_SIMILARITY_CACHE_SIZE", "64"))
+)
@@ -0,0 +1,48 @@
+"""
+# -*- coding:utf-8 -*-
+# @Author: Beck
+# @File: review_feedback.py
+# @Date: 2026/10/15 23:20
+"""
+
+import re
+from typing import Dict, List
+
+# 文本反馈中的章节标题，如"1. 完整性"，与审查评论类别的映射
+FEEDBACK_SECTIONS = {
+    '1. 完整性': 'completeness',
+    '2. 清晰度': 'clarity',
+    '3. 可执行性': 'executability',
+    '4. 边界情况': 'boundary_cases',
+    '5. 错误场景': 'error_scenarios'
+}
+# 一次搜索即可识别行中的任一章节标题
+FEEDBACK_SECTION_RE = re.compile('|'.join(map(re.escape, FEEDBACK_SECTIONS)))
+# 以"-"或"•"开头的建议条目
+_BULLET_RE = re.compile(r'[-•]\s*(.+)')
+
+
+def parse_feedback_sections(feedback: str) -> Dict[str, List[str]]:
+    """
+    按章节标题解析文本格式的审查反馈，提取各类别下以"-"或"•"开头的改进建议
+    :param feedback: 审查反馈文本
+    :return: 各类别的改进建议
+    """
+    sections = {category: [] for category in FEEDBACK_SECTIONS.values()}
+    current_section = None
+
+    for line in feedback.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+
+        # 识别章节标题
+        match = FEEDBACK_SECTION_RE.search(line)
+        if match:
+            current_section = FEEDBACK_SECTIONS[match.group()]
+
+        # 提取建议内容
+        if current_section and (bullet := _BULLET_RE.match(line)):
+            sections[current_section].append(bullet.group(1))
+
+    return sections
@@ -14,8 +14,15 @@
 import os
 import json
 import logging
+
+import pytest
 from dotenv import load_dotenv
-from src.agents.test_case_writer import TestCaseWriterAgent
+from src.agents import test_case_writer
+from src.agents.test_case_writer import (
+    TestCaseWriterAgent, _find_covered_features, _format_approach_info, _format_priority_info
+)
+from src.utils.agent_io import AgentIO
+from src.utils.json_parser import UnifiedJSONParser
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -53,8 +60,8 @@ def test_generate_feature_test_cases():
     test_cases = writer._generate_feature_test_cases(
         feature=feature,
         feature_items=feature_items,
-        priorities=priorities,
-        test_approach=test_approach
+        priority_info=_format_priority_info(priorities),
+        approach_info=_format_approach_info(test_approach)
     )
 
     # 输出结果
@@ -67,6 +74,146 @@ def test_generate_feature_test_cases():
     return test_cases
 
 
+def _covered_features_per_feature(test_cases, features):
+    """逐个功能点匹配标题，单次扫描实现之前的查找方式"""
+    covered = set()
+    for tc in test_cases:
+        title = tc.get('title', '').lower()
+        for feature in features:
+            if feature.lower() in title:
+                covered.add(feature)
+    return covered
+
+
+# 覆盖检查的样例：(测试用例标题, 功能点名称)，None表示没有标题字段的测试用例
+_COVERAGE_SAMPLES = [
+    (['用户登录-正常流程', '修改密码为空'], ['用户登录', '修改密码', '导出报表']),
+    (['Login With SMS', None, 'logout'], ['login', 'LOGIN', 'Logout', 'export']),
+    (['导出报表'], ['', '导出', '报表', '导出报表', '打印']),
+    (['登录登录'], ['登录', '登']),
+    ([], ['登录']),
+    (['任意标题'], []),
+]
+
+
+@pytest.mark.parametrize('use_automaton', [True, False], ids=['ahocorasick', 'substring'])
+@pytest.mark.parametrize('titles, features', _COVERAGE_SAMPLES)
+def test_find_covered_features_matches_per_feature_scan(monkeypatch, use_automaton, titles, features):
+    """测试覆盖的功能点与逐个功能点匹配标题的结果一致，是否安装pyahocorasick结果都相同"""
+    if use_automaton and test_case_writer.ahocorasick is None:
+        pytest.skip("未安装pyahocorasick")
+    if not use_automaton:
+        monkeypatch.setattr(test_case_writer, 'ahocorasick', None)
+    test_cases = [{'id': 'TC999'} if title is None else {'title': title} for title in titles]
+    assert _find_covered_features(test_cases, features) == _covered_features_per_feature(test_cases, features)
+
+
+# 代理响应的样例，以及改为按字段正则解析前的解析结果
+_TEXT_RESPONSE = """ID: TC001
+Title: 登录
+测试正常登录
+Description: 验证登录
+Preconditions:
+- 已注册
+Steps:
+1. 打开页面
+2. 输入账号
+- 点击
+Expected Results:
+1. 成功
+Priority: 1
+Category: 功能测试
+id: TC002
+TITLE: 第二个
+Description: d
+Steps:
+- s
+Expected results:
+- e
+Priority: P2
+Category: c
+"""
+_PARSE_SAMPLES = [
+    (_TEXT_RESPONSE, [
+        {'id': 'TC001', 'title': '登录 测试正常登录', 'description': '验证登录', 'preconditions': ['已注册'],
+         'steps': ['打开页面', '输入账号', '点击'], 'expected_results': ['成功'], 'priority': 'P1',
+         'category': '功能测试'},
+        {'id': 'TC002', 'title': '第二个', 'description': 'd', 'preconditions': [], 'steps': ['s'],
+         'expected_results': ['e'], 'priority': 'P2', 'category': 'c'},
+    ]),
+    ("Title: 无ID\nDescription: x\nSteps:\n- a\nExpected Results:\n- b\nPriority: high\nCategory: 功能\n"
+     "ID: TC9\nTitle: bad\n", [
+        {'id': 'TC001', 'title': '无ID', 'description': 'x', 'preconditions': [], 'steps': ['a'],
+         'expected_results': ['b'], 'priority': 'high', 'category': '功能'},
+    ]),
+    ("随便的文本", []),
+    ("""```json
+{"test_cases": [
+  {"id": "TC001", "title": "登录", "description": "d", "preconditions": ["p"], "steps": "s",
+   "expected_results": ["e"], "priority": "1", "category": "功能测试"},
+  {"id": "TC002", "title": "缺字段"}
+]}
+```""", [
+        {'id': 'TC001', 'title': '登录', 'description': 'd', 'preconditions': ['p'], 'steps': ['s'],
+         'expected_results': ['e'], 'priority': 'P1', 'category': '功能测试'},
+    ]),
+]
+
+
+@pytest.mark.parametrize('message, expected', _PARSE_SAMPLES)
+def test_parse_test_cases_matches_previous_parser(message, expected):
+    """测试解析结果与改为按字段正则解析前的结果一致"""
+    writer = TestCaseWriterAgent.__new__(TestCaseWriterAgent)
+    writer.json_parser = UnifiedJSONParser()
+    writer._parse_json_cached = writer._parse_json_response
+    assert writer._parse_test_cases(message) == expected
+    # 字典格式的消息从content字段取出内容
+    assert writer._parse_test_cases({'content': message}) == expected
+
+
+
+# 审查反馈文本的样例，以及改为共用质量保证代理的解析逻辑前的解析结果
+_EMPTY_COMMENTS = {'completeness': [], 'clarity': [], 'executability': [], 'boundary_cases': [], 'error_scenarios': []}
+_FEEDBACK_SAMPLES = [
+    ("审查结果：\n1. 完整性\n- 补充前置条件\n-   缺少清理步骤\n-\n2. 清晰度\n• 步骤描述更具体\n"
+     "3. 可执行性 - 行内建议\n4. 边界情况\n- 空输入\n5. 错误场景\n- 网络中断\n普通文本",
+     dict(_EMPTY_COMMENTS, completeness=['补充前置条件', '缺少清理步骤'], clarity=['步骤描述更具体'],
+          boundary_cases=['空输入'], error_scenarios=['网络中断'])),
+    ("- 没有章节的建议\n", _EMPTY_COMMENTS),
+    ("", _EMPTY_COMMENTS),
+    ("### 1. 完整性：\r\n- 带回车的建议\r\n  - 缩进的建议\n",
+     dict(_EMPTY_COMMENTS, completeness=['带回车的建议', '缩进的建议'])),
+]
+
+
+@pytest.mark.parametrize('feedback, expected', _FEEDBACK_SAMPLES)
+def test_parse_string_feedback_matches_previous_parser(feedback, expected):
+    """测试审查反馈的解析结果与之前单独实现时的结果一致"""
+    writer = TestCaseWriterAgent.__new__(TestCaseWriterAgent)
+    assert writer._parse_string_feedback(feedback) == expected
+
+def test_generate_flushes_writes_on_failure(tmp_path):
+    """测试生成中途出错时也等待已提交的中间结果写入完成"""
+    writer = TestCaseWriterAgent()
+    writer.agent_io = AgentIO(str(tmp_path))
+    generated = iter([[{'id': 'TC001', 'title': '登录'}]])
+
+    def _generate_feature_test_cases(**kwargs):
+        # 第一个功能点生成成功，第二个功能点出错
+        return next(generated)
+
+    writer._generate_feature_test_cases = _generate_feature_test_cases
+    strategy = {'coverage_matrix': [{'feature': '登录', 'test_type': '功能测试'},
+                                    {'feature': '注册', 'test_type': '功能测试'}]}
+    try:
+        with pytest.raises(StopIteration):
+            writer.generate(strategy)
+        assert not writer._pending_writes
+        assert (tmp_path / "test_case_writer_feature_1_result.json").exists()
+    finally:
+        writer.close()
+
+
 def main():
     logger.info("开始测试测试用例生成功能")
     test_cases = test_generate_feature_test_cases()